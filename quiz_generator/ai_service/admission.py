@@ -0,0 +1,458 @@
+"""
+Admission Control
+Limits how much work of each kind the service runs at once, so a burst of
+minute-long exam generations cannot stall grading or exceed the LLM
+provider's rate limits:
+- each workflow (generation, grading) has its own concurrency limit and a
+  bounded queue; a request that finds the queue full is rejected right away
+- all workflows share ADMISSION_MAX_CONCURRENT slots; when one frees up,
+  waiting grading requests are admitted before waiting generations
+- token buckets cap LLM requests and tokens per minute. The budget is
+  enforced on every LLM call (see resilience.py), whichever path makes it:
+  requests, question bank refills, certificate polishing. A call takes one
+  request and its prompt's estimated tokens, waiting (within the request
+  deadline) while the buckets are empty, and is charged its actual tokens
+  when it returns. Admission only turns generations away early while the
+  buckets cannot cover their estimated usage; grading is never rejected for
+  LLM budget (its certificate calls are small).
+Rejections carry a Retry-After estimate (HTTP 429).
+
+Concurrency limits apply per worker process. With a shared backend
+(SHARED_BACKEND, see shared.py) the LLM budget is counted there in fixed
+one-minute windows, so all workers take from one budget; otherwise each
+worker gets an equal share of it.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Tuple, TypeVar, Union
+
+# Handle imports for both module and direct execution
+try:
+    from .metrics import ADMISSION_DECISIONS, ADMISSION_WAIT
+    from .deadlines import check_deadline, remaining_seconds, within_deadline
+    from .shared import SERVICE_WORKERS, SharedBackend, get_shared_backend, offload
+except ImportError:
+    from metrics import ADMISSION_DECISIONS, ADMISSION_WAIT
+    from deadlines import check_deadline, remaining_seconds, within_deadline
+    from shared import SERVICE_WORKERS, SharedBackend, get_shared_backend, offload
+
+T = TypeVar("T")
+
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))
+GENERATION_MAX_CONCURRENT = int(os.getenv("GENERATION_MAX_CONCURRENT", "8"))
+GENERATION_QUEUE_SIZE = int(os.getenv("GENERATION_QUEUE_SIZE", "32"))
+GRADING_MAX_CONCURRENT = int(os.getenv("GRADING_MAX_CONCURRENT", "64"))
+GRADING_QUEUE_SIZE = int(os.getenv("GRADING_QUEUE_SIZE", "256"))
+
+# Provider limits for the whole service (0: unlimited)
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+# Usage a generation needs available to be admitted
+GENERATION_ESTIMATED_LLM_CALLS = int(os.getenv("GENERATION_ESTIMATED_LLM_CALLS", "1"))
+GENERATION_ESTIMATED_TOKENS = int(os.getenv("GENERATION_ESTIMATED_TOKENS", "4000"))
+
+
+class Overloaded(Exception):
+    """The request was not admitted; retry after retry_after seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Refills at rate_per_minute up to one minute's worth. Charges may take the
+    level below zero (actual usage above the reservation); new reservations
+    then wait for the refill.
+    """
+
+    blocking = False
+
+    def __init__(self, rate_per_minute: float):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self._level = rate_per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Takes amount and returns 0, or returns the seconds until amount is available"""
+        with self._lock:
+            self._refill()
+            # More than the capacity is let through once the bucket is full
+            needed = min(amount, self.capacity)
+            if self._level >= needed:
+                self._level -= amount
+                return 0.0
+            return (needed - self._level) / self.rate_per_second
+
+    def charge(self, amount: float) -> None:
+        """Adds (or with a negative amount, refunds) usage"""
+        with self._lock:
+            self._refill()
+            self._level = min(self.capacity, self._level - amount)
+
+    def available_in(self, amount: float) -> float:
+        """Seconds until amount could be reserved (0: now)"""
+        with self._lock:
+            self._refill()
+            return max(min(amount, self.capacity) - self._level, 0.0) / self.rate_per_second
+
+    def level(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._level
+
+
+class SharedRateWindow:
+    """
+    Per-minute limit counted in a shared backend, so all workers take from
+    one budget. Usage is summed per fixed one-minute window with
+    SharedBackend.incr, and resets when the minute ends.
+    """
+
+    NAMESPACE = "llm_budget"
+
+    def __init__(self, name: str, limit_per_minute: float, backend: SharedBackend):
+        self.name = name
+        self.capacity = limit_per_minute
+        self.backend = backend
+        self.blocking = backend.blocking
+
+    def _window(self) -> Tuple[str, float]:
+        """Key of the current window and the seconds until it ends"""
+        now = time.time()
+        return f"{self.name}:{int(now // 60)}", 60.0 - now % 60
+
+    def _used(self, key: str) -> int:
+        return int(self.backend.get(self.NAMESPACE, key) or 0)
+
+    def reserve(self, amount: float) -> float:
+        """Takes amount and returns 0, or returns the seconds until the next window"""
+        key, ends_in = self._window()
+        used = self.backend.incr(self.NAMESPACE, key, math.ceil(amount), ttl_seconds=120)
+        # More than the capacity is let through in an unused window
+        if used <= self.capacity or used == math.ceil(amount):
+            return 0.0
+        self.backend.incr(self.NAMESPACE, key, -math.ceil(amount))
+        return ends_in
+
+    def charge(self, amount: float) -> None:
+        """Adds (or with a negative amount, refunds) usage in the current window"""
+        key, _ = self._window()
+        self.backend.incr(self.NAMESPACE, key, round(amount), ttl_seconds=120)
+
+    def available_in(self, amount: float) -> float:
+        key, ends_in = self._window()
+        used = self._used(key)
+        return 0.0 if used == 0 or used + amount <= self.capacity else ends_in
+
+    def level(self) -> float:
+        key, _ = self._window()
+        return self.capacity - self._used(key)
+
+
+# A TokenBucket, or a SharedRateWindow when workers share a backend
+RateLimit = Union[TokenBucket, SharedRateWindow]
+
+
+class LLMBudget:
+    """Per-minute LLM request and token limits, taken from by every LLM call"""
+
+    def __init__(self, request_bucket: Optional[RateLimit] = None, token_bucket: Optional[RateLimit] = None):
+        self.request_bucket = request_bucket
+        self.token_bucket = token_bucket
+        self.blocking = any(bucket is not None and bucket.blocking for bucket in (request_bucket, token_bucket))
+
+    async def _call(self, fn: Callable[..., T], *args: Any) -> T:
+        return await offload(fn, *args) if self.blocking else fn(*args)
+
+    def _buckets(self, calls: int, tokens: int) -> Tuple[Tuple[RateLimit, int], ...]:
+        return tuple(
+            (bucket, amount)
+            for bucket, amount in ((self.request_bucket, calls), (self.token_bucket, tokens))
+            if bucket is not None and amount > 0
+        )
+
+    def reserve(self, calls: int, tokens: int) -> float:
+        """Takes calls and tokens and returns 0, or takes nothing and returns the seconds until they are available"""
+        reservations = self._buckets(calls, tokens)
+        for i, (bucket, amount) in enumerate(reservations):
+            wait = bucket.reserve(amount)
+            if wait > 0:
+                for reserved_bucket, reserved in reservations[:i]:
+                    reserved_bucket.charge(-reserved)
+                return wait
+        return 0.0
+
+    def available_in(self, calls: int, tokens: int) -> float:
+        """Seconds until calls and tokens could be taken (0: now), without taking them"""
+        return max((bucket.available_in(amount) for bucket, amount in self._buckets(calls, tokens)), default=0.0)
+
+    def acquire(self, tokens: int) -> None:
+        """Takes one call and tokens for an LLM call, sleeping until the budget allows it (within the deadline)"""
+        while True:
+            wait = self.reserve(1, tokens)
+            if wait <= 0:
+                return
+            remaining = remaining_seconds()
+            time.sleep(min(wait, remaining) if remaining is not None else wait)
+            check_deadline("llm_budget")
+
+    async def aacquire(self, tokens: int) -> None:
+        """Async variant of acquire"""
+        while True:
+            wait = await self._call(self.reserve, 1, tokens)
+            if wait <= 0:
+                return
+            await within_deadline(asyncio.sleep(wait), "llm_budget")
+
+    def charge(self, calls: int, tokens: int) -> None:
+        """Adds usage (or with negative amounts, refunds it) once a call's outcome is known"""
+        for bucket, amount in ((self.request_bucket, calls), (self.token_bucket, tokens)):
+            if bucket is not None and amount:
+                bucket.charge(amount)
+
+    async def acharge(self, calls: int, tokens: int) -> None:
+        """Async variant of charge"""
+        await self._call(self.charge, calls, tokens)
+
+    async def aavailable_in(self, calls: int, tokens: int) -> float:
+        """Async variant of available_in"""
+        return await self._call(self.available_in, calls, tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {}
+        for name, bucket in (("llm_requests_available", self.request_bucket), ("llm_tokens_available", self.token_bucket)):
+            if bucket is not None:
+                stats[name] = math.floor(bucket.level())
+        return stats
+
+
+def build_rate_limit(name: str, limit_per_minute: float) -> Optional[RateLimit]:
+    """Shared window when workers share a backend, else this worker's share in a token bucket"""
+    if limit_per_minute <= 0:
+        return None
+    backend = get_shared_backend()
+    if backend.shared:
+        return SharedRateWindow(name, limit_per_minute, backend)
+    return TokenBucket(limit_per_minute / max(SERVICE_WORKERS, 1))
+
+
+def build_llm_budget() -> LLMBudget:
+    """Budget configured from the environment"""
+    return LLMBudget(
+        request_bucket=build_rate_limit("requests", LLM_REQUESTS_PER_MINUTE),
+        token_bucket=build_rate_limit("tokens", LLM_TOKENS_PER_MINUTE)
+    )
+
+
+# Budget will be initialized lazily when needed
+_llm_budget = None
+
+def get_llm_budget() -> LLMBudget:
+    """Return the process-wide LLM budget"""
+    global _llm_budget
+    if _llm_budget is None:
+        _llm_budget = build_llm_budget()
+    return _llm_budget
+
+
+class Workflow:
+    """Concurrency limit, queue and scheduling priority of one kind of request"""
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int,
+        queue_size: int,
+        priority: int,
+        estimated_llm_calls: int = 0,
+        estimated_tokens: int = 0
+    ):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        # Lower is admitted first
+        self.priority = priority
+        # Must be available in the LLM budget at admission; 0 is never rejected for budget
+        self.estimated_llm_calls = estimated_llm_calls
+        self.estimated_tokens = estimated_tokens
+        self.running = 0
+        self.waiting: Deque[asyncio.Future] = deque()
+        self.rejected = 0
+        # Moving average of how long a request holds its slot
+        self.average_seconds = 1.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "waiting": len(self.waiting),
+            "max_concurrent": self.max_concurrent,
+            "queue_size": self.queue_size,
+            "rejected": self.rejected,
+            "average_seconds": round(self.average_seconds, 3)
+        }
+
+
+class Admission:
+    """A slot held by one request"""
+
+    __slots__ = ("workflow", "admitted_at")
+
+    def __init__(self, workflow: Workflow, admitted_at: float):
+        self.workflow = workflow
+        self.admitted_at = admitted_at
+
+
+class AdmissionController:
+    """Admits requests of each workflow within its limits and the LLM budget"""
+
+    def __init__(
+        self,
+        workflows: Dict[str, Workflow],
+        max_concurrent: int,
+        budget: Optional[LLMBudget] = None
+    ):
+        self.workflows = workflows
+        self.max_concurrent = max_concurrent
+        self.budget = budget
+        self.running = 0
+        self._by_priority = sorted(workflows.values(), key=lambda workflow: workflow.priority)
+
+    def _can_start(self, workflow: Workflow) -> bool:
+        return self.running < self.max_concurrent and workflow.running < workflow.max_concurrent
+
+    def _start(self, workflow: Workflow) -> None:
+        workflow.running += 1
+        self.running += 1
+
+    def _wake(self) -> None:
+        """Hands free slots to waiting requests, higher priority workflows first"""
+        for workflow in self._by_priority:
+            while workflow.waiting and self._can_start(workflow):
+                waiter = workflow.waiting.popleft()
+                if not waiter.done():
+                    self._start(workflow)
+                    waiter.set_result(None)
+
+    def _release(self, workflow: Workflow, held_seconds: float) -> None:
+        workflow.running -= 1
+        self.running -= 1
+        workflow.average_seconds += 0.2 * (held_seconds - workflow.average_seconds)
+        self._wake()
+
+    def _retry_after(self, workflow: Workflow) -> float:
+        """Time for the queue ahead to drain at the workflow's current pace"""
+        return workflow.average_seconds * (len(workflow.waiting) + 1) / max(workflow.max_concurrent, 1)
+
+    def _reject(self, workflow: Workflow, reason: str, message: str, retry_after: float) -> Overloaded:
+        workflow.rejected += 1
+        ADMISSION_DECISIONS.inc(workflow=workflow.name, result=reason)
+        return Overloaded(message, retry_after)
+
+    async def _check_llm_budget(self, workflow: Workflow) -> None:
+        """Raises Overloaded while the LLM budget cannot cover the workflow's estimated usage"""
+        if self.budget is None:
+            return
+        wait = await self.budget.aavailable_in(workflow.estimated_llm_calls, workflow.estimated_tokens)
+        if wait > 0:
+            raise self._reject(workflow, "rejected_llm_budget", "LLM rate limit budget exhausted", wait)
+
+    async def acquire(self, name: str) -> Admission:
+        """
+        Takes a slot of the workflow, waiting in its queue (within the request
+        deadline) when none is free. Raises Overloaded when the queue is full
+        or the LLM budget is exhausted. The slot is freed with release().
+        """
+        workflow = self.workflows[name]
+        await self._check_llm_budget(workflow)
+        start_now = self._can_start(workflow) and not workflow.waiting
+        if not start_now and len(workflow.waiting) >= workflow.queue_size:
+            raise self._reject(workflow, "rejected_queue_full", f"Too many {name} requests queued",
+                               self._retry_after(workflow))
+
+        start = time.perf_counter()
+        if start_now:
+            self._start(workflow)
+            ADMISSION_DECISIONS.inc(workflow=name, result="admitted")
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            workflow.waiting.append(waiter)
+            ADMISSION_DECISIONS.inc(workflow=name, result="queued")
+            try:
+                await within_deadline(waiter, "admission")
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over just as the wait ended
+                    self._release(workflow, 0.0)
+                elif waiter in workflow.waiting:
+                    workflow.waiting.remove(waiter)
+                raise
+        admitted_at = time.perf_counter()
+        ADMISSION_WAIT.observe(admitted_at - start, workflow=name)
+        return Admission(workflow, admitted_at)
+
+    def release(self, admission: Admission) -> None:
+        """Frees the slot"""
+        self._release(admission.workflow, time.perf_counter() - admission.admitted_at)
+
+    @asynccontextmanager
+    async def admit(self, name: str) -> AsyncIterator[None]:
+        """Holds a slot of the workflow for the block"""
+        admission = await self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(admission)
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {
+            "running": self.running,
+            "max_concurrent": self.max_concurrent,
+            "workflows": {name: workflow.stats() for name, workflow in self.workflows.items()}
+        }
+        if self.budget is not None:
+            stats.update(self.budget.stats())
+        return stats
+
+
+def build_admission_controller() -> AdmissionController:
+    """Controller configured from the environment; grading is admitted before generation"""
+    return AdmissionController(
+        workflows={
+            "grading": Workflow("grading", GRADING_MAX_CONCURRENT, GRADING_QUEUE_SIZE, priority=0),
+            "generation": Workflow(
+                "generation",
+                GENERATION_MAX_CONCURRENT,
+                GENERATION_QUEUE_SIZE,
+                priority=1,
+                estimated_llm_calls=GENERATION_ESTIMATED_LLM_CALLS,
+                estimated_tokens=GENERATION_ESTIMATED_TOKENS
+            )
+        },
+        max_concurrent=ADMISSION_MAX_CONCURRENT,
+        budget=get_llm_budget()
+    )
+
+
+# Controller will be initialized lazily when needed
+_admission_controller = None
+
+def get_admission_controller() -> AdmissionController:
+    """Return the process-wide admission controller"""
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = build_admission_controller()
+    return _admission_controller
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: per-request graph compilation vs. the cached graph registry
+Runs the grading workflow (no LLM call for a failing student) both ways and
+reports the per-call cost so the compile overhead can be tracked.
+"""
+import argparse
+import statistics
+import time
+
+# Handle imports for both module and direct execution
+try:
+    from .state import ExamState, MCQ, StudentAnswer
+    from .graph import build_exam_generation_graph, build_grading_graph, GraphRegistry
+except ImportError:
+    from state import ExamState, MCQ, StudentAnswer
+    from graph import build_exam_generation_graph, build_grading_graph, GraphRegistry
+
+
+def make_grading_state(num_questions: int) -> ExamState:
+    """Builds a grading state where every answer is wrong, so no certificate (LLM) call is made"""
+    mcqs = [
+        MCQ(
+            id=f"q{i}",
+            question=f"Question {i}?",
+            choices={"A": "a", "B": "b", "C": "c", "D": "d"},
+            correct_answer="A",
+            learning_outcome=f"Outcome {i % 4}"
+        )
+        for i in range(1, num_questions + 1)
+    ]
+    answers = [StudentAnswer(question_id=mcq.id, answer="B") for mcq in mcqs]
+    return ExamState(
+        course_name="Benchmark Course",
+        teacher_name="Teacher",
+        student_name="Student",
+        learning_outcomes=[f"Outcome {i}" for i in range(4)],
+        passing_score=70.0,
+        mcqs=mcqs,
+        student_answers=answers
+    )
+
+
+def time_calls(fn, iterations: int):
+    """Returns per-call timings in milliseconds"""
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label: str, timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{label:<34} mean {statistics.mean(timings):8.3f} ms   "
+          f"median {statistics.median(timings):8.3f} ms   p95 {p95:8.3f} ms")
+    return statistics.mean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--questions", type=int, default=20)
+    args = parser.parse_args()
+
+    state = make_grading_state(args.questions)
+    registry = GraphRegistry()
+
+    print(f"Iterations: {args.iterations}, questions per exam: {args.questions}")
+    print("-" * 90)
+
+    # Compile cost alone
+    report("compile exam generation graph", time_calls(build_exam_generation_graph, args.iterations))
+    report("compile grading graph", time_calls(build_grading_graph, args.iterations))
+    print("-" * 90)
+
+    # Full request path: compile + invoke vs. cached invoke
+    per_request = report(
+        "grade: compile per request",
+        time_calls(lambda: build_grading_graph().invoke(state), args.iterations)
+    )
+    cached = report(
+        "grade: cached registry graph",
+        time_calls(lambda: registry.grading.invoke(state), args.iterations)
+    )
+    print("-" * 90)
+    print(f"Saved per request: {per_request - cached:.3f} ms ({per_request / cached:.2f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the generation and grading pipelines
+Measures the pieces separately and end to end against the deterministic fake
+LLM, so runs are repeatable and need no API key:
+- nodes: supervisor_node and grading_node at several exam sizes
+- state: ExamState construction, serialization and the dict -> ExamState rebuild
+- graph: compile cost, grading invoke overhead, generation invoke with the fake LLM
+- grading: one /grade-exam request's CPU work on the graph path vs the grading
+  engine, and memory held per graded submission (full report dicts vs compact sheets)
+- http: /generate-exam and /grade-exam latency percentiles and throughput in-process;
+  passing students are graded with template certificates (no LLM call) and
+  with one LLM certificate per student
+
+Results are printed as a table and can be written as JSON (--output) for
+regression tracking.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+# Keep benchmark state out of the on-disk stores
+os.environ.setdefault("EXAM_STORE_SQLITE_PATH", ":memory:")
+os.environ.setdefault("QUESTION_BANK_SQLITE_PATH", ":memory:")
+
+import httpx
+
+# Handle imports for both module and direct execution
+try:
+    from . import nodes
+    from .llm import FakeExamLLM
+    from .state import ExamState, MCQ, StudentAnswer
+    from .scoring import AnswerKey, grade_answer_sheet
+    from .graph import build_exam_generation_graph, build_fanout_exam_generation_graph, build_grading_graph, GraphRegistry
+    from .main import app
+except ImportError:
+    import nodes
+    from llm import FakeExamLLM
+    from state import ExamState, MCQ, StudentAnswer
+    from scoring import AnswerKey, grade_answer_sheet
+    from graph import build_exam_generation_graph, build_fanout_exam_generation_graph, build_grading_graph, GraphRegistry
+    from main import app
+
+
+GROUPS = ("nodes", "state", "graph", "grading", "http")
+
+LEARNING_OUTCOMES = [
+    "Understand basic Python syntax and data types",
+    "Write and call functions in Python",
+    "Use control structures (if/else, loops)",
+    "Handle errors with exceptions"
+]
+
+
+def make_mcqs(num_questions: int) -> List[MCQ]:
+    return [
+        MCQ(
+            id=f"q{i}",
+            question=f"Question {i}?",
+            choices={"A": "a", "B": "b", "C": "c", "D": "d"},
+            correct_answer="ABCD"[i % 4],
+            learning_outcome=LEARNING_OUTCOMES[i % len(LEARNING_OUTCOMES)]
+        )
+        for i in range(1, num_questions + 1)
+    ]
+
+
+def make_state(num_questions: int, correct: bool = False) -> ExamState:
+    """Grading state; wrong answers by default so no certificate is written"""
+    mcqs = make_mcqs(num_questions)
+    answers = [
+        StudentAnswer(question_id=mcq.id, answer=mcq.correct_answer if correct else "ABCD"[("ABCD".index(mcq.correct_answer) + 1) % 4])
+        for mcq in mcqs
+    ]
+    return ExamState(
+        course_name="Benchmark Course",
+        teacher_name="Teacher",
+        student_name="Student",
+        learning_outcomes=LEARNING_OUTCOMES,
+        passing_score=70.0,
+        mcqs=mcqs,
+        student_answers=answers
+    )
+
+
+def summarize(group: str, name: str, timings: List[float], wall: Optional[float] = None, **params: Any) -> Dict[str, Any]:
+    """Percentiles over per-call timings (seconds in, milliseconds out)"""
+    ordered = sorted(t * 1000 for t in timings)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+    result = {
+        "group": group,
+        "name": name,
+        "params": params,
+        "iterations": len(ordered),
+        "mean_ms": round(statistics.mean(ordered), 4),
+        "p50_ms": round(statistics.median(ordered), 4),
+        "p95_ms": round(percentile(0.95), 4),
+        "p99_ms": round(percentile(0.99), 4),
+        "min_ms": round(ordered[0], 4),
+        "max_ms": round(ordered[-1], 4)
+    }
+    if wall:
+        result["throughput_rps"] = round(len(ordered) / wall, 2)
+    return result
+
+
+def time_calls(fn: Callable[[], Any], iterations: int) -> List[float]:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def atime_calls(fn: Callable[[], Any], iterations: int) -> List[float]:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_nodes(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:
+    results = []
+    for size in sizes:
+        state = make_state(size)
+        results.append(summarize("nodes", "supervisor_node", time_calls(lambda: nodes.supervisor_node(state), iterations), questions=size))
+        validated = make_state(size)
+        validated.validation_status = "valid"
+        results.append(summarize("nodes", "grading_node", time_calls(lambda: nodes.grading_node(validated), iterations), questions=size))
+    return results
+
+
+def bench_state(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:
+    results = []
+    for size in sizes:
+        state = make_state(size)
+        payload = state.model_dump()
+        payload_json = state.model_dump_json()
+        results.extend([
+            summarize("state", "ExamState(**dict)", time_calls(lambda: ExamState(**payload), iterations), questions=size),
+            summarize("state", "model_dump", time_calls(state.model_dump, iterations), questions=size),
+            summarize("state", "model_dump_json", time_calls(state.model_dump_json, iterations), questions=size,
+                      payload_bytes=len(payload_json)),
+            summarize("state", "model_validate_json", time_calls(lambda: ExamState.model_validate_json(payload_json), iterations),
+                      questions=size)
+        ])
+    return results
+
+
+async def bench_graph(iterations: int, latency: float) -> List[Dict[str, Any]]:
+    registry = GraphRegistry()
+    grading_state = make_state(20)
+    generation_state = ExamState(course_name="Benchmark Course", teacher_name="Teacher", learning_outcomes=LEARNING_OUTCOMES)
+    fanout_state = generation_state.model_copy(update={"generation_mode": "fanout"})
+    llm_iterations = max(1, iterations // 10)
+    return [
+        summarize("graph", "compile exam generation", time_calls(build_exam_generation_graph, iterations)),
+        summarize("graph", "compile fanout generation", time_calls(build_fanout_exam_generation_graph, iterations)),
+        summarize("graph", "compile grading", time_calls(build_grading_graph, iterations)),
+        summarize("graph", "grading invoke (cached graph)", time_calls(lambda: registry.grading.invoke(grading_state), iterations),
+                  questions=20),
+        summarize("graph", "grading ainvoke (cached graph)", await atime_calls(lambda: registry.grading.ainvoke(grading_state), iterations),
+                  questions=20),
+        summarize("graph", "generation ainvoke (single)",
+                  await atime_calls(lambda: registry.exam_generation.ainvoke(generation_state), llm_iterations),
+                  llm_latency_s=latency),
+        summarize("graph", "generation ainvoke (fanout)",
+                  await atime_calls(lambda: registry.exam_generation_fanout.ainvoke(fanout_state), llm_iterations),
+                  llm_latency_s=latency)
+    ]
+
+
+def bench_grading(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:
+    """
+    Per-request grading work for a failing sheet (no certificate): the old
+    path (answers -> StudentAnswer -> ExamState -> graph -> ExamState rebuild)
+    against the engine (one pass over the request's answer dicts).
+    cpu_ms is process CPU time per request.
+    """
+    graph = GraphRegistry().grading
+    results = []
+    for size in sizes:
+        state = make_state(size)
+        key = AnswerKey(state.mcqs)
+        request_answers = [{"question_id": a.question_id, "answer": a.answer} for a in state.student_answers]
+
+        def graph_path():
+            answers = [StudentAnswer(question_id=a["question_id"], answer=a["answer"]) for a in request_answers]
+            final = graph.invoke(ExamState(
+                course_name=state.course_name,
+                teacher_name=state.teacher_name,
+                student_name=state.student_name,
+                learning_outcomes=state.learning_outcomes,
+                passing_score=state.passing_score,
+                mcqs=state.mcqs,
+                student_answers=answers
+            ))
+            return ExamState(**final)
+
+        for name, fn in (("graph path", graph_path),
+                         ("engine", lambda: grade_answer_sheet(key, request_answers, state.passing_score))):
+            cpu_start = time.process_time()
+            timings = time_calls(fn, iterations)
+            cpu_ms = (time.process_time() - cpu_start) * 1000 / iterations
+            results.append(summarize("grading", name, timings, questions=size, cpu_ms=round(cpu_ms, 4)))
+        results.extend(bench_grading_memory(key, request_answers, state.passing_score))
+    return results
+
+
+def _held_bytes(build: Callable[[], Any]) -> int:
+    """Bytes still allocated by what build() returns"""
+    tracemalloc.start()
+    try:
+        held = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del held
+    return size
+
+
+def bench_grading_memory(key: AnswerKey, request_answers: List[Dict[str, str]], passing_score: float,
+                         submissions: int = 200) -> List[Dict[str, Any]]:
+    """
+    Memory per graded submission held for a batch: the per-question report
+    dicts the graph path kept in ExamState vs the engine's GradedSheet.
+    """
+    def reports():
+        sheets = [grade_answer_sheet(key, request_answers, passing_score) for _ in range(submissions)]
+        return [
+            {"raw_score": s.raw_score, "percentage": s.percentage, "passed": s.passed,
+             "grading_report": s.grading_report(key, passing_score)}
+            for s in sheets
+        ]
+
+    def sheets():
+        return [grade_answer_sheet(key, request_answers, passing_score) for _ in range(submissions)]
+
+    results = []
+    for name, build in (("memory: report dicts", reports), ("memory: compact sheets", sheets)):
+        start = time.perf_counter()
+        per_submission = _held_bytes(build) / submissions
+        result = summarize("grading", name, [time.perf_counter() - start], questions=len(key),
+                           bytes_per_submission=round(per_submission))
+        results.append(result)
+    return results
+
+
+async def bench_http(requests: int, concurrency: int, latency: float) -> List[Dict[str, Any]]:
+    exam_request = {
+        "course_name": "Benchmark Course",
+        "teacher_name": "Teacher",
+        "student_name": "Student",
+        "learning_outcomes": LEARNING_OUTCOMES,
+        "passing_score": 70.0,
+        "cache_mode": "bypass"
+    }
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(client: httpx.AsyncClient, path: str, payload: dict, timings: List[float]) -> dict:
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(path, json=payload)
+            timings.append(time.perf_counter() - start)
+        response.raise_for_status()
+        return response.json()
+
+    async def run(client: httpx.AsyncClient, path: str, payloads: List[dict]):
+        timings: List[float] = []
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[timed(client, path, payload, timings) for payload in payloads])
+        return timings, time.perf_counter() - start, responses
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        timings, wall, responses = await run(client, "/generate-exam", [exam_request] * requests)
+        exam = responses[0]
+        results = [summarize("http", "POST /generate-exam", timings, wall, concurrency=concurrency, llm_latency_s=latency)]
+
+        passing = {"exam_id": exam["exam_id"], "student_name": "Student", "student_answers": [
+            {"question_id": mcq["id"], "answer": mcq["correct_answer"]} for mcq in exam["mcqs"]
+        ]}
+        failing = dict(passing, student_answers=[
+            {"question_id": mcq["id"], "answer": "A" if mcq["correct_answer"] != "A" else "B"} for mcq in exam["mcqs"]
+        ])
+        timings, wall, _ = await run(client, "/grade-exam", [failing] * requests)
+        results.append(summarize("http", "POST /grade-exam (fail, no LLM)", timings, wall, concurrency=concurrency))
+        timings, wall, _ = await run(client, "/grade-exam", [passing] * requests)
+        results.append(summarize("http", "POST /grade-exam (pass, template cert)", timings, wall,
+                                 concurrency=concurrency))
+        # The node reads the mode per call; switch it for this scenario only
+        certificate_mode = nodes.CERTIFICATE_MODE
+        nodes.CERTIFICATE_MODE = "llm_per_student"
+        try:
+            timings, wall, _ = await run(client, "/grade-exam", [passing] * requests)
+        finally:
+            nodes.CERTIFICATE_MODE = certificate_mode
+        results.append(summarize("http", "POST /grade-exam (pass, LLM cert)", timings, wall,
+                                 concurrency=concurrency, llm_latency_s=latency))
+    return results
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    print(f"{'group':<6} {'benchmark':<38} {'params':<40} {'mean':>10} {'p50':>10} {'p95':>10} {'p99':>10} {'rps':>8}")
+    print("-" * 138)
+    for r in results:
+        params = ",".join(f"{k}={v}" for k, v in r["params"].items())
+        rps = f"{r['throughput_rps']:8.1f}" if "throughput_rps" in r else ""
+        print(f"{r['group']:<6} {r['name']:<38} {params:<40} {r['mean_ms']:10.3f} {r['p50_ms']:10.3f} "
+              f"{r['p95_ms']:10.3f} {r['p99_ms']:10.3f} {rps}")
+
+
+async def run_suite(args: argparse.Namespace) -> Dict[str, Any]:
+    nodes._llm = FakeExamLLM(latency=args.latency)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    groups = args.only.split(",") if args.only else GROUPS
+
+    results = []
+    if "nodes" in groups:
+        results += bench_nodes(sizes, args.iterations)
+    if "state" in groups:
+        results += bench_state(sizes, args.iterations)
+    if "graph" in groups:
+        results += await bench_graph(args.iterations, args.latency)
+    if "grading" in groups:
+        results += bench_grading(sizes, args.iterations)
+    if "http" in groups:
+        results += await bench_http(args.requests, args.concurrency, args.latency)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "sizes": sizes,
+            "llm_latency_s": args.latency,
+            "http_requests": args.requests,
+            "http_concurrency": args.concurrency
+        },
+        "results": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200, help="calls per micro-benchmark")
+    parser.add_argument("--sizes", default="10,100,1000", help="exam sizes for node and state benchmarks")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake LLM latency in seconds")
+    parser.add_argument("--requests", type=int, default=100, help="HTTP requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=10, help="HTTP requests in flight")
+    parser.add_argument("--only", help=f"comma-separated subset of {','.join(GROUPS)}")
+    parser.add_argument("--output", help="write JSON results to this path ('-' for stdout)")
+    args = parser.parse_args()
+
+    suite = asyncio.run(run_suite(args))
+    if args.output == "-":
+        json.dump(suite, sys.stdout, indent=2)
+        print()
+        return
+    print_table(suite["results"])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(suite, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Exam Cache
+Content-addressed cache for generated exams, so identical course setups reuse
+a previous generation instead of paying for another LLM call.
+Tiers: in-process LRU with TTL, plus an optional second tier: an on-disk
+SQLite file, or the shared state backend when several workers serve the app.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Handle imports for both module and direct execution
+try:
+    from .shared import SQLITE_BUSY_TIMEOUT_SECONDS, SharedBackend, get_shared_backend, offload
+except ImportError:
+    from shared import SQLITE_BUSY_TIMEOUT_SECONDS, SharedBackend, get_shared_backend, offload
+
+
+def normalize_text(text: str) -> str:
+    """Case- and whitespace-insensitive form of a course name or outcome"""
+    return " ".join((text or "").split()).casefold()
+
+
+def exam_cache_key(
+    course_name: str,
+    learning_outcomes: List[str],
+    model: str,
+    prompt_version: str,
+    generation_mode: str = "single"
+) -> str:
+    """
+    Hash of the normalized course setup. Outcome order is kept because it
+    drives question order; student and teacher names do not change the exam.
+    """
+    material = json.dumps([
+        normalize_text(course_name),
+        [normalize_text(outcome) for outcome in learning_outcomes],
+        model,
+        prompt_version,
+        generation_mode
+    ], separators=(",", ":"))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ExamCache:
+    """Interface for exam cache backends. Values are lists of MCQ dicts."""
+
+    # False for caches whose calls never wait on I/O
+    blocking = True
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        raise NotImplementedError
+
+    def set(self, key: str, mcqs: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+    async def aget(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Async variant of get; blocking caches are read from a worker thread"""
+        return await offload(self.get, key) if self.blocking else self.get(key)
+
+    async def aset(self, key: str, mcqs: List[Dict[str, Any]]) -> None:
+        """Async variant of set"""
+        if self.blocking:
+            await offload(self.set, key, mcqs)
+        else:
+            self.set(key, mcqs)
+
+
+class MemoryExamCache(ExamCache):
+    """In-process LRU cache with a per-entry time to live"""
+
+    blocking = False
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 86400):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, mcqs = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return mcqs
+
+    def set(self, key: str, mcqs: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, mcqs)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "max_entries": self.max_entries}
+
+
+class SQLiteExamCache(ExamCache):
+    """On-disk cache tier; survives restarts and can be shared between processes"""
+
+    def __init__(self, path: str, ttl_seconds: float = 86400):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS exam_cache ("
+            "key TEXT PRIMARY KEY, payload TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, expires_at FROM exam_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self._conn.execute("DELETE FROM exam_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        return json.loads(row[0])
+
+    def set(self, key: str, mcqs: List[Dict[str, Any]]) -> None:
+        payload = json.dumps(mcqs)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO exam_cache (key, payload, expires_at) VALUES (?, ?, ?)",
+                (key, payload, time.time() + self.ttl_seconds)
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM exam_cache").fetchone()
+        return {"entries": entries, "path": self.path}
+
+
+class SharedExamCache(ExamCache):
+    """Cache tier in the shared state backend, visible to every worker process"""
+
+    NAMESPACE = "exam_cache"
+
+    def __init__(self, backend: SharedBackend, ttl_seconds: float = 86400):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.blocking = backend.blocking
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        payload = self.backend.get(self.NAMESPACE, key)
+        return json.loads(payload) if payload is not None else None
+
+    def set(self, key: str, mcqs: List[Dict[str, Any]]) -> None:
+        self.backend.set(self.NAMESPACE, key, json.dumps(mcqs), ttl_seconds=self.ttl_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": type(self.backend).__name__}
+
+
+class TieredExamCache(ExamCache):
+    """Memory tier in front of an optional disk tier, with hit/miss counters"""
+
+    blocking = False
+
+    def __init__(self, memory: MemoryExamCache, disk: Optional[ExamCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def _memory_get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        mcqs = self.memory.get(key)
+        if mcqs is not None:
+            self.memory_hits += 1
+        return mcqs
+
+    def _disk_result(self, key: str, mcqs: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
+        if mcqs is not None:
+            self.disk_hits += 1
+            self.memory.set(key, mcqs)
+        else:
+            self.misses += 1
+        return mcqs
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        mcqs = self._memory_get(key)
+        if mcqs is not None:
+            return mcqs
+        return self._disk_result(key, self.disk.get(key) if self.disk is not None else None)
+
+    def set(self, key: str, mcqs: List[Dict[str, Any]]) -> None:
+        self.writes += 1
+        self.memory.set(key, mcqs)
+        if self.disk is not None:
+            self.disk.set(key, mcqs)
+
+    async def aget(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Async variant of get; only the disk tier leaves the event loop"""
+        mcqs = self._memory_get(key)
+        if mcqs is not None:
+            return mcqs
+        return self._disk_result(key, await self.disk.aget(key) if self.disk is not None else None)
+
+    async def aset(self, key: str, mcqs: List[Dict[str, Any]]) -> None:
+        """Async variant of set"""
+        self.writes += 1
+        self.memory.set(key, mcqs)
+        if self.disk is not None:
+            await self.disk.aset(key, mcqs)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk is not None else None
+        }
+
+
+def build_exam_cache() -> Optional[ExamCache]:
+    """
+    Builds the exam cache from environment configuration:
+    EXAM_CACHE_ENABLED, EXAM_CACHE_MAX_ENTRIES, EXAM_CACHE_TTL_SECONDS and
+    EXAM_CACHE_SQLITE_PATH (enables the disk tier when set). Without a disk
+    tier, a shared state backend (several workers) is used as the second tier.
+    """
+    if os.getenv("EXAM_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    ttl_seconds = float(os.getenv("EXAM_CACHE_TTL_SECONDS", "86400"))
+    memory = MemoryExamCache(
+        max_entries=int(os.getenv("EXAM_CACHE_MAX_ENTRIES", "256")),
+        ttl_seconds=ttl_seconds
+    )
+    sqlite_path = os.getenv("EXAM_CACHE_SQLITE_PATH")
+    if sqlite_path:
+        disk = SQLiteExamCache(sqlite_path, ttl_seconds=ttl_seconds)
+    elif get_shared_backend().shared:
+        disk = SharedExamCache(get_shared_backend(), ttl_seconds=ttl_seconds)
+    else:
+        disk = None
+    return TieredExamCache(memory, disk)
+
+
+# Cache will be initialized lazily when needed
+_exam_cache = None
+_exam_cache_initialized = False
+
+def get_exam_cache() -> Optional[ExamCache]:
+    """Return the process-wide exam cache, or None when caching is disabled"""
+    global _exam_cache, _exam_cache_initialized
+    if not _exam_cache_initialized:
+        _exam_cache = build_exam_cache()
+        _exam_cache_initialized = True
+    return _exam_cache
@@ -0,0 +1,353 @@
+"""
+Certificate Templates
+Certificates are rendered from a template and five fields (student, course,
+teacher, completion date and score), so a passing student costs no LLM call.
+Each course's template is filled with its course-level fields once and cached
+in memory; only the student fields are substituted per certificate.
+With LLM certificates, the LLM writes one certificate "style" per course that
+is cached and filled the same way. LLM polishing is an opt-in background job
+(see main.py).
+"""
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+from string import Template
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+# Handle imports for both module and direct execution
+try:
+    from .cache import normalize_text
+    from .shared import SharedBackend, get_shared_backend
+    from .metrics import CERTIFICATE_STYLE_LOOKUPS, CERTIFICATE_TOKENS_SAVED
+except ImportError:
+    from cache import normalize_text
+    from shared import SharedBackend, get_shared_backend
+    from metrics import CERTIFICATE_STYLE_LOOKUPS, CERTIFICATE_TOKENS_SAVED
+
+
+# "template": rendered instantly from the course template
+# "llm": the LLM writes one style per course, filled for each student
+# "llm_per_student": one LLM call per student (stable, cache-friendly prompt prefix)
+CERTIFICATE_MODE = os.getenv("CERTIFICATE_MODE", "template")
+
+CERTIFICATE_FIELDS = frozenset({"student_name", "course_name", "teacher_name", "completion_date", "score"})
+
+DEFAULT_CERTIFICATE_TEMPLATE = """CERTIFICATE OF COMPLETION
+
+This is to certify that
+
+$student_name
+
+has successfully completed the course
+
+$course_name
+
+under the instruction of $teacher_name, achieving a final score of $score.
+
+Awarded on $completion_date.
+
+
+______________________________
+$teacher_name
+Course Instructor"""
+
+
+def _escape(value: str) -> str:
+    """Keeps "$" in course-level values from being read as a placeholder in the second pass"""
+    return (value or "").replace("$", "$$")
+
+
+def validate_template(template: str) -> None:
+    """Raises ValueError for malformed templates or unknown placeholders"""
+    parsed = Template(template)
+    if not parsed.is_valid():
+        raise ValueError("Template contains an invalid placeholder (use $name or ${name}; $$ for a literal $)")
+    unknown = set(parsed.get_identifiers()) - CERTIFICATE_FIELDS
+    if unknown:
+        raise ValueError(
+            f"Unknown placeholders: {', '.join(sorted(unknown))}. "
+            f"Allowed: {', '.join(sorted(CERTIFICATE_FIELDS))}"
+        )
+
+
+class CertificateTemplates:
+    """
+    Per-course certificate templates. A course uses its registered template or
+    the default; the course-level fields are substituted once per
+    (course, teacher) and the partially filled template is kept in an LRU cache.
+    """
+
+    def __init__(self, default_template: str = DEFAULT_CERTIFICATE_TEMPLATE, max_courses: int = 1024):
+        validate_template(default_template)
+        self.default_template = default_template
+        self.max_courses = max_courses
+        self._templates: Dict[str, str] = {}
+        self._compiled: "OrderedDict[Tuple[str, str], Template]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def set_template(self, course_name: str, template: str) -> None:
+        """Registers a course's template (replacing the cached one)"""
+        validate_template(template)
+        course_key = normalize_text(course_name)
+        with self._lock:
+            self._templates[course_key] = template
+            for key in [key for key in self._compiled if key[0] == course_key]:
+                del self._compiled[key]
+
+    def template_for(self, course_name: str) -> str:
+        with self._lock:
+            return self._templates.get(normalize_text(course_name), self.default_template)
+
+    def _course_template(self, course_name: str, teacher_name: str) -> Template:
+        key = (normalize_text(course_name), teacher_name or "")
+        with self._lock:
+            compiled = self._compiled.get(key)
+            if compiled is not None:
+                self._compiled.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+            template = self._templates.get(key[0], self.default_template)
+        compiled = Template(Template(template).safe_substitute(
+            course_name=_escape(course_name),
+            teacher_name=_escape(teacher_name)
+        ))
+        with self._lock:
+            self._compiled[key] = compiled
+            while len(self._compiled) > self.max_courses:
+                self._compiled.popitem(last=False)
+        return compiled
+
+    def render(
+        self,
+        student_name: str,
+        course_name: str,
+        teacher_name: str,
+        completion_date: str,
+        percentage: float
+    ) -> str:
+        return self._course_template(course_name, teacher_name).safe_substitute(
+            student_name=student_name or "",
+            completion_date=completion_date,
+            score=f"{percentage:.2f}%"
+        )
+
+    def stats(self) -> dict:
+        return {
+            "mode": CERTIFICATE_MODE,
+            "course_templates": len(self._templates),
+            "cached_courses": len(self._compiled),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+def fill_certificate(template: str, fields: Dict[str, str]) -> str:
+    """Substitutes the certificate fields into a template or style"""
+    return Template(template).safe_substitute(fields)
+
+
+# A style and the tokens it took to generate (None for unusable LLM output)
+StyleEntry = Tuple[Optional[str], int]
+
+
+class CertificateStyleCache:
+    """
+    LLM-written certificate styles, one per (course, teacher): a complete
+    certificate with $student_name, $completion_date and $score placeholders,
+    generated once and filled for every passing student of the course.
+    Concurrent requests for a missing style share one generation, and with a
+    shared state backend every worker process reuses it. Every reuse saves
+    the tokens of a per-student certificate call.
+    """
+
+    NAMESPACE = "certificate_styles"
+
+    def __init__(self, max_entries: int = 1024, backend: Optional[SharedBackend] = None):
+        self.max_entries = max_entries
+        self.backend = backend
+        self._styles: "OrderedDict[Tuple[str, str], StyleEntry]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.unusable = 0
+        self.tokens_saved = 0
+
+    @staticmethod
+    def _key(course_name: str, teacher_name: str) -> Tuple[str, str]:
+        return normalize_text(course_name), teacher_name or ""
+
+    def _lookup(self, key: Tuple[str, str]) -> Optional[StyleEntry]:
+        entry = self._styles.get(key)
+        if entry is not None:
+            self._styles.move_to_end(key)
+        return entry
+
+    def _remember(self, key: Tuple[str, str], entry: StyleEntry) -> None:
+        with self._lock:
+            self._styles[key] = entry
+            while len(self._styles) > self.max_entries:
+                self._styles.popitem(last=False)
+
+    def _shared_entry(self, key: Tuple[str, str], payload: Optional[str]) -> Optional[StyleEntry]:
+        if payload is None:
+            return None
+        style, tokens = json.loads(payload)
+        entry = (style, tokens)
+        self._remember(key, entry)
+        return entry
+
+    def _shared_lookup(self, key: Tuple[str, str]) -> Optional[StyleEntry]:
+        """A style another worker generated"""
+        if self.backend is None:
+            return None
+        return self._shared_entry(key, self.backend.get(self.NAMESPACE, json.dumps(key)))
+
+    async def _ashared_lookup(self, key: Tuple[str, str]) -> Optional[StyleEntry]:
+        """Async variant of _shared_lookup"""
+        if self.backend is None:
+            return None
+        return self._shared_entry(key, await self.backend.aget(self.NAMESPACE, json.dumps(key)))
+
+    def _record_hit(self, entry: StyleEntry) -> Optional[str]:
+        style, tokens = entry
+        if style is None:
+            CERTIFICATE_STYLE_LOOKUPS.inc(result="unusable")
+            return None
+        self.hits += 1
+        self.tokens_saved += tokens
+        CERTIFICATE_STYLE_LOOKUPS.inc(result="hit")
+        CERTIFICATE_TOKENS_SAVED.inc(tokens)
+        return style
+
+    def _record_miss(self) -> None:
+        self.misses += 1
+        CERTIFICATE_STYLE_LOOKUPS.inc(result="miss")
+
+    def _usable(self, key: Tuple[str, str], style: str, tokens: int) -> Optional[str]:
+        """Caches a generated style locally; output without a usable $student_name placeholder is cached as unusable"""
+        try:
+            validate_template(style)
+            usable = "student_name" in Template(style).get_identifiers()
+        except ValueError:
+            usable = False
+        if not usable:
+            self.unusable += 1
+            style = None
+        self._remember(key, (style, tokens))
+        return style
+
+    def _store(self, key: Tuple[str, str], style: str, tokens: int) -> Optional[str]:
+        style = self._usable(key, style, tokens)
+        if self.backend is not None:
+            self.backend.set(self.NAMESPACE, json.dumps(key), json.dumps([style, tokens]))
+        return style
+
+    async def _astore(self, key: Tuple[str, str], style: str, tokens: int) -> Optional[str]:
+        """Async variant of _store"""
+        style = self._usable(key, style, tokens)
+        if self.backend is not None:
+            await self.backend.aset(self.NAMESPACE, json.dumps(key), json.dumps([style, tokens]))
+        return style
+
+    def get_or_create(
+        self,
+        course_name: str,
+        teacher_name: str,
+        create: Callable[[], Tuple[str, int]]
+    ) -> Optional[str]:
+        """Returns the course's style, generating it with create() on a miss; None if unusable"""
+        key = self._key(course_name, teacher_name)
+        with self._lock:
+            entry = self._lookup(key)
+        if entry is None:
+            entry = self._shared_lookup(key)
+        if entry is not None:
+            return self._record_hit(entry)
+        self._record_miss()
+        style, tokens = create()
+        return self._store(key, style, tokens)
+
+    async def aget_or_create(
+        self,
+        course_name: str,
+        teacher_name: str,
+        create: Callable[[], Awaitable[Tuple[str, int]]]
+    ) -> Optional[str]:
+        """Async variant of get_or_create; concurrent misses wait for one generation"""
+        key = self._key(course_name, teacher_name)
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return self._record_hit(entry)
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = asyncio.get_running_loop().create_future()
+        
+        if not owner:
+            await asyncio.shield(pending)
+            with self._lock:
+                entry = self._lookup(key)
+            return self._record_hit(entry) if entry is not None else None
+        
+        try:
+            entry = await self._ashared_lookup(key)
+            if entry is not None:
+                return self._record_hit(entry)
+            self._record_miss()
+            style, tokens = await create()
+            return await self._astore(key, style, tokens)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set_result(None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "styles": len(self._styles),
+            "hits": self.hits,
+            "misses": self.misses,
+            "unusable": self.unusable,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "tokens_saved": self.tokens_saved
+        }
+
+
+def build_certificate_templates() -> CertificateTemplates:
+    """CERTIFICATE_TEMPLATE_PATH replaces the built-in default template"""
+    path = os.getenv("CERTIFICATE_TEMPLATE_PATH")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return CertificateTemplates(default_template=f.read())
+    return CertificateTemplates()
+
+
+# Templates and styles will be loaded lazily when needed
+_certificate_templates = None
+_certificate_styles = None
+
+def get_certificate_templates() -> CertificateTemplates:
+    """Return the process-wide certificate templates"""
+    global _certificate_templates
+    if _certificate_templates is None:
+        _certificate_templates = build_certificate_templates()
+    return _certificate_templates
+
+
+def get_certificate_styles() -> CertificateStyleCache:
+    """Return the process-wide certificate style cache"""
+    global _certificate_styles
+    if _certificate_styles is None:
+        backend = get_shared_backend()
+        _certificate_styles = CertificateStyleCache(
+            max_entries=int(os.getenv("CERTIFICATE_STYLE_CACHE_ENTRIES", "1024")),
+            backend=backend if backend.shared else None
+        )
+    return _certificate_styles
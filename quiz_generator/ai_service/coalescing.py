@@ -0,0 +1,158 @@
+"""
+Request Coalescing
+Single-flight execution of identical work: while a generation for a key is
+in flight, further requests for the same key await its result instead of
+starting their own LLM calls. When a course is published, every student
+opening the exam at once then costs one generation.
+
+The work runs in its own task, so a leader request that goes away does not
+cancel it for the requests waiting on it (the result also lands in the exam
+cache); it is cancelled once no request is waiting for it any more. It runs
+without the leader's deadline: each request applies its own deadline to its
+wait. Coalescing is per process; across workers the shared exam cache
+serves requests that arrive after the first generation finished.
+"""
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+# Handle imports for both module and direct execution
+try:
+    from .metrics import CANCELLATIONS, REGISTRY, count_llm_calls
+    from .deadlines import request_deadline
+except ImportError:
+    from metrics import CANCELLATIONS, REGISTRY, count_llm_calls
+    from deadlines import request_deadline
+
+
+GENERATION_COALESCING = os.getenv("GENERATION_COALESCING", "true").lower() == "true"
+
+
+class FlightStats:
+    """Counters of one coalescing key"""
+
+    __slots__ = ("runs", "coalesced", "llm_calls", "llm_calls_saved")
+
+    def __init__(self):
+        self.runs = 0
+        self.coalesced = 0
+        self.llm_calls = 0
+        self.llm_calls_saved = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key onto one execution. Keeps
+    per-key counters for the most recent max_keys keys; a coalesced call is
+    credited with the LLM calls of the execution it joined.
+    """
+
+    def __init__(self, name: str, max_keys: int = 256):
+        self.name = name
+        self.max_keys = max_keys
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self._stats: "OrderedDict[str, FlightStats]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key_stats(self, key: str) -> FlightStats:
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = FlightStats()
+            while len(self._stats) > self.max_keys:
+                self._stats.popitem(last=False)
+        self._stats.move_to_end(key)
+        return stats
+
+    async def _execute(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, int]:
+        try:
+            with request_deadline(None), count_llm_calls() as usage:
+                result = await fn()
+            with self._lock:
+                stats = self._key_stats(key)
+                stats.runs += 1
+                stats.llm_calls += usage.calls
+            return result, usage.calls
+        finally:
+            with self._lock:
+                # An abandoned execution may already have been replaced by a new one
+                if self._inflight.get(key) is asyncio.current_task():
+                    del self._inflight[key]
+                    del self._waiters[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Runs fn() for key, or awaits the execution already in flight for it.
+        Returns (result, coalesced); errors propagate to every caller. The
+        execution is cancelled when every caller waiting for it is cancelled.
+        """
+        with self._lock:
+            flight = self._inflight.get(key)
+            coalesced = flight is not None
+            if not coalesced:
+                flight = self._inflight[key] = asyncio.ensure_future(self._execute(key, fn))
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+
+        try:
+            result, llm_calls = await asyncio.shield(flight)
+        except asyncio.CancelledError:
+            self._leave(key, flight)
+            raise
+        if coalesced:
+            with self._lock:
+                stats = self._key_stats(key)
+                stats.coalesced += 1
+                stats.llm_calls_saved += llm_calls
+        return result, coalesced
+
+    def _leave(self, key: str, flight: asyncio.Future) -> None:
+        """A waiter was cancelled; the execution is cancelled with its last waiter"""
+        with self._lock:
+            if flight.done() or self._inflight.get(key) is not flight:
+                return
+            self._waiters[key] -= 1
+            if self._waiters[key] > 0:
+                return
+            del self._inflight[key]
+            del self._waiters[key]
+        flight.cancel()
+        CANCELLATIONS.inc(reason="abandoned", stage=self.name)
+
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            per_key = {key: stats.as_dict() for key, stats in self._stats.items()}
+        return {
+            "inflight": self.inflight(),
+            "runs": sum(stats["runs"] for stats in per_key.values()),
+            "coalesced": sum(stats["coalesced"] for stats in per_key.values()),
+            "llm_calls_saved": sum(stats["llm_calls_saved"] for stats in per_key.values()),
+            "keys": per_key
+        }
+
+    def collect(self) -> List[str]:
+        """Per-key counters in the Prometheus text format (bounded by max_keys)"""
+        lines = []
+        with self._lock:
+            items = [(key, stats.as_dict()) for key, stats in self._stats.items()]
+        for field, documentation in (
+            ("runs", "Executions that did the work"),
+            ("coalesced", "Requests served by joining an execution in flight"),
+            ("llm_calls_saved", "LLM calls avoided by coalescing")
+        ):
+            name = f"quiz_singleflight_{field}_total"
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} counter"]
+            for key, stats in items:
+                lines.append(f'{name}{{flight="{self.name}",key="{key[:16]}"}} {stats[field]}')
+        return lines
+
+
+# Concurrent /generate-exam requests for the same normalized course setup
+GENERATION_FLIGHTS = REGISTRY.register(SingleFlight("generate_exam"))
@@ -0,0 +1,112 @@
+"""
+Response Compression
+ASGI middleware compressing large JSON responses with Brotli (when the
+optional brotli package is installed) or gzip, whichever the client accepts.
+Streaming responses (SSE/NDJSON question streams) are passed through
+untouched so events still reach the client as they are produced.
+"""
+import gzip
+import os
+from typing import Callable, List, Optional
+
+# Optional dependency: Brotli compresses JSON better than gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Responses smaller than this are sent as they are
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+
+def _compressors() -> dict:
+    compressors = {"gzip": lambda body: gzip.compress(body, compresslevel=GZIP_LEVEL)}
+    if brotli is not None:
+        compressors["br"] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+    return compressors
+
+
+def available_encodings() -> List[str]:
+    """Encodings the service can produce, in order of preference"""
+    return sorted(_compressors(), key=lambda encoding: encoding != "br")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Preferred encoding the client accepts (q=0 excluded), or None"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    for encoding in available_encodings():
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return None
+
+
+class CompressionMiddleware:
+    """Compresses complete (non-streamed) responses of at least minimum_size bytes"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self._compressors = _compressors()
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, self._compressing_send(send, encoding))
+
+    def _compressing_send(self, send: Callable, encoding: str) -> Callable:
+        start_message = None
+        passthrough = False
+
+        async def wrapped(message) -> None:
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                # Held back until the body shows whether it is worth compressing
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            headers = [(name, value) for name, value in start_message.get("headers", [])]
+            header_names = {name.lower() for name, _ in headers}
+            if (message.get("more_body", False) or b"content-encoding" in header_names
+                    or len(body) < self.minimum_size):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = self._compressors[encoding](body)
+            headers = [
+                (name, value) for name, value in headers
+                if name.lower() not in (b"content-length", b"vary")
+            ]
+            vary = [value for name, value in start_message.get("headers", []) if name.lower() == b"vary"]
+            headers += [
+                (b"content-encoding", encoding.encode("latin-1")),
+                (b"content-length", str(len(compressed)).encode("latin-1")),
+                (b"vary", b", ".join(vary + [b"Accept-Encoding"]))
+            ]
+            await send(dict(start_message, headers=headers))
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        return wrapped
@@ -0,0 +1,109 @@
+"""
+Request Deadlines and Cancellation
+Each request gets a time budget (X-Request-Timeout header, timeout_seconds
+field or REQUEST_TIMEOUT_SECONDS). The deadline is kept in a context
+variable, so it reaches the graph nodes running for the request: async LLM
+calls are cancelled when it passes, and nodes check it before starting
+another call. Requests are also cancelled when the client disconnects.
+Every cancellation is counted in quiz_cancellations_total.
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Iterator, Optional
+
+# Handle imports for both module and direct execution
+try:
+    from .metrics import CANCELLATIONS
+except ImportError:
+    from metrics import CANCELLATIONS
+
+
+# Budget of requests that do not set one (0: no deadline)
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "0"))
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out"""
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the response was ready"""
+
+
+# Deadline of the current request on the time.monotonic() clock
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def request_timeout(*candidates: Optional[float]) -> Optional[float]:
+    """First positive timeout given, else REQUEST_TIMEOUT_SECONDS (None: no deadline)"""
+    for seconds in candidates + (REQUEST_TIMEOUT_SECONDS,):
+        if seconds is not None and seconds > 0:
+            return seconds
+    return None
+
+
+@contextmanager
+def request_deadline(timeout_seconds: Optional[float]) -> Iterator[Optional[float]]:
+    """Sets the deadline of the block and the tasks it starts (None: no deadline)"""
+    deadline = time.monotonic() + timeout_seconds if timeout_seconds is not None else None
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_seconds() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one"""
+    deadline = _deadline.get()
+    return deadline - time.monotonic() if deadline is not None else None
+
+
+def check_deadline(stage: str) -> None:
+    """Raises DeadlineExceeded if the deadline has passed (before starting more work)"""
+    remaining = remaining_seconds()
+    if remaining is not None and remaining <= 0:
+        CANCELLATIONS.inc(reason="deadline", stage=stage)
+        raise DeadlineExceeded(f"Request deadline exceeded before {stage}")
+
+
+async def within_deadline(awaitable: Awaitable[Any], stage: str) -> Any:
+    """Awaits awaitable, cancelling it when the deadline passes"""
+    remaining = remaining_seconds()
+    if remaining is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, max(remaining, 0))
+    except asyncio.TimeoutError:
+        CANCELLATIONS.inc(reason="deadline", stage=stage)
+        raise DeadlineExceeded(f"Request deadline exceeded during {stage}")
+
+
+async def _disconnected(request) -> None:
+    """Returns once the server reports the client gone (the request body is already read)"""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def until_disconnect(request, awaitable: Awaitable[Any], stage: str) -> Any:
+    """
+    Awaits awaitable while the client of request (a Starlette Request) is
+    connected; cancels it and raises ClientDisconnected when the client leaves.
+    """
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(_disconnected(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+        task.cancel()
+        CANCELLATIONS.inc(reason="disconnect", stage=stage)
+        raise ClientDisconnected(f"Client disconnected during {stage}")
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
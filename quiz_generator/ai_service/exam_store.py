@@ -0,0 +1,215 @@
+"""
+Exam Store
+Generated exams are persisted server-side under an exam id, so grading
+requests only carry the id and the answers. Correct answers never leave the
+server for grading, and the answer key is computed once per exam and kept in
+an in-memory hot cache in front of the store.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+# Handle imports for both module and direct execution
+try:
+    from .state import MCQ
+    from .scoring import AnswerKey
+    from .shared import SQLITE_BUSY_TIMEOUT_SECONDS, offload
+except ImportError:
+    from state import MCQ
+    from scoring import AnswerKey
+    from shared import SQLITE_BUSY_TIMEOUT_SECONDS, offload
+
+
+class StoredExam(BaseModel):
+    """A generated exam as persisted by the service"""
+    exam_id: str
+    course_name: str
+    teacher_name: str
+    learning_outcomes: List[str]
+    passing_score: float
+    mcqs: List[MCQ]
+    # Compact answer key: correct letters in question order, e.g. "BADC..."
+    answer_key: str
+    created_at: float = Field(default_factory=time.time)
+
+
+def make_stored_exam(
+    course_name: str,
+    teacher_name: str,
+    learning_outcomes: List[str],
+    passing_score: float,
+    mcqs: List[MCQ]
+) -> StoredExam:
+    """
+    Builds the stored form of an exam. The id is a content hash, so the same
+    exam (e.g. served from the exam cache) is stored once.
+    """
+    material = json.dumps([
+        course_name,
+        teacher_name,
+        learning_outcomes,
+        passing_score,
+        [mcq.model_dump() for mcq in mcqs]
+    ], separators=(",", ":"), sort_keys=True)
+    return StoredExam(
+        exam_id=hashlib.sha256(material.encode("utf-8")).hexdigest()[:32],
+        course_name=course_name,
+        teacher_name=teacher_name,
+        learning_outcomes=learning_outcomes,
+        passing_score=passing_score,
+        mcqs=mcqs,
+        answer_key="".join(mcq.correct_answer for mcq in mcqs)
+    )
+
+
+class ExamStore:
+    """Interface for exam persistence"""
+
+    # False for stores whose calls never wait on I/O
+    blocking = True
+
+    def save(self, exam: StoredExam) -> None:
+        raise NotImplementedError
+
+    def get(self, exam_id: str) -> Optional[StoredExam]:
+        raise NotImplementedError
+
+
+class MemoryExamStore(ExamStore):
+    """Process-local exam store"""
+
+    blocking = False
+
+    def __init__(self):
+        self._exams = {}
+        self._lock = threading.Lock()
+
+    def save(self, exam: StoredExam) -> None:
+        with self._lock:
+            self._exams[exam.exam_id] = exam
+
+    def get(self, exam_id: str) -> Optional[StoredExam]:
+        with self._lock:
+            return self._exams.get(exam_id)
+
+
+class SQLiteExamStore(ExamStore):
+    """Exams persisted in SQLite so they survive restarts and are shared by workers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS exams ("
+            "exam_id TEXT PRIMARY KEY, payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def save(self, exam: StoredExam) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO exams (exam_id, payload, created_at) VALUES (?, ?, ?)",
+                (exam.exam_id, exam.model_dump_json(), exam.created_at)
+            )
+            self._conn.commit()
+
+    def get(self, exam_id: str) -> Optional[StoredExam]:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM exams WHERE exam_id = ?", (exam_id,)).fetchone()
+        return StoredExam.model_validate_json(row[0]) if row else None
+
+
+class CachedExamStore(ExamStore):
+    """LRU hot cache of exams and their answer keys in front of a backing store"""
+
+    def __init__(self, backend: ExamStore, max_entries: int = 1024):
+        self.backend = backend
+        self.max_entries = max_entries
+        self._hot: "OrderedDict[str, Tuple[StoredExam, AnswerKey]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, exam: StoredExam) -> Tuple[StoredExam, AnswerKey]:
+        entry = (exam, AnswerKey(exam.mcqs))
+        with self._lock:
+            self._hot[exam.exam_id] = entry
+            self._hot.move_to_end(exam.exam_id)
+            while len(self._hot) > self.max_entries:
+                self._hot.popitem(last=False)
+        return entry
+
+    def save(self, exam: StoredExam) -> None:
+        self.backend.save(exam)
+        self._remember(exam)
+
+    def get(self, exam_id: str) -> Optional[StoredExam]:
+        entry = self.get_with_key(exam_id)
+        return entry[0] if entry else None
+
+    def _hot_lookup(self, exam_id: str) -> Optional[Tuple[StoredExam, AnswerKey]]:
+        with self._lock:
+            entry = self._hot.get(exam_id)
+            if entry is not None:
+                self._hot.move_to_end(exam_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def get_with_key(self, exam_id: str) -> Optional[Tuple[StoredExam, AnswerKey]]:
+        """Returns the exam and its prebuilt answer key, loading from the backend on a miss"""
+        entry = self._hot_lookup(exam_id)
+        if entry is not None:
+            return entry
+        exam = self.backend.get(exam_id)
+        return self._remember(exam) if exam is not None else None
+
+    async def asave(self, exam: StoredExam) -> None:
+        """Async variant of save; a blocking backend is written from a worker thread"""
+        if self.backend.blocking:
+            await offload(self.backend.save, exam)
+        else:
+            self.backend.save(exam)
+        self._remember(exam)
+
+    async def aget_with_key(self, exam_id: str) -> Optional[Tuple[StoredExam, AnswerKey]]:
+        """Async variant of get_with_key; hot cache hits never leave the event loop"""
+        entry = self._hot_lookup(exam_id)
+        if entry is not None:
+            return entry
+        exam = await offload(self.backend.get, exam_id) if self.backend.blocking else self.backend.get(exam_id)
+        return self._remember(exam) if exam is not None else None
+
+    def stats(self) -> dict:
+        return {"hot_entries": len(self._hot), "hot_hits": self.hits, "hot_misses": self.misses}
+
+
+def build_exam_store() -> CachedExamStore:
+    """
+    EXAM_STORE_SQLITE_PATH selects the database (default: ai_service/exams.db;
+    ":memory:" keeps exams in-process). EXAM_STORE_HOT_ENTRIES sizes the hot cache.
+    """
+    path = os.getenv("EXAM_STORE_SQLITE_PATH", str(Path(__file__).parent / "exams.db"))
+    backend = MemoryExamStore() if path == ":memory:" else SQLiteExamStore(path)
+    return CachedExamStore(backend, max_entries=int(os.getenv("EXAM_STORE_HOT_ENTRIES", "1024")))
+
+
+# Exam store will be initialized lazily when needed
+_exam_store = None
+
+def get_exam_store() -> CachedExamStore:
+    """Return the process-wide exam store"""
+    global _exam_store
+    if _exam_store is None:
+        _exam_store = build_exam_store()
+    return _exam_store
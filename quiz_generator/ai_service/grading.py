@@ -0,0 +1,106 @@
+"""
+Batch Grading
+Grades many answer sheets against one exam. The answer key is built once per
+exam and each sheet is validated and scored in a single pass by the grading
+engine (scoring.py); this module adds class-level aggregates and
+certificates for the passing students.
+"""
+import asyncio
+import statistics
+from typing import Any, Dict, List
+
+# Handle imports for both module and direct execution
+try:
+    from .state import ExamState
+    from .nodes import acertificate_node
+    from .scoring import AnswerKey, GradedSheet
+    from .metrics import instrument_node
+except ImportError:
+    from state import ExamState
+    from nodes import acertificate_node
+    from scoring import AnswerKey, GradedSheet
+    from metrics import instrument_node
+
+
+def class_summary(key: AnswerKey, results: List[GradedSheet]) -> Dict[str, Any]:
+    """Class-level aggregates over the graded sheets of a batch"""
+    graded = [result for result in results if result.graded]
+    percentages = [result.percentage for result in graded]
+    passed = sum(1 for result in graded if result.passed)
+
+    question_correct = [0] * len(key)
+    for result in graded:
+        for position, (code, correct) in enumerate(zip(result.answers, key.correct_codes)):
+            question_correct[position] += code == correct
+    outcome_totals = [[0, 0] for _ in key.outcomes]
+    for position, correct in enumerate(question_correct):
+        totals = outcome_totals[key.outcome_positions[position]]
+        totals[0] += correct
+        totals[1] += len(graded)
+
+    return {
+        "submissions": len(results),
+        "graded": len(graded),
+        "invalid": len(results) - len(graded),
+        "passed": passed,
+        "failed": len(graded) - passed,
+        "pass_rate": round(passed / len(graded) * 100, 2) if graded else 0.0,
+        "mean_percentage": round(statistics.mean(percentages), 2) if percentages else None,
+        "median_percentage": round(statistics.median(percentages), 2) if percentages else None,
+        "min_percentage": round(min(percentages), 2) if percentages else None,
+        "max_percentage": round(max(percentages), 2) if percentages else None,
+        "question_correct_rates": {
+            question_id: round(correct / len(graded) * 100, 2) if graded else 0.0
+            for question_id, correct in zip(key.question_ids, question_correct)
+        },
+        "outcome_correct_rates": {
+            outcome: round(correct / answered * 100, 2)
+            for outcome, (correct, answered) in zip(key.outcomes, outcome_totals)
+            if answered
+        }
+    }
+
+
+# Certificates are generated outside the grading graph; keep the node's timings
+_acertificate = instrument_node("certificate", acertificate_node)
+
+
+async def agenerate_certificate(
+    course_name: str,
+    teacher_name: str,
+    passing_score: float,
+    student_name: str,
+    percentage: float
+) -> Dict[str, Any]:
+    """Runs the certificate agent for one passing student; returns the node update"""
+    state = ExamState(
+        course_name=course_name,
+        teacher_name=teacher_name,
+        student_name=student_name,
+        passing_score=passing_score,
+        percentage=percentage,
+        passed=True
+    )
+    return await _acertificate(state)
+
+
+async def agenerate_certificates(
+    course_name: str,
+    teacher_name: str,
+    passing_score: float,
+    students: List[Dict[str, Any]],
+    max_concurrency: int = 5
+) -> List[Dict[str, Any]]:
+    """
+    Runs the certificate agent for each passing student, at most
+    max_concurrency LLM calls at a time. Returns the node updates in order.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def certificate_for(student: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            return await agenerate_certificate(
+                course_name, teacher_name, passing_score, student["student_name"], student["percentage"]
+            )
+
+    return await asyncio.gather(*[certificate_for(student) for student in students])
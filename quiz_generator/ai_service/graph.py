@@ -2,16 +2,54 @@
 LangGraph Workflow Definition
 Orchestrates the multi-agent system with conditional routing.
 """
-from typing import Literal
+import os
+from typing import List, Literal, Union
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
+from langgraph.types import Send
 
 # Handle imports for both module and direct execution
 try:
-    from .state import ExamState
-    from .nodes import generate_mcq_node, supervisor_node, grading_node, certificate_node
+    from .state import ExamState, OutcomeGenerationTask
+    from .metrics import instrument_node
+    from .nodes import (
+        generate_mcq_node, agenerate_mcq_node, repair_coverage_node, arepair_coverage_node,
+        supervisor_node, grading_node,
+        certificate_node, acertificate_node,
+        plan_mcq_generation_node, generate_outcome_mcqs_node, agenerate_outcome_mcqs_node,
+        merge_mcqs_node, questions_per_outcome, chunk_outcomes
+    )
 except ImportError:
-    from state import ExamState
-    from nodes import generate_mcq_node, supervisor_node, grading_node, certificate_node
+    from state import ExamState, OutcomeGenerationTask
+    from metrics import instrument_node
+    from nodes import (
+        generate_mcq_node, agenerate_mcq_node, repair_coverage_node, arepair_coverage_node,
+        supervisor_node, grading_node,
+        certificate_node, acertificate_node,
+        plan_mcq_generation_node, generate_outcome_mcqs_node, agenerate_outcome_mcqs_node,
+        merge_mcqs_node, questions_per_outcome, chunk_outcomes
+    )
+
+
+# Upper bound on fan-out branches (LLM calls) running at the same time
+FANOUT_MAX_CONCURRENCY = int(os.getenv("MCQ_FANOUT_MAX_CONCURRENCY", "4"))
+
+
+def _node(name: str, func, afunc=None):
+    """
+    Wraps a node function with timing metrics. LLM nodes carry a sync and an
+    async implementation so the compiled graph supports both invoke() and ainvoke()
+    """
+    if afunc is None:
+        return instrument_node(name, func)
+    return RunnableLambda(instrument_node(name, func), afunc=instrument_node(name, afunc))
+
+
+def should_repair_coverage(state: ExamState) -> Literal["repair", "end"]:
+    """Conditional routing: follow-up generation while learning outcomes are uncovered"""
+    if state.generation_status == "pending" and state.pending_outcomes:
+        return "repair"
+    return "end"
 
 
 def should_grade(state: ExamState) -> Literal["grade", "error"]:
@@ -28,25 +66,73 @@ def should_generate_certificate(state: ExamState) -> Literal["certificate", "end
     return "end"
 
 
+def fan_out_outcomes(state: ExamState) -> Union[List[Send], str]:
+    """Conditional routing: one generation branch per chunk of pending outcomes"""
+    if state.generation_status == "failed" or not state.pending_outcomes:
+        return END
+    quota = questions_per_outcome(len(state.learning_outcomes))
+    return [
+        Send("generate_outcome_mcqs", OutcomeGenerationTask(
+            course_name=state.course_name,
+            teacher_name=state.teacher_name,
+            student_name=state.student_name,
+            learning_outcomes=chunk,
+            questions_per_outcome=quota,
+            attempt=state.generation_attempts
+        ))
+        for chunk in chunk_outcomes(state.pending_outcomes)
+    ]
+
+
 def build_exam_generation_graph() -> StateGraph:
     """
     Builds the LangGraph workflow for exam generation.
-    Flow: generate_mcq -> END
+    Flow: generate_mcq -> (outcomes uncovered) -> repair_coverage -> ... -> END
     """
     workflow = StateGraph(ExamState)
     
     # Add nodes
-    workflow.add_node("generate_mcq", generate_mcq_node)
+    workflow.add_node("generate_mcq", _node("generate_mcq", generate_mcq_node, agenerate_mcq_node))
+    workflow.add_node("repair_coverage", _node("repair_coverage", repair_coverage_node, arepair_coverage_node))
     
     # Set entry point
     workflow.set_entry_point("generate_mcq")
     
-    # Add edges
-    workflow.add_edge("generate_mcq", END)
+    # Repair loops until every outcome is covered or its retry budget is spent
+    routes = {"repair": "repair_coverage", "end": END}
+    workflow.add_conditional_edges("generate_mcq", should_repair_coverage, routes)
+    workflow.add_conditional_edges("repair_coverage", should_repair_coverage, routes)
     
     return workflow.compile()
 
 
+def build_fanout_exam_generation_graph() -> StateGraph:
+    """
+    Builds the LangGraph workflow for fan-out exam generation.
+    Flow: plan -> generate_outcome_mcqs (one branch per outcome chunk) -> merge
+          -> (outcomes still missing) -> generate_outcome_mcqs -> merge -> END
+    """
+    workflow = StateGraph(ExamState)
+    
+    # Add nodes
+    workflow.add_node("plan_generation", _node("plan_generation", plan_mcq_generation_node))
+    workflow.add_node(
+        "generate_outcome_mcqs",
+        _node("generate_outcome_mcqs", generate_outcome_mcqs_node, agenerate_outcome_mcqs_node)
+    )
+    workflow.add_node("merge_mcqs", _node("merge_mcqs", merge_mcqs_node))
+    
+    # Set entry point
+    workflow.set_entry_point("plan_generation")
+    
+    # Fan out to the branches, then retry only the outcomes left uncovered
+    workflow.add_conditional_edges("plan_generation", fan_out_outcomes, ["generate_outcome_mcqs", END])
+    workflow.add_edge("generate_outcome_mcqs", "merge_mcqs")
+    workflow.add_conditional_edges("merge_mcqs", fan_out_outcomes, ["generate_outcome_mcqs", END])
+    
+    return workflow.compile().with_config(max_concurrency=FANOUT_MAX_CONCURRENCY)
+
+
 def build_grading_graph() -> StateGraph:
     """
     Builds the LangGraph workflow for grading and certificate generation.
@@ -55,9 +141,9 @@ def build_grading_graph() -> StateGraph:
     workflow = StateGraph(ExamState)
     
     # Add nodes
-    workflow.add_node("supervisor", supervisor_node)
-    workflow.add_node("grading", grading_node)
-    workflow.add_node("certificate", certificate_node)
+    workflow.add_node("supervisor", _node("supervisor", supervisor_node))
+    workflow.add_node("grading", _node("grading", grading_node))
+    workflow.add_node("certificate", _node("certificate", certificate_node, acertificate_node))
     
     # Set entry point
     workflow.set_entry_point("supervisor")
@@ -84,3 +170,33 @@ def build_grading_graph() -> StateGraph:
     workflow.add_edge("certificate", END)
     
     return workflow.compile()
+
+
+class GraphRegistry:
+    """
+    Holds the compiled workflows for the lifetime of the process.
+    Compiled LangGraph graphs are stateless between invocations, so one
+    instance per workflow can be shared by every request.
+    """
+
+    def __init__(self):
+        self.exam_generation = build_exam_generation_graph()
+        self.exam_generation_fanout = build_fanout_exam_generation_graph()
+        self.grading = build_grading_graph()
+
+    def exam_generation_for(self, mode: str):
+        """Returns the exam generation graph for a generation mode ("single" or "fanout")"""
+        if mode == "fanout":
+            return self.exam_generation_fanout
+        return self.exam_generation
+
+
+# Registry will be compiled lazily (or eagerly from the FastAPI lifespan)
+_registry = None
+
+def get_graph_registry() -> GraphRegistry:
+    """Return the process-wide graph registry, compiling the workflows on first use"""
+    global _registry
+    if _registry is None:
+        _registry = GraphRegistry()
+    return _registry
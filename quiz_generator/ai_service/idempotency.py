@@ -0,0 +1,197 @@
+"""
+Idempotency Keys
+Requests sent with an Idempotency-Key header run at most once per key: a
+retry of a request that is still running waits for that run, and a retry of
+a finished request gets the stored response, so a client that timed out and
+retried does not start a second generation (and second LLM bill).
+
+Responses are kept in a bounded LRU for IDEMPOTENCY_TTL_SECONDS. With a
+shared state backend the keys are claimed across worker processes, and a
+retry that lands on another worker waits for the stored response. Only
+successful responses are kept: errors and responses with success=false
+release the key so a retry runs again.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# Handle imports for both module and direct execution
+try:
+    from .shared import SharedBackend, get_shared_backend
+    from .metrics import IDEMPOTENT_REQUESTS
+    from .deadlines import check_deadline, within_deadline
+except ImportError:
+    from shared import SharedBackend, get_shared_backend
+    from metrics import IDEMPOTENT_REQUESTS
+    from deadlines import check_deadline, within_deadline
+
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "1024"))
+# How long a retry waits for a run of the same key on another worker
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "120"))
+
+MAX_KEY_LENGTH = 255
+
+# (fingerprint, response, expires_at)
+StoredResponse = Tuple[str, Dict[str, Any], float]
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different body"""
+
+
+class IdempotencyConflict(Exception):
+    """The request for this key is still running elsewhere"""
+
+
+def request_fingerprint(*parts: str) -> str:
+    """Hash of the request body (and parameters) a key was first used with"""
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """Runs each (endpoint, key) once and replays its response to retries"""
+
+    NAMESPACE = "idempotency"
+    # A claim of a worker that died mid-request is released after this long
+    PENDING_TTL_SECONDS = 600.0
+    POLL_INTERVAL_SECONDS = 0.25
+
+    def __init__(
+        self,
+        max_entries: int = IDEMPOTENCY_MAX_ENTRIES,
+        ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS,
+        backend: Optional[SharedBackend] = None,
+        wait_seconds: float = IDEMPOTENCY_WAIT_SECONDS
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self.wait_seconds = wait_seconds
+        self._responses: "OrderedDict[str, StoredResponse]" = OrderedDict()
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key: str) -> Optional[StoredResponse]:
+        with self._lock:
+            entry = self._responses.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                del self._responses[key]
+                return None
+            self._responses.move_to_end(key)
+            return entry
+
+    def _remember(self, key: str, entry: StoredResponse) -> None:
+        with self._lock:
+            self._responses[key] = entry
+            while len(self._responses) > self.max_entries:
+                self._responses.popitem(last=False)
+
+    @staticmethod
+    def _check(fingerprint: str, stored_fingerprint: str) -> None:
+        if fingerprint != stored_fingerprint:
+            raise IdempotencyKeyReused("Idempotency-Key was already used with a different request")
+
+    async def _execute(self, key: str, fingerprint: str, fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        stored = False
+        try:
+            response = await fn()
+            if response.get("success") is not False:
+                expires_at = time.time() + self.ttl_seconds
+                self._remember(key, (fingerprint, response, expires_at))
+                if self.backend is not None:
+                    payload = json.dumps({"fingerprint": fingerprint, "response": response})
+                    await self.backend.aset(self.NAMESPACE, key, payload, self.ttl_seconds)
+                stored = True
+            return response
+        finally:
+            if not stored and self.backend is not None:
+                await self.backend.adelete(self.NAMESPACE, key)
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def _claim(self, key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        Claims the key in the shared backend. Returns None once claimed, or the
+        response another worker stored while this request waited.
+        """
+        deadline = time.monotonic() + self.wait_seconds
+        pending = json.dumps({"fingerprint": fingerprint, "response": None})
+        while not await self.backend.aadd(self.NAMESPACE, key, pending, self.PENDING_TTL_SECONDS):
+            payload = await self.backend.aget(self.NAMESPACE, key)
+            if payload is not None:
+                entry = json.loads(payload)
+                self._check(fingerprint, entry["fingerprint"])
+                if entry["response"] is not None:
+                    self._remember(key, (fingerprint, entry["response"], time.time() + self.ttl_seconds))
+                    return entry["response"]
+            if time.monotonic() >= deadline:
+                raise IdempotencyConflict("A request with this Idempotency-Key is still in progress")
+            check_deadline("idempotency_wait")
+            await asyncio.sleep(self.POLL_INTERVAL_SECONDS)
+        return None
+
+    async def run(
+        self,
+        endpoint: str,
+        idempotency_key: str,
+        fingerprint: str,
+        fn: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Returns (response, replayed). fn runs only if no request with this key
+        is stored or running; it runs in its own task, so a client that
+        disconnects does not cancel it for its retry.
+        """
+        key = f"{endpoint}:{idempotency_key}"
+        entry = self._lookup(key)
+        if entry is not None:
+            self._check(fingerprint, entry[0])
+            IDEMPOTENT_REQUESTS.inc(endpoint=endpoint, result="replayed")
+            return entry[1], True
+
+        with self._lock:
+            flight = self._inflight.get(key)
+        if flight is None and self.backend is not None:
+            response = await self._claim(key, fingerprint)
+            if response is not None:
+                IDEMPOTENT_REQUESTS.inc(endpoint=endpoint, result="replayed")
+                return response, True
+        with self._lock:
+            flight = self._inflight.get(key)
+            attached = flight is not None
+            if not attached:
+                task = asyncio.ensure_future(self._execute(key, fingerprint, fn))
+                # Retrieved here in case every request waiting for it is gone
+                task.add_done_callback(lambda done: done.cancelled() or done.exception())
+                flight = self._inflight[key] = (fingerprint, task)
+
+        self._check(fingerprint, flight[0])
+        IDEMPOTENT_REQUESTS.inc(endpoint=endpoint, result="attached" if attached else "new")
+        if attached:
+            # The run keeps the first request's deadline; a retry waits within its own
+            return await within_deadline(asyncio.shield(flight[1]), "idempotency_wait"), True
+        return await asyncio.shield(flight[1]), False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"responses": len(self._responses), "inflight": len(self._inflight)}
+
+
+# Store will be initialized lazily when needed
+_idempotency_store = None
+
+def get_idempotency_store() -> IdempotencyStore:
+    """Return the process-wide idempotency store (keys shared across workers when the backend is)"""
+    global _idempotency_store
+    if _idempotency_store is None:
+        backend = get_shared_backend()
+        _idempotency_store = IdempotencyStore(backend=backend if backend.shared else None)
+    return _idempotency_store
@@ -0,0 +1,416 @@
+"""
+Asynchronous Jobs
+Long-running exam generations submitted as jobs: the client gets a job id
+immediately, a bounded pool of workers runs the generation, and the result
+is fetched by polling (or pushed to an optional callback URL).
+"""
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from pydantic import BaseModel, Field
+
+# Handle imports for both module and direct execution
+try:
+    from .shared import SQLITE_BUSY_TIMEOUT_SECONDS, SharedBackend, get_shared_backend, offload
+except ImportError:
+    from shared import SQLITE_BUSY_TIMEOUT_SECONDS, SharedBackend, get_shared_backend, offload
+
+logger = logging.getLogger(__name__)
+
+# Hosts callback URLs may point to (comma-separated); when unset, any public address
+JOB_CALLBACK_ALLOWED_HOSTS = frozenset(
+    host.strip().lower() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+)
+
+
+def _is_public_address(address: str) -> bool:
+    """False for loopback, private, link-local, reserved and multicast addresses (ValueError if not an IP)"""
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if getattr(ip, "ipv4_mapped", None) is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_callback_url(url: str) -> str:
+    """
+    Returns url if the server may POST job results to it, else raises
+    ValueError: it must be http(s), and its host on JOB_CALLBACK_ALLOWED_HOSTS
+    when that is set, otherwise not localhost or a non-public IP address.
+    Host names are resolved and checked again before delivery.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("callback_url must be an http or https URL with a host")
+    host = parts.hostname
+    if JOB_CALLBACK_ALLOWED_HOSTS:
+        if host not in JOB_CALLBACK_ALLOWED_HOSTS:
+            raise ValueError(f"callback_url host '{host}' is not in JOB_CALLBACK_ALLOWED_HOSTS")
+        return url
+    if host == "localhost" or host.endswith(".localhost"):
+        raise ValueError("callback_url must not point to localhost")
+    try:
+        public = _is_public_address(host)
+    except ValueError:
+        # A host name, checked once resolved
+        return url
+    if not public:
+        raise ValueError("callback_url must not point to a loopback, private or link-local address")
+    return url
+
+
+async def acheck_callback_address(url: str) -> None:
+    """Resolves the callback host and raises ValueError unless every address is public (allowlisted hosts are trusted)"""
+    check_callback_url(url)
+    if JOB_CALLBACK_ALLOWED_HOSTS:
+        return
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    addresses = await asyncio.get_running_loop().getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+    if not all(_is_public_address(address[4][0]) for address in addresses):
+        raise ValueError(f"callback_url host '{parts.hostname}' resolves to a non-public address")
+
+
+class Job(BaseModel):
+    """A submitted unit of work and its outcome"""
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    kind: str
+    status: Literal["queued", "running", "completed", "failed"] = "queued"
+    request: Dict[str, Any]
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    callback_url: Optional[str] = None
+    callback_status: Optional[str] = None
+    created_at: float = Field(default_factory=time.time)
+    updated_at: float = Field(default_factory=time.time)
+
+
+class JobStore:
+    """Interface for job persistence"""
+
+    # False for stores whose calls never wait on I/O
+    blocking = True
+
+    def save(self, job: Job) -> None:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+
+    def unfinished(self) -> List[Job]:
+        """Jobs that were queued or running, for recovery after a restart"""
+        return []
+
+    def claim(self, job: Job) -> bool:
+        """
+        Takes an unfinished job for re-queueing. Stores shared by several
+        workers let exactly one of them recover each job.
+        """
+        return True
+
+
+class InMemoryJobStore(JobStore):
+    """Process-local job store; finished jobs beyond max_jobs are evicted oldest first"""
+
+    blocking = False
+
+    def __init__(self, max_jobs: int = 10000):
+        self.max_jobs = max_jobs
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def save(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[job.id] = job
+            if len(self._jobs) > self.max_jobs:
+                for job_id, stored in list(self._jobs.items()):
+                    if stored.status in ("completed", "failed"):
+                        del self._jobs[job_id]
+                        break
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+class SQLiteJobStore(JobStore):
+    """Durable job store; unfinished jobs are re-queued when the service restarts"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def save(self, job: Job) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, status, payload, updated_at) VALUES (?, ?, ?, ?)",
+                (job.id, job.status, job.model_dump_json(), job.updated_at)
+            )
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.model_validate_json(row[0]) if row else None
+
+    def unfinished(self) -> List[Job]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM jobs WHERE status IN ('queued', 'running') ORDER BY updated_at"
+            ).fetchall()
+        return [Job.model_validate_json(payload) for (payload,) in rows]
+
+    def claim(self, job: Job) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET updated_at = ? WHERE id = ? AND updated_at = ?",
+                (time.time(), job.id, job.updated_at)
+            )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+
+class SharedJobStore(JobStore):
+    """Jobs in the shared state backend, so any worker can report on any job"""
+
+    NAMESPACE = "jobs"
+
+    def __init__(self, backend: SharedBackend, ttl_seconds: float = 7 * 86400):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.blocking = backend.blocking
+
+    def save(self, job: Job) -> None:
+        self.backend.set(self.NAMESPACE, job.id, job.model_dump_json(), ttl_seconds=self.ttl_seconds)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        payload = self.backend.get(self.NAMESPACE, job_id)
+        return Job.model_validate_json(payload) if payload is not None else None
+
+    def unfinished(self) -> List[Job]:
+        jobs = [Job.model_validate_json(payload) for _, payload in self.backend.scan(self.NAMESPACE)]
+        return sorted((job for job in jobs if job.status in ("queued", "running")), key=lambda job: job.updated_at)
+
+    def claim(self, job: Job) -> bool:
+        return self.backend.add("job_claims", f"{job.id}:{job.updated_at}", "1", ttl_seconds=self.ttl_seconds)
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+class JobManager:
+    """
+    Runs jobs on a fixed number of asyncio workers fed by a bounded queue.
+    runner(job.request) returns the result dict; a result with "success": False
+    marks the job failed. Calls to a blocking store run in a worker thread.
+
+    With a durable or shared store, the manager holds a lease on the jobs it
+    has queued or is running: their updated_at is refreshed every third of
+    lease_seconds. Unfinished jobs whose lease has expired (their worker died
+    or was restarted) are reclaimed by any manager with room in its queue.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        runners: Dict[str, Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]],
+        workers: int = 4,
+        queue_size: int = 100,
+        callback_timeout: float = 10.0,
+        lease_seconds: float = 60.0
+    ):
+        self.store = store
+        self.runners = runners
+        self.workers = workers
+        self.callback_timeout = callback_timeout
+        self.lease_seconds = lease_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._queue_size = queue_size
+        self._tasks: List[asyncio.Task] = []
+        # Workers currently running a job (drained on shutdown)
+        self._busy: set = set()
+        self._draining = False
+        # Latest state of the queued and running jobs this manager holds a lease on
+        self._owned: Dict[str, Job] = {}
+        # Serializes job writes, so a heartbeat never saves a stale status
+        self._save_lock = asyncio.Lock()
+
+    @property
+    def started(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        """Starts the workers on the running event loop, and the lease upkeep that recovers abandoned jobs"""
+        if self.started:
+            return
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._tasks = [asyncio.get_running_loop().create_task(self._worker()) for _ in range(self.workers)]
+        self._draining = False
+        self._tasks.append(asyncio.get_running_loop().create_task(self._maintain_leases()))
+
+    async def _store_call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await offload(fn, *args) if self.store.blocking else fn(*args)
+
+    async def _maintain_leases(self) -> None:
+        while not self._draining:
+            try:
+                await self._reclaim_expired()
+                await asyncio.sleep(self.lease_seconds / 3)
+                for job in list(self._owned.values()):
+                    await self._update(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job lease upkeep failed")
+                await asyncio.sleep(self.lease_seconds / 3)
+
+    async def _reclaim_expired(self) -> None:
+        """Re-queues unfinished jobs nobody has refreshed within lease_seconds, as far as the queue has room"""
+        expired_before = time.time() - self.lease_seconds
+        for job in await self._store_call(self.store.unfinished):
+            if self._queue.full() or self._draining:
+                # The rest is reclaimed on a later pass (or by another worker)
+                return
+            if job.id in self._owned or job.updated_at > expired_before:
+                continue
+            if await self._store_call(self.store.claim, job):
+                logger.info("Reclaiming job %s (lease expired)", job.id)
+                try:
+                    await self._enqueue(job.model_copy(update={"status": "queued"}))
+                except JobQueueFull:
+                    return
+
+    async def stop(self, drain_timeout: float = 0.0) -> None:
+        """
+        Stops the workers. Jobs already running get up to drain_timeout
+        seconds to finish; queued jobs stay in the store, and with a durable
+        or shared store they are reclaimed once their lease expires.
+        """
+        self._draining = True
+        busy = [task for task in self._tasks if task in self._busy]
+        for task in self._tasks:
+            if task not in self._busy:
+                task.cancel()
+        if busy and drain_timeout > 0:
+            await asyncio.wait(busy, timeout=drain_timeout)
+        for task in busy:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._busy.clear()
+
+    async def submit(self, kind: str, request: Dict[str, Any], callback_url: Optional[str] = None) -> Job:
+        if self._draining:
+            raise JobQueueFull("Service is shutting down")
+        self.start()
+        if self._queue.full():
+            raise JobQueueFull(f"Job queue is full ({self._queue.maxsize} jobs waiting)")
+        job = Job(kind=kind, request=request, callback_url=callback_url)
+        await self._enqueue(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await self._store_call(self.store.get, job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": len(self._busy),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self._queue_size
+        }
+
+    async def _enqueue(self, job: Job) -> None:
+        job = await self._update(job)
+        try:
+            self._queue.put_nowait(job.id)
+        except asyncio.QueueFull:
+            # Filled up by other submissions while the job was being saved
+            await self._update(job, status="failed", error="Job queue is full")
+            raise JobQueueFull(f"Job queue is full ({self._queue.maxsize} jobs waiting)")
+
+    async def _update(self, job: Job, **changes: Any) -> Job:
+        """Saves the job with changes applied, renewing the lease while it is unfinished"""
+        async with self._save_lock:
+            job = self._owned.get(job.id, job).model_copy(update=dict(changes, updated_at=time.time()))
+            if job.status in ("queued", "running"):
+                self._owned[job.id] = job
+            else:
+                self._owned.pop(job.id, None)
+            await self._store_call(self.store.save, job)
+        return job
+
+    async def _worker(self) -> None:
+        task = asyncio.current_task()
+        while not self._draining:
+            job_id = await self._queue.get()
+            self._busy.add(task)
+            try:
+                job = await self._store_call(self.store.get, job_id)
+                if job is not None:
+                    await self._run(job)
+            except Exception:
+                logger.exception("Job %s crashed", job_id)
+            finally:
+                self._busy.discard(task)
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        job = await self._update(job, status="running")
+        try:
+            result = await self.runners[job.kind](job.request)
+        except Exception as e:
+            job = await self._update(job, status="failed", error=str(e))
+        else:
+            if result.get("success", True):
+                job = await self._update(job, status="completed", result=result)
+            else:
+                job = await self._update(job, status="failed", result=result, error=result.get("error"))
+        if job.callback_url:
+            await self._notify(job)
+
+    async def _notify(self, job: Job) -> None:
+        """POSTs the finished job to its callback URL; failures are recorded, not retried"""
+        try:
+            await acheck_callback_address(job.callback_url)
+        except (ValueError, OSError) as e:
+            await self._update(job, callback_status=f"rejected: {e}")
+            return
+        try:
+            # Redirects are not followed, so the checked address is the one posted to
+            async with httpx.AsyncClient(timeout=self.callback_timeout) as client:
+                response = await client.post(job.callback_url, json=json.loads(job.model_dump_json()))
+            callback_status = f"delivered ({response.status_code})"
+        except Exception as e:
+            callback_status = f"failed: {str(e)}"
+        await self._update(job, callback_status=callback_status)
+
+
+def build_job_store() -> JobStore:
+    """
+    JOB_STORE_SQLITE_PATH selects the durable SQLite store; otherwise the
+    shared state backend when several workers serve the app, or in-memory
+    """
+    sqlite_path = os.getenv("JOB_STORE_SQLITE_PATH")
+    if sqlite_path:
+        return SQLiteJobStore(sqlite_path)
+    if get_shared_backend().shared:
+        return SharedJobStore(get_shared_backend())
+    return InMemoryJobStore()
@@ -0,0 +1,327 @@
+"""
+LLM Providers
+Builds the chat model used by every LLM node, selected by LLM_PROVIDER:
+- "openai": OpenAI API (OPENAI_API_KEY)
+- "openai_compatible": any OpenAI-compatible endpoint (LLM_BASE_URL), e.g. vLLM, Ollama, LM Studio
+- "fake": deterministic offline stand-in that returns schema-valid MCQ JSON and
+  certificate text, with configurable latency and failure injection, so the
+  service can be tested and benchmarked without a model
+Every provider is wrapped with timeouts, retries and the circuit breaker of
+resilience.py; the OpenAI clients share one tuned keep-alive connection pool.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+from pydantic import PrivateAttr
+
+# Handle imports for both module and direct execution
+try:
+    from .metrics import LLM_METRICS_CALLBACK
+    from .resilience import LLM_TIMEOUT_SECONDS, ResilientChatModel
+except ImportError:
+    from metrics import LLM_METRICS_CALLBACK
+    from resilience import LLM_TIMEOUT_SECONDS, ResilientChatModel
+
+
+DEFAULT_MODELS = {
+    "openai": "gpt-4",
+    "openai_compatible": "",
+    "fake": "fake-exam-llm"
+}
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+
+# Model used for every LLM call; part of the exam cache key
+LLM_MODEL = os.getenv("LLM_MODEL") or DEFAULT_MODELS.get(LLM_PROVIDER, "")
+
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+
+# Connection pool shared by all OpenAI(-compatible) calls of the process
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+LLM_HTTP_KEEPALIVE_SECONDS = float(os.getenv("LLM_HTTP_KEEPALIVE_SECONDS", "30"))
+
+
+class FakeLLMError(Exception):
+    """Failure injected by the fake provider; carries an HTTP-like status code"""
+
+    def __init__(self, message: str, status_code: int = 503):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeExamLLM(BaseChatModel):
+    """
+    Deterministic chat model for offline use. It reads the learning outcomes
+    (and "exactly N ... for EACH" quotas) from the MCQ prompts and answers with
+    matching question JSON; certificate prompts get a filled-in certificate.
+    Identical prompts always produce identical output.
+    """
+    latency: float = 0.0
+    latency_jitter: float = 0.0
+    failure_rate: float = 0.0
+    failure_status_code: int = 503
+    stream_chunk_size: int = 40
+    seed: int = 0
+
+    _random: random.Random = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._random = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-exam-llm"
+
+    # ---------- response content ----------
+
+    @staticmethod
+    def _prompt_text(messages: List[BaseMessage]) -> str:
+        return "\n".join(str(message.content) for message in messages)
+
+    @staticmethod
+    def _field(prompt: str, label: str) -> str:
+        match = re.search(rf"^{re.escape(label)}:\s*(.*)$", prompt, re.MULTILINE)
+        return match.group(1).strip() if match else ""
+
+    @staticmethod
+    def _outcomes(prompt: str) -> List[str]:
+        section = prompt.split("Learning Outcomes:", 1)[-1]
+        outcomes = []
+        for line in section.strip().splitlines():
+            if not line.startswith("- "):
+                break
+            outcomes.append(line[2:].strip())
+        return outcomes
+
+    def _exam_json(self, prompt: str) -> str:
+        outcomes = self._outcomes(prompt) or ["General knowledge"]
+        quota = re.search(r"Generate exactly (\d+) multiple-choice questions for EACH", prompt)
+        if quota:
+            per_outcome = [int(quota.group(1))] * len(outcomes)
+        else:
+            # Spread 10-20 questions round-robin so every outcome is covered
+            total = max(len(outcomes), min(20, max(10, 3 * len(outcomes))))
+            per_outcome = [total // len(outcomes) + (i < total % len(outcomes)) for i in range(len(outcomes))]
+
+        questions = []
+        for outcome, count in zip(outcomes, per_outcome):
+            for n in range(count):
+                digest = hashlib.sha256(f"{outcome}|{n}".encode("utf-8")).digest()
+                number = len(questions) + 1
+                questions.append({
+                    "id": f"q{number}",
+                    "question": f"Which statement best demonstrates: {outcome}? (variant {n + 1})",
+                    "choices": {letter: f"Option {letter} for variant {n + 1}" for letter in "ABCD"},
+                    "correct_answer": "ABCD"[digest[0] % 4],
+                    "learning_outcome": outcome
+                })
+        return json.dumps({"questions": questions}, indent=2)
+
+    def _certificate_text(self, prompt: str, style: bool = False) -> str:
+        """A certificate for the prompt's fields; a style keeps the student placeholders"""
+        student, score, date = (
+            ("$student_name", "$score", "$completion_date") if style else
+            (self._field(prompt, "Student Name"), self._field(prompt, "Score"), self._field(prompt, "Completion Date"))
+        )
+        return (
+            "CERTIFICATE OF COMPLETION\n\n"
+            f"This certifies that {student} has successfully completed "
+            f"the course \"{self._field(prompt, 'Course Name')}\" under the instruction of "
+            f"{self._field(prompt, 'Teacher/Instructor')}, achieving a score of "
+            f"{score}.\n\n"
+            f"Awarded on {date}."
+        )
+
+    def _content(self, messages: List[BaseMessage]) -> str:
+        prompt = self._prompt_text(messages)
+        if "certificate" in prompt.lower() and "Learning Outcomes:" not in prompt:
+            if "$student_name" in prompt:
+                return self._certificate_text(prompt, style=True)
+            if "Student Name:" not in prompt:
+                # Rewrite request: echo the certificate between instructions and closing line
+                paragraphs = str(messages[-1].content).split("\n\n")
+                return "\n\n".join(paragraphs[1:-1]).strip()
+            return self._certificate_text(prompt)
+        return self._exam_json(prompt)
+
+    def _message(self, messages: List[BaseMessage], content: str) -> AIMessage:
+        input_tokens = len(self._prompt_text(messages)) // 4
+        output_tokens = len(content) // 4
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens
+        })
+
+    # ---------- latency and failure injection ----------
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency + self._random.uniform(-self.latency_jitter, self.latency_jitter))
+
+    def _maybe_fail(self) -> None:
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise FakeLLMError(
+                f"Injected fake LLM failure (status {self.failure_status_code})",
+                status_code=self.failure_status_code
+            )
+
+    # ---------- BaseChatModel interface ----------
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._delay())
+        self._maybe_fail()
+        message = self._message(messages, self._content(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._delay())
+        self._maybe_fail()
+        message = self._message(messages, self._content(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        self._maybe_fail()
+        content = self._content(messages)
+        chunks = [content[i:i + self.stream_chunk_size] for i in range(0, len(content), self.stream_chunk_size)]
+        # Spread the configured latency over the stream, like token-by-token output
+        delay = self._delay() / max(len(chunks), 1)
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+
+
+def fake_llm_from_env() -> FakeExamLLM:
+    """Fake provider configured by FAKE_LLM_* environment variables"""
+    return FakeExamLLM(
+        latency=float(os.getenv("FAKE_LLM_LATENCY_SECONDS", "0")),
+        latency_jitter=float(os.getenv("FAKE_LLM_LATENCY_JITTER_SECONDS", "0")),
+        failure_rate=float(os.getenv("FAKE_LLM_FAILURE_RATE", "0")),
+        failure_status_code=int(os.getenv("FAKE_LLM_FAILURE_STATUS", "503")),
+        seed=int(os.getenv("FAKE_LLM_SEED", "0"))
+    )
+
+
+def llm_timeout() -> httpx.Timeout:
+    """Per-attempt HTTP timeouts of LLM calls"""
+    return httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS)
+
+
+# HTTP clients will be initialized lazily when needed
+_http_clients = None
+
+def get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """Return the process-wide (sync, async) HTTP clients used for LLM calls"""
+    global _http_clients
+    if _http_clients is None:
+        limits = httpx.Limits(
+            max_connections=LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_HTTP_KEEPALIVE_SECONDS
+        )
+        _http_clients = (
+            httpx.Client(limits=limits, timeout=llm_timeout()),
+            httpx.AsyncClient(limits=limits, timeout=llm_timeout())
+        )
+    return _http_clients
+
+
+async def close_http_clients() -> None:
+    """Closes the pooled connections (on shutdown)"""
+    global _http_clients
+    if _http_clients is not None:
+        client, async_client = _http_clients
+        _http_clients = None
+        client.close()
+        await async_client.aclose()
+
+
+def _openai_client_options() -> Dict[str, Any]:
+    """Pooled clients and explicit timeouts; retries are left to ResilientChatModel"""
+    client, async_client = get_http_clients()
+    return {
+        "http_client": client,
+        "http_async_client": async_client,
+        "request_timeout": llm_timeout(),
+        "max_retries": 0
+    }
+
+
+def create_llm(provider: Optional[str] = None) -> BaseChatModel:
+    """
+    Builds the chat model for a provider (default: LLM_PROVIDER), with
+    retries, the circuit breaker and call metrics attached
+    """
+    llm = ResilientChatModel(model=_create_llm(provider or LLM_PROVIDER))
+    llm.callbacks = [LLM_METRICS_CALLBACK]
+    return llm
+
+
+def _create_llm(provider: str) -> BaseChatModel:
+    if provider == "fake":
+        return fake_llm_from_env()
+
+    if provider == "openai_compatible":
+        base_url = os.getenv("LLM_BASE_URL")
+        if not base_url or not LLM_MODEL:
+            raise ValueError(
+                "LLM_PROVIDER=openai_compatible requires LLM_BASE_URL "
+                "(e.g. http://localhost:11434/v1) and LLM_MODEL to be set."
+            )
+        return ChatOpenAI(
+            temperature=LLM_TEMPERATURE,
+            model=LLM_MODEL,
+            base_url=base_url,
+            stream_usage=True,
+            # Local servers usually ignore the key, but the client requires one
+            api_key=os.getenv("LLM_API_KEY", "not-needed"),
+            **_openai_client_options()
+        )
+
+    if provider != "openai":
+        raise ValueError(f"Unknown LLM_PROVIDER '{provider}'. Use openai, openai_compatible or fake.")
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError(
+            "OPENAI_API_KEY environment variable is not set. "
+            "Please set it before using the service. "
+            "You can either:\n"
+            "1. Export it: export OPENAI_API_KEY='your-api-key-here'\n"
+            "2. Create a .env file in the ai_service folder with: OPENAI_API_KEY=your-api-key-here\n"
+            "Or run offline with LLM_PROVIDER=fake."
+        )
+    try:
+        return ChatOpenAI(
+            temperature=LLM_TEMPERATURE,
+            model=LLM_MODEL,
+            api_key=api_key,
+            stream_usage=True,
+            **_openai_client_options()
+        )
+    except Exception as e:
+        raise ValueError(
+            f"Failed to initialize OpenAI client: {str(e)}. "
+            "Please check that your OPENAI_API_KEY is correct and valid."
+        )
+
+
+def describe_llm() -> Dict[str, str]:
+    """Provider and model, for the health endpoint"""
+    return {"provider": LLM_PROVIDER, "model": LLM_MODEL}
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Concurrency load test for the async execution path
+Fires N concurrent /generate-exam and /grade-exam requests at the app in-process
+against a fake LLM with a fixed latency, while probing /health. If graph execution
+blocks the event loop the requests queue (wall time ~ N x latency); on the async
+path they overlap (wall time ~ 1 x latency) and /health stays responsive.
+Every request does its own LLM work: generations bypass the exam cache (and
+so coalescing), graded students each get an LLM-written certificate, and the
+admission limits are raised to the concurrency so no request waits for a slot.
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import List
+
+import httpx
+
+# Read at import time by the certificate node
+os.environ.setdefault("CERTIFICATE_MODE", "llm_per_student")
+
+# Handle imports for both module and direct execution
+try:
+    from . import nodes
+    from .admission import get_admission_controller
+    from .llm import FakeExamLLM
+    from .main import app
+except ImportError:
+    import nodes
+    from admission import get_admission_controller
+    from llm import FakeExamLLM
+    from main import app
+
+
+LEARNING_OUTCOMES = [
+    "Understand basic Python syntax and data types",
+    "Write and call functions in Python",
+    "Use control structures (if/else, loops)"
+]
+
+
+async def timed_post(client: httpx.AsyncClient, path: str, payload: dict):
+    start = time.perf_counter()
+    response = await client.post(path, json=payload)
+    response.raise_for_status()
+    return time.perf_counter() - start, response.json()
+
+
+async def probe_health(client: httpx.AsyncClient, stop: asyncio.Event, latencies: List[float]):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/health")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.05)
+
+
+def admit_all(concurrency: int) -> None:
+    """Raises the admission limits so all requests of a phase run at once"""
+    controller = get_admission_controller()
+    controller.max_concurrent = max(controller.max_concurrent, concurrency)
+    for workflow in controller.workflows.values():
+        workflow.max_concurrent = max(workflow.max_concurrent, concurrency)
+
+
+async def run(concurrency: int, latency: float, mode: str):
+    nodes._llm = FakeExamLLM(latency=latency)
+    admit_all(concurrency)
+    exam_request = {
+        "course_name": "Introduction to Python Programming",
+        "teacher_name": "Dr. Jane Smith",
+        "student_name": "John Doe",
+        "learning_outcomes": LEARNING_OUTCOMES,
+        "passing_score": 70.0,
+        "generation_mode": mode,
+        "cache_mode": "bypass"
+    }
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        # Generation: N concurrent exams
+        stop = asyncio.Event()
+        health_latencies: List[float] = []
+        prober = asyncio.create_task(probe_health(client, stop, health_latencies))
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            timed_post(client, "/generate-exam", dict(exam_request, student_name=f"Student {i}"))
+            for i in range(concurrency)
+        ])
+        generation_wall = time.perf_counter() - start
+        stop.set()
+        await prober
+
+        exam = results[0][1]
+        assert exam["success"], exam
+
+        # Grading: N concurrent passing students, each with a certificate LLM call
+        grade_request = dict(exam_request, mcqs=exam["mcqs"], student_answers=[
+            {"question_id": mcq["id"], "answer": mcq["correct_answer"]} for mcq in exam["mcqs"]
+        ])
+        start = time.perf_counter()
+        graded = await asyncio.gather(*[
+            timed_post(client, "/grade-exam", dict(grade_request, student_name=f"Student {i}"))
+            for i in range(concurrency)
+        ])
+        grading_wall = time.perf_counter() - start
+        assert all(result["certificate_text"] for _, result in graded), graded[0][1]
+
+    serial = concurrency * latency
+    print(f"Concurrent requests: {concurrency}, fake LLM latency: {latency:.2f}s, generation mode: {mode}")
+    print("-" * 60)
+    print(f"/generate-exam wall time: {generation_wall:6.2f}s  (serial would be {serial:.2f}s)")
+    print(f"/grade-exam wall time:    {grading_wall:6.2f}s  (serial would be {serial:.2f}s)")
+    if health_latencies:
+        print(f"/health during load:      max {max(health_latencies) * 1000:.1f} ms "
+              f"over {len(health_latencies)} probes")
+    overlapped = generation_wall < serial / 2 and grading_wall < serial / 2
+    print("Result:", "requests overlapped" if overlapped else "requests queued")
+    return overlapped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=1.0, help="Fake LLM latency in seconds")
+    parser.add_argument("--mode", choices=["single", "fanout"], default="single")
+    args = parser.parse_args()
+    overlapped = asyncio.run(run(args.concurrency, args.latency, args.mode))
+    raise SystemExit(0 if overlapped else 1)
+
+
+if __name__ == "__main__":
+    main()
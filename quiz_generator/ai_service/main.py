@@ -2,11 +2,18 @@
 FastAPI Application - REST API for Laravel Integration
 Provides endpoints for exam generation and grading.
 """
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Dict, Optional
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.responses import JSONResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field, field_validator
+from typing import Any, Awaitable, Callable, List, Dict, Literal, Optional, Tuple
+import logging
+import math
 import os
+import time
 from pathlib import Path
 
 # Load environment variables from .env file if it exists
@@ -18,18 +25,127 @@ except ImportError:
     # python-dotenv not installed, skip .env loading
     pass
 
+# Optional dependency: orjson serializes JSON responses several times faster
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:
+    FastJSONResponse = JSONResponse
+
 # Handle imports for both module and direct execution
 try:
-    from .state import ExamState, MCQ, StudentAnswer
-    from .graph import build_exam_generation_graph, build_grading_graph
+    from .state import ExamState, MCQ
+    from .graph import get_graph_registry
+    from .nodes import LLM_MODEL, MCQ_PROMPT_VERSION
+    from .llm import close_http_clients, describe_llm
+    from .resilience import LLM_BREAKER, CircuitOpenError
+    from .cache import exam_cache_key, get_exam_cache
+    from .question_bank import get_question_bank
+    from .streaming import stream_exam_generation, MEDIA_TYPES
+    from .jobs import JobManager, JobQueueFull, build_job_store, check_callback_url
+    from .scoring import AnswerKey, grade_answer_sheet, grade_answer_sheets
+    from .compression import COMPRESSION_ENABLED, CompressionMiddleware, available_encodings
+    from .grading import class_summary, agenerate_certificate, agenerate_certificates
+    from .exam_store import StoredExam, make_stored_exam, get_exam_store
+    from .nodes import apolish_certificate, get_llm
+    from .shared import SERVICE_WORKERS, get_shared_backend, offload
+    from .certificates import get_certificate_styles, get_certificate_templates
+    from .coalescing import GENERATION_COALESCING, GENERATION_FLIGHTS
+    from .admission import Overloaded, get_admission_controller
+    from .deadlines import ClientDisconnected, DeadlineExceeded, request_deadline, request_timeout, until_disconnect, within_deadline
+    from .idempotency import (
+        MAX_KEY_LENGTH, IdempotencyConflict, IdempotencyKeyReused, get_idempotency_store, request_fingerprint
+    )
+    from .metrics import (
+        REGISTRY, HTTP_DURATION, HTTP_RESPONSE_BYTES,
+        start_request_timings, server_timing_header, timed_phase
+    )
 except ImportError:
-    from state import ExamState, MCQ, StudentAnswer
-    from graph import build_exam_generation_graph, build_grading_graph
+    from state import ExamState, MCQ
+    from graph import get_graph_registry
+    from nodes import LLM_MODEL, MCQ_PROMPT_VERSION
+    from llm import close_http_clients, describe_llm
+    from resilience import LLM_BREAKER, CircuitOpenError
+    from cache import exam_cache_key, get_exam_cache
+    from question_bank import get_question_bank
+    from streaming import stream_exam_generation, MEDIA_TYPES
+    from jobs import JobManager, JobQueueFull, build_job_store, check_callback_url
+    from scoring import AnswerKey, grade_answer_sheet, grade_answer_sheets
+    from compression import COMPRESSION_ENABLED, CompressionMiddleware, available_encodings
+    from grading import class_summary, agenerate_certificate, agenerate_certificates
+    from exam_store import StoredExam, make_stored_exam, get_exam_store
+    from nodes import apolish_certificate, get_llm
+    from shared import SERVICE_WORKERS, get_shared_backend, offload
+    from certificates import get_certificate_styles, get_certificate_templates
+    from coalescing import GENERATION_COALESCING, GENERATION_FLIGHTS
+    from admission import Overloaded, get_admission_controller
+    from deadlines import ClientDisconnected, DeadlineExceeded, request_deadline, request_timeout, until_disconnect, within_deadline
+    from idempotency import (
+        MAX_KEY_LENGTH, IdempotencyConflict, IdempotencyKeyReused, get_idempotency_store, request_fingerprint
+    )
+    from metrics import (
+        REGISTRY, HTTP_DURATION, HTTP_RESPONSE_BYTES,
+        start_request_timings, server_timing_header, timed_phase
+    )
+
+
+logger = logging.getLogger(__name__)
+
+# Certificate LLM calls (CERTIFICATE_MODE=llm or llm_per_student) running at the same time for one batch grading request
+BATCH_CERTIFICATE_CONCURRENCY = int(os.getenv("BATCH_CERTIFICATE_CONCURRENCY", "5"))
+
+# Generation mode used when a request does not pick one ("single", "fanout" or "bank")
+DEFAULT_GENERATION_MODE = os.getenv("MCQ_GENERATION_MODE", "single")
+
+# Grading report detail: "full" question results, "ids" without question and
+# outcome text (the caller already has the exam), or "summary" scores only
+ReportDetail = Literal["full", "ids", "summary"]
+
+# Return the per-request timing breakdown (Server-Timing header) on every
+# response; otherwise only when the client sends "X-Timing: 1"
+TIMING_HEADERS = os.getenv("METRICS_TIMING_HEADERS", "false").lower() == "true"
+
+
+# Seconds running jobs (and their LLM calls) get to finish when the service stops
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "30"))
+
+
+def _warm_up() -> None:
+    """
+    Builds the per-process state before the first request: LLM client,
+    stores, shared backend and certificate templates. A missing API key is
+    only logged here; requests report it as before.
+    """
+    get_exam_store()
+    get_shared_backend()
+    get_exam_cache()
+    get_certificate_templates()
+    try:
+        get_llm()
+    except ValueError as e:
+        logger.warning("LLM not initialized at startup: %s", e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Compile the LangGraph workflows and warm up app state once at startup so requests reuse them"""
+    # Handlers (and background jobs, which have no request) use the registry singleton
+    get_graph_registry()
+    _warm_up()
+    get_job_manager().start()
+    yield
+    # The server has stopped accepting requests and drained in-flight ones;
+    # give running jobs the same grace before cancelling them
+    await get_job_manager().stop(drain_timeout=SHUTDOWN_DRAIN_SECONDS)
+    await close_http_clients()
+
 
 app = FastAPI(
     title="AI Quiz Generator Service",
     description="LangGraph-based multi-agent system for MCQ generation and grading",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # CORS middleware for Laravel integration
@@ -41,6 +157,60 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/br for large responses such as full grading reports of big batches
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return FastJSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return FastJSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+    )
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    return FastJSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+    )
+
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    # Nobody reads this response; 499 marks the request in logs and metrics
+    return FastJSONResponse(status_code=499, content={"detail": str(exc)})
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Records latency and response size per route, and collects the timing breakdown"""
+    timings = start_request_timings()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    HTTP_DURATION.observe(elapsed, method=request.method, path=path, status=response.status_code)
+    content_length = response.headers.get("content-length")
+    if content_length:
+        HTTP_RESPONSE_BYTES.observe(int(content_length), path=path)
+
+    if TIMING_HEADERS or request.headers.get("x-timing") == "1":
+        timings["total"] = elapsed
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
 
 # ==================== REQUEST/RESPONSE SCHEMAS ====================
 
@@ -51,6 +221,31 @@ class CourseSetupRequest(BaseModel):
     student_name: str
     learning_outcomes: List[str]
     passing_score: float = Field(default=70.0, ge=0, le=100)
+    generation_mode: Optional[Literal["single", "fanout", "bank"]] = None
+    # "use": serve from the exam cache when possible, "bypass": skip the cache,
+    # "refresh": regenerate and overwrite the cached exam
+    cache_mode: Literal["use", "bypass", "refresh"] = "use"
+    # Time budget in seconds (or the X-Request-Timeout header); LLM work stops when it runs out
+    timeout_seconds: Optional[float] = Field(default=None, gt=0)
+
+
+class QuestionBankPrefillRequest(BaseModel):
+    """Request payload for stocking the question bank of a course"""
+    course_name: str
+    teacher_name: str
+    learning_outcomes: List[str]
+    wait: bool = False  # Block until the pools are stocked instead of refilling in the background
+
+
+class GenerateExamJobRequest(CourseSetupRequest):
+    """Exam generation submitted as a background job"""
+    callback_url: Optional[str] = None  # POSTed the finished job when set
+
+    @field_validator("callback_url")
+    @classmethod
+    def _check_callback_url(cls, url: Optional[str]) -> Optional[str]:
+        """Only public http(s) hosts, or those on JOB_CALLBACK_ALLOWED_HOSTS (422 otherwise)"""
+        return check_callback_url(url) if url is not None else None
 
 
 class MCQResponse(BaseModel):
@@ -67,19 +262,31 @@ class ExamGenerationResponse(BaseModel):
     success: bool
     mcqs: List[MCQResponse]
     total_questions: int
+    exam_id: Optional[str] = None  # Reference for grading requests
+    cached: bool = False
+    coalesced: bool = False  # Served by joining an identical request's generation
     message: Optional[str] = None
     error: Optional[str] = None
 
 
 class StudentAnswerRequest(BaseModel):
-    """Request payload for grading"""
-    course_name: str
-    teacher_name: str
+    """
+    Request payload for grading.
+    Either exam_id (exam stored by the service) or the full mcqs list is required;
+    with exam_id, the course fields are those of the stored exam.
+    """
+    course_name: Optional[str] = None
+    teacher_name: Optional[str] = None
     student_name: str
-    learning_outcomes: List[str]
-    passing_score: float
-    mcqs: List[MCQResponse]
+    learning_outcomes: Optional[List[str]] = None
+    passing_score: Optional[float] = None
+    exam_id: Optional[str] = None
+    mcqs: Optional[List[MCQResponse]] = None
     student_answers: List[Dict[str, str]]  # [{"question_id": "q1", "answer": "A"}]
+    # Queue LLM polishing of the template certificate; fetch it from /jobs/{id}
+    polish_certificate: bool = False
+    # Time budget in seconds (or the X-Request-Timeout header) for the certificate LLM call
+    timeout_seconds: Optional[float] = Field(default=None, gt=0)
 
 
 class GradingResponse(BaseModel):
@@ -93,75 +300,252 @@ class GradingResponse(BaseModel):
     grading_report: Optional[Dict] = None
     certificate_text: Optional[str] = None
     completion_date: Optional[str] = None
+    certificate_polish_job_id: Optional[str] = None
     validation_errors: Optional[List[str]] = None
     error: Optional[str] = None
 
 
+class AnswerSheet(BaseModel):
+    """One student's submission in a batch grading request"""
+    student_name: str
+    student_answers: List[Dict[str, str]]  # [{"question_id": "q1", "answer": "A"}]
+
+
+class BatchGradingRequest(BaseModel):
+    """Request payload for grading a whole class against one exam (exam_id or mcqs)"""
+    course_name: Optional[str] = None
+    teacher_name: Optional[str] = None
+    learning_outcomes: Optional[List[str]] = None
+    passing_score: Optional[float] = None
+    exam_id: Optional[str] = None
+    mcqs: Optional[List[MCQResponse]] = None
+    submissions: List[AnswerSheet]
+    generate_certificates: bool = True
+    polish_certificates: bool = False
+
+
+class StudentGradingResult(BaseModel):
+    """Grading result for one answer sheet of a batch"""
+    student_name: str
+    success: bool
+    raw_score: Optional[int] = None
+    percentage: Optional[float] = None
+    passed: Optional[bool] = None
+    grading_report: Optional[Dict] = None
+    certificate_text: Optional[str] = None
+    completion_date: Optional[str] = None
+    certificate_polish_job_id: Optional[str] = None
+    validation_errors: Optional[List[str]] = None
+    error: Optional[str] = None
+
+
+class CertificateTemplateRequest(BaseModel):
+    """Certificate template for one course ($student_name, $course_name, $teacher_name, $completion_date, $score)"""
+    course_name: str
+    template: str
+
+
+class BatchGradingResponse(BaseModel):
+    """Response after batch grading"""
+    success: bool
+    passing_score: float
+    total_questions: int
+    results: List[StudentGradingResult]
+    summary: Dict
+
+
 # ==================== API ENDPOINTS ====================
 
+async def _store_exam(request: CourseSetupRequest, mcqs: List[MCQ]) -> str:
+    """Persists a generated exam so grading requests can reference it by id"""
+    exam = make_stored_exam(
+        request.course_name,
+        request.teacher_name,
+        request.learning_outcomes,
+        request.passing_score,
+        mcqs
+    )
+    await get_exam_store().asave(exam)
+    return exam.exam_id
+
+
+async def _load_exam(request) -> Tuple[StoredExam, AnswerKey]:
+    """
+    Resolves the exam a grading request refers to: the stored exam for
+    exam_id (with its cached answer key), or the inline mcqs with the
+    request's course fields. A stored exam is never altered by the request,
+    so clients cannot lower its passing score or rename its certificate.
+    """
+    if request.exam_id:
+        entry = await get_exam_store().aget_with_key(request.exam_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail=f"Exam {request.exam_id} not found")
+        exam, key = entry
+    elif request.mcqs:
+        mcqs = [MCQ(**mcq.model_dump()) for mcq in request.mcqs]
+        exam = StoredExam(
+            exam_id="",
+            course_name=request.course_name or "",
+            teacher_name=request.teacher_name or "",
+            learning_outcomes=request.learning_outcomes or [],
+            passing_score=request.passing_score if request.passing_score is not None else 70.0,
+            mcqs=mcqs,
+            answer_key="".join(mcq.correct_answer for mcq in mcqs)
+        )
+        key = AnswerKey(mcqs)
+    else:
+        raise HTTPException(status_code=400, detail="Either exam_id or mcqs is required")
+    return exam, key
+
+
+async def _run_exam_generation(
+    state: ExamState,
+    cache,
+    cache_key: str
+) -> Tuple[Optional[str], List[MCQResponse]]:
+    """
+    Runs the exam generation graph and stores the result in the exam cache.
+    Returns (error, questions); error is None when generation succeeded.
+    """
+    # Run the pre-compiled graph
+    graph = get_graph_registry().exam_generation_for(state.generation_mode)
+    final_state_dict = await graph.ainvoke(state)
+    
+    # Convert dict back to ExamState (LangGraph returns dict)
+    with timed_phase("state_rebuild"):
+        final_state = ExamState(**final_state_dict) if isinstance(final_state_dict, dict) else final_state_dict
+    
+    if final_state.generation_status == "failed":
+        return final_state.generation_error, []
+    
+    # Convert MCQs to response format
+    # Handle case where MCQs might be dicts or MCQ objects
+    mcq_responses = []
+    for mcq in final_state.mcqs:
+        if isinstance(mcq, dict):
+            # Convert dict to MCQResponse
+            mcq_responses.append(MCQResponse(
+                id=mcq.get("id", ""),
+                question=mcq.get("question", ""),
+                choices=mcq.get("choices", {}),
+                correct_answer=mcq.get("correct_answer", ""),
+                learning_outcome=mcq.get("learning_outcome", "")
+            ))
+        else:
+            # MCQ is already an object
+            mcq_responses.append(MCQResponse(
+                id=mcq.id,
+                question=mcq.question,
+                choices=mcq.choices,
+                correct_answer=mcq.correct_answer,
+                learning_outcome=mcq.learning_outcome
+            ))
+    
+    if cache is not None:
+        await cache.aset(cache_key, [mcq.model_dump() for mcq in mcq_responses])
+    return None, mcq_responses
+
+
+async def _admitted(workflow: str, run: Callable[[], Awaitable]):
+    """Runs the request's work once admission control gives it a slot of the workflow"""
+    async with get_admission_controller().admit(workflow):
+        return await run()
+
+
 @app.post("/generate-exam", response_model=ExamGenerationResponse)
-async def generate_exam(request: CourseSetupRequest):
+async def generate_exam(
+    request: CourseSetupRequest,
+    http_request: Request,
+    idempotency_key: Optional[str] = Header(None),
+    x_request_timeout: Optional[float] = Header(None)
+):
     """
     Generate MCQ exam based on learning outcomes.
     
     Laravel sends course setup data, receives structured MCQs.
+    A retry with the same Idempotency-Key gets the first request's exam.
+    Generation stops when the time budget runs out (504) or the client
+    disconnects; with an Idempotency-Key it keeps running for the retry.
     """
+    with request_deadline(request_timeout(request.timeout_seconds, x_request_timeout)):
+        if idempotency_key is None:
+            return await until_disconnect(http_request, _generate_exam(request), "generate_exam")
+        return await _idempotent(
+            "generate-exam", idempotency_key, lambda: _generate_exam(request), request.model_dump_json()
+        )
+
+
+async def _generate_exam(request: CourseSetupRequest) -> ExamGenerationResponse:
+    """Generates (or loads from cache or question bank) the exam for a course setup"""
     try:
+        generation_mode = request.generation_mode or DEFAULT_GENERATION_MODE
+        if generation_mode == "bank":
+            return await _admitted("generation", lambda: _generate_exam_from_bank(request))
+        
         # Initialize state
         state = ExamState(
             course_name=request.course_name,
             teacher_name=request.teacher_name,
             student_name=request.student_name,
             learning_outcomes=request.learning_outcomes,
-            passing_score=request.passing_score
+            passing_score=request.passing_score,
+            generation_mode=generation_mode
         )
         
-        # Build and run graph
-        graph = build_exam_generation_graph()
-        final_state_dict = graph.invoke(state)
+        # Serve identical course setups from the exam cache
+        cache = get_exam_cache() if request.cache_mode != "bypass" else None
+        cache_key = exam_cache_key(
+            request.course_name,
+            request.learning_outcomes,
+            LLM_MODEL,
+            MCQ_PROMPT_VERSION,
+            state.generation_mode
+        )
+        if cache is not None and request.cache_mode == "use":
+            cached_mcqs = await cache.aget(cache_key)
+            if cached_mcqs is not None:
+                return ExamGenerationResponse(
+                    success=True,
+                    mcqs=[MCQResponse(**mcq) for mcq in cached_mcqs],
+                    total_questions=len(cached_mcqs),
+                    exam_id=await _store_exam(request, [MCQ(**mcq) for mcq in cached_mcqs]),
+                    cached=True,
+                    message=f"Loaded {len(cached_mcqs)} questions from cache"
+                )
         
-        # Convert dict back to ExamState (LangGraph returns dict)
-        final_state = ExamState(**final_state_dict) if isinstance(final_state_dict, dict) else final_state_dict
+        # Concurrent identical requests share one graph run (cache bypass runs always do their own)
+        if GENERATION_COALESCING and cache is not None:
+            (error, mcq_responses), coalesced = await within_deadline(
+                GENERATION_FLIGHTS.do(
+                    cache_key, lambda: _admitted("generation", lambda: _run_exam_generation(state, cache, cache_key))
+                ),
+                "generate_exam"
+            )
+        else:
+            (error, mcq_responses), coalesced = await _admitted(
+                "generation", lambda: _run_exam_generation(state, cache, cache_key)
+            ), False
         
         # Check for errors
-        if final_state.generation_status == "failed":
+        if error is not None:
             return ExamGenerationResponse(
                 success=False,
                 mcqs=[],
                 total_questions=0,
-                error=final_state.generation_error
+                error=error
             )
         
-        # Convert MCQs to response format
-        # Handle case where MCQs might be dicts or MCQ objects
-        mcq_responses = []
-        for mcq in final_state.mcqs:
-            if isinstance(mcq, dict):
-                # Convert dict to MCQResponse
-                mcq_responses.append(MCQResponse(
-                    id=mcq.get("id", ""),
-                    question=mcq.get("question", ""),
-                    choices=mcq.get("choices", {}),
-                    correct_answer=mcq.get("correct_answer", ""),
-                    learning_outcome=mcq.get("learning_outcome", "")
-                ))
-            else:
-                # MCQ is already an object
-                mcq_responses.append(MCQResponse(
-                    id=mcq.id,
-                    question=mcq.question,
-                    choices=mcq.choices,
-                    correct_answer=mcq.correct_answer,
-                    learning_outcome=mcq.learning_outcome
-                ))
-        
         return ExamGenerationResponse(
             success=True,
             mcqs=mcq_responses,
             total_questions=len(mcq_responses),
+            exam_id=await _store_exam(request, [MCQ(**mcq.model_dump()) for mcq in mcq_responses]),
+            coalesced=coalesced,
             message=f"Successfully generated {len(mcq_responses)} questions"
         )
         
+    except (DeadlineExceeded, Overloaded, CircuitOpenError):
+        raise
     except ValueError as e:
         # Handle API key or configuration errors
         error_msg = str(e)
@@ -191,98 +575,444 @@ async def generate_exam(request: CourseSetupRequest):
         )
 
 
-@app.post("/grade-exam", response_model=GradingResponse)
-async def grade_exam(request: StudentAnswerRequest):
+@app.post("/generate-exam/stream")
+async def generate_exam_stream(request: CourseSetupRequest, format: Literal["sse", "ndjson"] = "sse"):
     """
-    Grade student answers and generate certificate if passed.
+    Streaming variant of /generate-exam (single-prompt generation).
     
-    Laravel sends student answers, receives grading report and optional certificate.
+    Each question is sent as a "question" event as soon as the LLM has
+    written it; a final "summary" event carries the coverage validation.
     """
-    try:
-        # Convert MCQs from request to state format
-        # request.mcqs contains MCQResponse objects (Pydantic models), not dicts
-        mcqs = []
-        for mcq in request.mcqs:
-            # Handle both Pydantic objects and dicts (for flexibility)
-            if isinstance(mcq, dict):
-                mcqs.append(MCQ(
-                    id=mcq["id"],
-                    question=mcq["question"],
-                    choices=mcq["choices"],
-                    correct_answer=mcq["correct_answer"],
-                    learning_outcome=mcq.get("learning_outcome", "")
-                ))
-            else:
-                # MCQResponse object (Pydantic model) - use attribute access
-                mcqs.append(MCQ(
-                    id=mcq.id,
-                    question=mcq.question,
-                    choices=mcq.choices,
-                    correct_answer=mcq.correct_answer,
-                    learning_outcome=mcq.learning_outcome
-                ))
-        
-        # Convert student answers to state format
-        student_answers = [
-            StudentAnswer(
-                question_id=answer["question_id"],
-                answer=answer["answer"]
-            )
-            for answer in request.student_answers
-        ]
-        
-        # Initialize state
+    state = ExamState(
+        course_name=request.course_name,
+        teacher_name=request.teacher_name,
+        student_name=request.student_name,
+        learning_outcomes=request.learning_outcomes,
+        passing_score=request.passing_score,
+        generation_mode="single"
+    )
+    
+    cache = get_exam_cache() if request.cache_mode != "bypass" else None
+    cache_key = exam_cache_key(
+        request.course_name,
+        request.learning_outcomes,
+        LLM_MODEL,
+        MCQ_PROMPT_VERSION,
+        state.generation_mode
+    )
+    cached_mcqs = await cache.aget(cache_key) if cache is not None and request.cache_mode == "use" else None
+    
+    # The generation slot is held until the stream ends (or the client leaves)
+    admission = None
+    if cached_mcqs is None:
+        admission = await get_admission_controller().acquire("generation")
+    
+    return StreamingResponse(
+        stream_exam_generation(
+            state, format, cache, cache_key, cached_mcqs,
+            store_exam=lambda mcqs: _store_exam(request, mcqs)
+        ),
+        media_type=MEDIA_TYPES[format],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(get_admission_controller().release, admission) if admission else None
+    )
+
+
+async def _generate_exam_from_bank(request: CourseSetupRequest) -> ExamGenerationResponse:
+    """
+    Assembles the exam from the question bank. Cold pools fall back to a
+    fan-out generation whose questions seed the bank; low pools are refilled
+    in the background either way.
+    """
+    bank = get_question_bank()
+    mcqs = await bank.aassemble_exam(request.course_name, request.learning_outcomes)
+    message = None
+    
+    if mcqs is None:
         state = ExamState(
             course_name=request.course_name,
             teacher_name=request.teacher_name,
             student_name=request.student_name,
             learning_outcomes=request.learning_outcomes,
             passing_score=request.passing_score,
-            mcqs=mcqs,
-            student_answers=student_answers
+            generation_mode="fanout"
         )
+        final_state_dict = await get_graph_registry().exam_generation_fanout.ainvoke(state)
+        with timed_phase("state_rebuild"):
+            final_state = ExamState(**final_state_dict) if isinstance(final_state_dict, dict) else final_state_dict
+        if final_state.generation_status == "failed":
+            return ExamGenerationResponse(
+                success=False,
+                mcqs=[],
+                total_questions=0,
+                error=final_state.generation_error
+            )
+        await bank.aadd_exam(request.course_name, final_state.mcqs)
+        mcqs = final_state.mcqs
+        message = f"Successfully generated {len(mcqs)} questions and seeded the question bank"
+    
+    await bank.aschedule_refill(request.course_name, request.teacher_name, request.learning_outcomes)
+    
+    mcq_responses = [MCQResponse(**mcq.model_dump()) for mcq in mcqs]
+    return ExamGenerationResponse(
+        success=True,
+        mcqs=mcq_responses,
+        total_questions=len(mcq_responses),
+        exam_id=await _store_exam(request, mcqs),
+        message=message or f"Assembled {len(mcq_responses)} questions from the question bank"
+    )
+
+
+@app.post("/question-bank/prefill")
+async def prefill_question_bank(request: QuestionBankPrefillRequest):
+    """
+    Pre-generate question pools for a course so student exams can be
+    assembled without waiting on the LLM.
+    """
+    bank = get_question_bank()
+    if request.wait:
+        added = await bank.refill(request.course_name, request.teacher_name, request.learning_outcomes)
+        scheduled = False
+    else:
+        added = {}
+        scheduled = await bank.aschedule_refill(request.course_name, request.teacher_name, request.learning_outcomes)
+    return {
+        "success": True,
+        "refill_scheduled": scheduled,
+        "questions_added": added,
+        "pool_sizes": await bank.astatus(request.course_name, request.learning_outcomes)
+    }
+
+
+# ==================== JOBS ====================
+
+async def _run_generate_exam_job(payload: Dict) -> Dict:
+    request = CourseSetupRequest(**payload)
+    with request_deadline(request.timeout_seconds):
+        response = await _generate_exam(request)
+    return response.model_dump()
+
+
+async def _run_polish_certificate_job(payload: Dict) -> Dict:
+    certificate_text = await apolish_certificate(payload["certificate_text"])
+    return {"success": True, "student_name": payload["student_name"], "certificate_text": certificate_text}
+
+
+async def _submit_certificate_polish(student_name: str, certificate_text: Optional[str]) -> Optional[str]:
+    """Queues LLM polishing of a rendered certificate; returns the job id (None if not queued)"""
+    if not certificate_text:
+        return None
+    try:
+        job = await get_job_manager().submit(
+            "polish-certificate",
+            {"student_name": student_name, "certificate_text": certificate_text}
+        )
+    except JobQueueFull:
+        return None
+    return job.id
+
+
+# Job manager will be initialized lazily when needed
+_job_manager = None
+
+def get_job_manager() -> JobManager:
+    """Return the process-wide job manager (workers start with the app)"""
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = JobManager(
+            build_job_store(),
+            runners={
+                "generate-exam": _run_generate_exam_job,
+                "polish-certificate": _run_polish_certificate_job
+            },
+            workers=int(os.getenv("JOB_WORKERS", "4")),
+            queue_size=int(os.getenv("JOB_QUEUE_SIZE", "100")),
+            callback_timeout=float(os.getenv("JOB_CALLBACK_TIMEOUT_SECONDS", "10")),
+            lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "60"))
+        )
+    return _job_manager
+
+
+@app.post("/jobs/generate-exam", status_code=202)
+async def submit_generate_exam_job(request: GenerateExamJobRequest):
+    """
+    Queue an exam generation and return its job id immediately.
+    
+    Poll GET /jobs/{job_id} for the result, or pass callback_url to be notified.
+    """
+    try:
+        job = await get_job_manager().submit(
+            "generate-exam",
+            request.model_dump(exclude={"callback_url"}),
+            callback_url=request.callback_url
+        )
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job status; result holds the /generate-exam response or the polished certificate once completed"""
+    job = await get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job.model_dump(exclude={"request"})
+
+
+def _fast_json(response: BaseModel) -> Response:
+    """
+    Serializes a response model in one step, skipping FastAPI's second
+    validation and jsonable_encoder pass over large grading reports
+    """
+    return FastJSONResponse(response.model_dump())
+
+
+async def _idempotent(
+    endpoint: str,
+    idempotency_key: str,
+    run: Callable[[], Awaitable[BaseModel]],
+    *request_parts: str
+) -> Response:
+    """
+    Runs a request once per Idempotency-Key. Retries attach to the running
+    request or get its stored response (marked with Idempotent-Replayed).
+    The run is not cancelled when its client disconnects, so the retry can
+    still pick it up; it stops at the first request's deadline.
+    """
+    if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+    
+    async def run_once() -> Dict:
+        return (await run()).model_dump()
+    
+    try:
+        response, replayed = await get_idempotency_store().run(
+            endpoint, idempotency_key, request_fingerprint(*request_parts), run_once
+        )
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return FastJSONResponse(response, headers={"Idempotent-Replayed": "true"} if replayed else None)
+
+
+@app.post("/grade-exam", response_model=GradingResponse)
+async def grade_exam(
+    request: StudentAnswerRequest,
+    http_request: Request,
+    report: ReportDetail = "full",
+    idempotency_key: Optional[str] = Header(None),
+    x_request_timeout: Optional[float] = Header(None)
+):
+    """
+    Grade student answers and generate certificate if passed.
+    
+    Laravel sends student answers, receives grading report and optional certificate.
+    report=ids leaves question text out of the report; report=summary returns scores only.
+    A retry with the same Idempotency-Key gets the first request's result.
+    """
+    with request_deadline(request_timeout(request.timeout_seconds, x_request_timeout)):
+        if idempotency_key is None:
+            response = await until_disconnect(
+                http_request, _admitted("grading", lambda: _grade_exam(request, report)), "grade_exam"
+            )
+            return _fast_json(response)
+        return await _idempotent(
+            "grade-exam", idempotency_key, lambda: _admitted("grading", lambda: _grade_exam(request, report)),
+            request.model_dump_json(), report
+        )
+
+
+async def _grade_exam(request: StudentAnswerRequest, report: ReportDetail) -> GradingResponse:
+    """Grades one answer sheet and writes the certificate of a passing student"""
+    try:
+        # Stored exams come with their MCQs and answer key already built; inline MCQs are converted
+        exam, key = await _load_exam(request)
         
-        # Build and run graph
-        graph = build_grading_graph()
-        final_state_dict = graph.invoke(state)
-        
-        # Convert dict back to ExamState (LangGraph returns dict)
-        final_state = ExamState(**final_state_dict) if isinstance(final_state_dict, dict) else final_state_dict
+        # Validate and score in one pass against the answer key; the grading
+        # graph (supervisor -> grading -> certificate) is kept for direct callers
+        with timed_phase("grading"):
+            sheet = grade_answer_sheet(key, request.student_answers, exam.passing_score)
         
         # Check for validation errors
-        if final_state.validation_status == "invalid":
+        if sheet.validation_errors:
             return GradingResponse(
                 success=False,
-                passing_score=request.passing_score,
-                total_questions=len(mcqs),
-                validation_errors=final_state.validation_errors,
+                passing_score=exam.passing_score,
+                total_questions=len(key),
+                validation_errors=sheet.validation_errors,
                 error="Validation failed"
             )
         
+        certificate = {}
+        if sheet.passed:
+            certificate = await agenerate_certificate(
+                exam.course_name,
+                exam.teacher_name,
+                exam.passing_score,
+                request.student_name,
+                sheet.percentage
+            )
+        certificate_text = certificate.get("certificate_text")
+        
         # Return grading results
         return GradingResponse(
             success=True,
-            raw_score=final_state.raw_score,
-            percentage=final_state.percentage,
-            passed=final_state.passed,
-            passing_score=request.passing_score,
-            total_questions=len(mcqs),
-            grading_report=final_state.grading_report,
-            certificate_text=final_state.certificate_text,
-            completion_date=final_state.completion_date
+            raw_score=sheet.raw_score,
+            percentage=sheet.percentage,
+            passed=sheet.passed,
+            passing_score=exam.passing_score,
+            total_questions=len(key),
+            grading_report=sheet.grading_report(key, exam.passing_score, report),
+            certificate_text=certificate_text,
+            completion_date=certificate.get("completion_date"),
+            certificate_polish_job_id=(
+                await _submit_certificate_polish(request.student_name, certificate_text)
+                if request.polish_certificate else None
+            )
         )
         
+    except (HTTPException, DeadlineExceeded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Grading failed: {str(e)}")
 
 
+@app.post("/grade-exam/batch", response_model=BatchGradingResponse)
+async def grade_exam_batch(request: BatchGradingRequest, report: ReportDetail = "full"):
+    """
+    Grade many students against one exam.
+    
+    The answer key is built once; every sheet is validated and scored in a
+    single pass, then certificates for passing students are generated
+    concurrently (at most BATCH_CERTIFICATE_CONCURRENCY at a time).
+    report=ids|summary trims the per-student reports as for /grade-exam.
+    """
+    return await _admitted("grading", lambda: _grade_exam_batch(request, report))
+
+
+async def _grade_exam_batch(request: BatchGradingRequest, report: ReportDetail) -> Response:
+    try:
+        exam, key = await _load_exam(request)
+        # Compact graded sheets; per-question reports are built only for the response
+        graded = grade_answer_sheets(
+            key, (submission.student_answers for submission in request.submissions), exam.passing_score
+        )
+        
+        certificates = {}
+        if request.generate_certificates:
+            passing = [i for i, sheet in enumerate(graded) if sheet.passed]
+            generated = await agenerate_certificates(
+                exam.course_name,
+                exam.teacher_name,
+                exam.passing_score,
+                [
+                    {"student_name": request.submissions[i].student_name, "percentage": graded[i].percentage}
+                    for i in passing
+                ],
+                max_concurrency=BATCH_CERTIFICATE_CONCURRENCY
+            )
+            certificates = dict(zip(passing, generated))
+        
+        results = []
+        for i, (submission, sheet) in enumerate(zip(request.submissions, graded)):
+            if sheet.validation_errors:
+                results.append(StudentGradingResult(
+                    student_name=submission.student_name,
+                    success=False,
+                    validation_errors=sheet.validation_errors,
+                    error="Validation failed"
+                ))
+                continue
+            result = StudentGradingResult(
+                student_name=submission.student_name,
+                success=True,
+                raw_score=sheet.raw_score,
+                percentage=sheet.percentage,
+                passed=sheet.passed,
+                grading_report=sheet.grading_report(key, exam.passing_score, report)
+            )
+            results.append(result)
+            
+            certificate = certificates.get(i)
+            if certificate is not None:
+                result.certificate_text = certificate.get("certificate_text")
+                result.completion_date = certificate.get("completion_date")
+                if not certificate.get("certificate_generated"):
+                    result.error = certificate.get("error_message")
+                elif request.polish_certificates:
+                    result.certificate_polish_job_id = await _submit_certificate_polish(
+                        result.student_name, result.certificate_text
+                    )
+        
+        return _fast_json(BatchGradingResponse(
+            success=True,
+            passing_score=exam.passing_score,
+            total_questions=len(key),
+            results=results,
+            summary=class_summary(key, graded)
+        ))
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch grading failed: {str(e)}")
+
+
+@app.post("/certificate-templates")
+async def set_certificate_template(request: CertificateTemplateRequest):
+    """Register the certificate template used for a course"""
+    try:
+        get_certificate_templates().set_template(request.course_name, request.template)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "course_name": request.course_name}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: node, LLM call and HTTP timings, tokens and payload sizes"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+def _storage_stats() -> Dict[str, Any]:
+    """Health sections that may query SQLite (cache disk tier, question bank, shared backend, LLM budget)"""
+    cache = get_exam_cache()
+    bank = get_question_bank(create=False)
+    return {
+        "exam_cache": cache.stats() if cache is not None else {"enabled": False},
+        "question_bank": bank.stats() if bank is not None else {"initialized": False},
+        "shared_backend": get_shared_backend().stats(),
+        "admission": get_admission_controller().stats()
+    }
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
+    breaker = LLM_BREAKER.stats()
+    storage = await offload(_storage_stats)
     return {
-        "status": "healthy",
+        # Degraded while LLM calls fail fast; cached exams, bank mode and grading still work
+        "status": "degraded" if breaker["state"] == "open" else "healthy",
         "service": "AI Quiz Generator",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "exam_cache": storage["exam_cache"],
+        "question_bank": storage["question_bank"],
+        "jobs": get_job_manager().stats(),
+        "exam_store": get_exam_store().stats(),
+        "certificates": dict(get_certificate_templates().stats(), llm_styles=get_certificate_styles().stats()),
+        "llm": dict(describe_llm(), circuit_breaker=breaker),
+        "workers": {"count": SERVICE_WORKERS, "pid": os.getpid()},
+        "shared_backend": storage["shared_backend"],
+        "coalescing": GENERATION_FLIGHTS.stats(),
+        "idempotency": get_idempotency_store().stats(),
+        "admission": storage["admission"],
+        "response": {
+            "json": FastJSONResponse.__name__,
+            "compression": available_encodings() if COMPRESSION_ENABLED else []
+        }
     }
 
 
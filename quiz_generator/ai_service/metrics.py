@@ -0,0 +1,344 @@
+"""
+Metrics and Tracing
+Prometheus-style counters and histograms for graph nodes, LLM calls and HTTP
+requests, rendered in the text exposition format by GET /metrics. Timings are
+also collected per request so a breakdown can be returned in the
+Server-Timing response header.
+"""
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, Any]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together by /metrics"""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+NODE_DURATION = REGISTRY.register(Histogram(
+    "quiz_node_duration_seconds", "Wall time of LangGraph node executions", ("node", "status")
+))
+LLM_DURATION = REGISTRY.register(Histogram(
+    "quiz_llm_call_duration_seconds", "Wall time of LLM calls", ("node", "status")
+))
+LLM_TOKENS = REGISTRY.register(Histogram(
+    "quiz_llm_tokens", "Tokens per LLM call", ("node", "kind"), buckets=TOKEN_BUCKETS
+))
+LLM_TOKENS_TOTAL = REGISTRY.register(Counter(
+    "quiz_llm_tokens_total", "Tokens used by LLM calls", ("node", "kind")
+))
+LLM_PAYLOAD_BYTES = REGISTRY.register(Histogram(
+    "quiz_llm_payload_bytes", "Prompt and completion sizes of LLM calls", ("node", "direction"), buckets=SIZE_BUCKETS
+))
+RETRIES = REGISTRY.register(Counter(
+    "quiz_retries_total", "Retried units of work", ("kind",)
+))
+GENERATED_QUESTIONS = REGISTRY.register(Counter(
+    "quiz_generated_questions_total", "Question objects received from the LLM, kept or rejected by validation", ("status",)
+))
+CERTIFICATE_STYLE_LOOKUPS = REGISTRY.register(Counter(
+    "quiz_certificate_style_lookups_total", "Per-course certificate style cache lookups", ("result",)
+))
+CERTIFICATE_TOKENS_SAVED = REGISTRY.register(Counter(
+    "quiz_certificate_tokens_saved_total", "LLM tokens saved by reusing cached certificate styles"
+))
+IDEMPOTENT_REQUESTS = REGISTRY.register(Counter(
+    "quiz_idempotent_requests_total", "Requests with an Idempotency-Key: new runs, retries attached to a running request, replayed responses", ("endpoint", "result")
+))
+CANCELLATIONS = REGISTRY.register(Counter(
+    "quiz_cancellations_total", "Work cancelled because its deadline passed, its client disconnected or no request was waiting for it", ("reason", "stage")
+))
+ADMISSION_DECISIONS = REGISTRY.register(Counter(
+    "quiz_admission_decisions_total", "Admission decisions per workflow: admitted, queued or rejected", ("workflow", "result")
+))
+ADMISSION_WAIT = REGISTRY.register(Histogram(
+    "quiz_admission_wait_seconds", "Time requests waited in their workflow's queue", ("workflow",)
+))
+PHASE_DURATION = REGISTRY.register(Histogram(
+    "quiz_phase_duration_seconds", "Wall time of request phases outside the graph", ("phase",)
+))
+HTTP_DURATION = REGISTRY.register(Histogram(
+    "quiz_http_request_duration_seconds", "HTTP request latency", ("method", "path", "status")
+))
+HTTP_RESPONSE_BYTES = REGISTRY.register(Histogram(
+    "quiz_http_response_bytes", "HTTP response body sizes", ("path",), buckets=SIZE_BUCKETS
+))
+
+
+# ---------- per-request timing breakdown ----------
+
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> Dict[str, float]:
+    """Starts collecting timings for the current request; child tasks share the dict"""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record_timing(phase: str, seconds: float) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """Formats timings for the Server-Timing header (durations in milliseconds)"""
+    return ", ".join(f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in timings.items())
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    """Times a block of request handling, e.g. the ExamState rebuild"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        PHASE_DURATION.observe(elapsed, phase=phase)
+        record_timing(phase, elapsed)
+
+
+# ---------- LLM call counting ----------
+
+class LLMUsage:
+    """LLM calls started and tokens used inside a count_llm_calls() block"""
+
+    __slots__ = ("calls", "tokens")
+
+    def __init__(self):
+        self.calls = 0
+        self.tokens = 0
+
+
+_llm_usage: ContextVar[Optional[LLMUsage]] = ContextVar("llm_usage", default=None)
+
+
+@contextmanager
+def count_llm_calls() -> Iterator[LLMUsage]:
+    """
+    Counts the LLM calls (and their tokens) made inside the block, including
+    tasks it spawns. Usage of a nested block is added to the enclosing one.
+    """
+    outer = _llm_usage.get()
+    usage = LLMUsage()
+    token = _llm_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _llm_usage.reset(token)
+        if outer is not None:
+            outer.calls += usage.calls
+            outer.tokens += usage.tokens
+
+
+# ---------- graph nodes ----------
+
+def instrument_node(name: str, func: Callable) -> Callable:
+    """Wraps a sync or async node function with duration metrics"""
+
+    def observe(start: float, status: str) -> None:
+        elapsed = time.perf_counter() - start
+        NODE_DURATION.observe(elapsed, node=name, status=status)
+        record_timing(f"node.{name}", elapsed)
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception:
+                observe(start, "error")
+                raise
+            observe(start, "ok")
+            return result
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            observe(start, "error")
+            raise
+        observe(start, "ok")
+        return result
+    return wrapper
+
+
+# ---------- LLM calls ----------
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    LangChain callback recording duration, tokens and payload sizes of every
+    chat model call. Calls are labelled with the LangGraph node that made them,
+    or the "llm_call" metadata of calls made outside a graph.
+    """
+    run_inline = True
+
+    def __init__(self):
+        self._runs: Dict[UUID, Tuple[float, str, Optional[LLMUsage]]] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        metadata = metadata or {}
+        node = metadata.get("langgraph_node") or metadata.get("llm_call", "none")
+        prompt_bytes = sum(len(str(message.content).encode("utf-8")) for batch in messages for message in batch)
+        LLM_PAYLOAD_BYTES.observe(prompt_bytes, node=node, direction="prompt")
+        usage = _llm_usage.get()
+        if usage is not None:
+            usage.calls += 1
+        with self._lock:
+            self._runs[run_id] = (time.perf_counter(), node, usage)
+
+    def _finish(self, run_id: UUID, status: str) -> Tuple[Optional[str], Optional[LLMUsage]]:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return None, None
+        start, node, call_usage = run
+        elapsed = time.perf_counter() - start
+        LLM_DURATION.observe(elapsed, node=node, status=status)
+        record_timing("llm", elapsed)
+        return node, call_usage
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        node, call_usage = self._finish(run_id, "ok")
+        if node is None:
+            return
+        usage = {}
+        completion_bytes = 0
+        for generations in response.generations:
+            for generation in generations:
+                completion_bytes += len(generation.text.encode("utf-8"))
+                message = getattr(generation, "message", None)
+                if getattr(message, "usage_metadata", None):
+                    usage = message.usage_metadata
+        if not usage:
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            usage = {
+                "input_tokens": token_usage.get("prompt_tokens", 0),
+                "output_tokens": token_usage.get("completion_tokens", 0)
+            }
+        LLM_PAYLOAD_BYTES.observe(completion_bytes, node=node, direction="completion")
+        for kind, field in (("prompt", "input_tokens"), ("completion", "output_tokens")):
+            tokens = usage.get(field) or 0
+            if tokens:
+                LLM_TOKENS.observe(tokens, node=node, kind=kind)
+                LLM_TOKENS_TOTAL.inc(tokens, node=node, kind=kind)
+                if call_usage is not None:
+                    call_usage.tokens += tokens
+        # Prompt tokens served from the provider's prompt cache
+        cached = (usage.get("input_token_details") or {}).get("cache_read") or 0
+        if cached:
+            LLM_TOKENS_TOTAL.inc(cached, node=node, kind="cached_prompt")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id, "error")
+
+
+LLM_METRICS_CALLBACK = LLMMetricsCallback()
@@ -2,13 +2,11 @@
 LangGraph Node Implementations
 Each node represents a step in the multi-agent workflow.
 """
-import json
 import uuid
 import os
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 from datetime import datetime
 from pathlib import Path
-from langchain_openai import ChatOpenAI
 
 # Load environment variables from .env file if it exists
 try:
@@ -27,11 +25,47 @@ except ImportError:
 
 # Handle imports for both module and direct execution
 try:
-    from .state import ExamState, MCQ, StudentAnswer
+    from .state import ExamState, MCQ, StudentAnswer, OutcomeGenerationTask, MCQBatch
+    from .parsing import IncrementalQuestionParser
+    from .outcomes import OutcomeMatcher
+    from .scoring import AnswerKey, check_answer_sheet, score_answer_sheet
+    from .certificates import CERTIFICATE_MODE, fill_certificate, get_certificate_styles, get_certificate_templates
+    from .llm import LLM_MODEL, create_llm
+    from .metrics import RETRIES, GENERATED_QUESTIONS
+    from .deadlines import DeadlineExceeded, check_deadline, within_deadline
+    from .resilience import CircuitOpenError
 except ImportError:
-    from state import ExamState, MCQ, StudentAnswer
+    from state import ExamState, MCQ, StudentAnswer, OutcomeGenerationTask, MCQBatch
+    from parsing import IncrementalQuestionParser
+    from outcomes import OutcomeMatcher
+    from scoring import AnswerKey, check_answer_sheet, score_answer_sheet
+    from certificates import CERTIFICATE_MODE, fill_certificate, get_certificate_styles, get_certificate_templates
+    from llm import LLM_MODEL, create_llm
+    from metrics import RETRIES, GENERATED_QUESTIONS
+    from deadlines import DeadlineExceeded, check_deadline, within_deadline
+    from resilience import CircuitOpenError
 
 
+# Exam size bounds enforced on every generated exam
+MIN_QUESTIONS, MAX_QUESTIONS = 5, 25
+
+# Fan-out generation: outcomes per branch and retry budget for uncovered outcomes
+FANOUT_CHUNK_SIZE = int(os.getenv("MCQ_FANOUT_CHUNK_SIZE", "1"))
+FANOUT_MAX_RETRIES = int(os.getenv("MCQ_FANOUT_MAX_RETRIES", "2"))
+
+# Partial salvage: follow-up calls replacing questions lost to malformed or
+# truncated output, made while the exam has fewer than the 10 questions the
+# single prompt asks for
+SALVAGE_MAX_RETRIES = int(os.getenv("MCQ_SALVAGE_MAX_RETRIES", "1"))
+TOP_UP_BELOW = 10
+
+# Follow-up generations for learning outcomes the single-prompt exam misses
+COVERAGE_REPAIR_MAX_RETRIES = int(os.getenv("MCQ_COVERAGE_REPAIR_MAX_RETRIES", "2"))
+
+
+# Bump whenever the MCQ prompts change so cached exams are regenerated
+MCQ_PROMPT_VERSION = "1"
+
 # LLM will be initialized lazily when needed
 _llm = None
 
@@ -39,75 +73,45 @@ def get_llm():
     """Lazy initialization of LLM to avoid errors if API key is missing at import time"""
     global _llm
     if _llm is None:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError(
-                "OPENAI_API_KEY environment variable is not set. "
-                "Please set it before using the service. "
-                "You can either:\n"
-                "1. Export it: export OPENAI_API_KEY='your-api-key-here'\n"
-                "2. Create a .env file in the ai_service folder with: OPENAI_API_KEY=your-api-key-here"
-            )
-        try:
-            _llm = ChatOpenAI(
-                temperature=0.7,
-                model="gpt-4",
-                api_key=api_key
-            )
-        except Exception as e:
-            raise ValueError(
-                f"Failed to initialize OpenAI client: {str(e)}. "
-                "Please check that your OPENAI_API_KEY is correct and valid."
-            )
+        _llm = create_llm()
     return _llm
 
 
-def generate_mcq_node(state: ExamState) -> Dict[str, Any]:
-    """
-    MCQ Generation Agent Node
-    Generates multiple-choice questions based on learning outcomes.
-    Each learning outcome must be tested by at least one MCQ.
-    """
-    try:
-        state.generation_status = "pending"
-        state.current_step = "mcq_generation"
-        
-        if not state.learning_outcomes:
-            state.generation_status = "failed"
-            state.generation_error = "No learning outcomes provided"
-            return {"generation_status": "failed", "generation_error": state.generation_error}
+_MCQ_SYSTEM_PROMPT = """You are an expert educational assessment designer. 
+        Generate high-quality multiple-choice questions that accurately test the provided learning outcomes.
+        Each question must:
+        1. Directly assess at least one learning outcome
+        2. Have exactly 4 choices (A, B, C, D)
+        3. Have one clearly correct answer
+        4. Include plausible distractors
+        5. Be clear and unambiguous
         
-        # Build prompt for MCQ generation
-        outcomes_text = "\n".join([f"- {outcome}" for outcome in state.learning_outcomes])
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert educational assessment designer. 
-            Generate high-quality multiple-choice questions that accurately test the provided learning outcomes.
-            Each question must:
-            1. Directly assess at least one learning outcome
-            2. Have exactly 4 choices (A, B, C, D)
-            3. Have one clearly correct answer
-            4. Include plausible distractors
-            5. Be clear and unambiguous
-            
-            Return ONLY valid JSON in this exact format:
-            {{
-                "questions": [
-                    {{
-                        "id": "q1",
-                        "question": "Question text here?",
-                        "choices": {{
-                            "A": "First choice",
-                            "B": "Second choice",
-                            "C": "Third choice",
-                            "D": "Fourth choice"
-                        }},
-                        "correct_answer": "A",
-                        "learning_outcome": "Which learning outcome this tests"
-                    }}
-                ]
-            }}"""),
-            ("human", f"""Course: {state.course_name}
+        Return ONLY valid JSON in this exact format:
+        {{
+            "questions": [
+                {{
+                    "id": "q1",
+                    "question": "Question text here?",
+                    "choices": {{
+                        "A": "First choice",
+                        "B": "Second choice",
+                        "C": "Third choice",
+                        "D": "Fourth choice"
+                    }},
+                    "correct_answer": "A",
+                    "learning_outcome": "Which learning outcome this tests"
+                }}
+            ]
+        }}"""
+
+
+def _build_mcq_prompt(state: ExamState) -> ChatPromptTemplate:
+    """Builds the MCQ generation prompt for the state's learning outcomes"""
+    outcomes_text = "\n".join([f"- {outcome}" for outcome in state.learning_outcomes])
+    
+    return ChatPromptTemplate.from_messages([
+        ("system", _MCQ_SYSTEM_PROMPT),
+        ("human", f"""Course: {state.course_name}
 Teacher: {state.teacher_name}
 Student: {state.student_name}
 
@@ -118,76 +122,189 @@ Generate between 10 and 20 multiple-choice questions (aim for 20 if the learning
 Distribute the questions across all learning outcomes, with more questions for broader or more important outcomes.
 
 Return the JSON response now.""")
-        ])
-        
-        chain = prompt | get_llm()
-        response = chain.invoke({})
-        
-        # Parse LLM response
-        content = response.content.strip()
-        
-        # Extract JSON from markdown code blocks if present
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        elif "```" in content:
-            content = content.split("```")[1].split("```")[0].strip()
-        
-        questions_data = json.loads(content)
-        
-        # Convert to MCQ objects
-        mcqs = []
-        for q_data in questions_data.get("questions", []):
-            mcq = MCQ(
-                id=q_data.get("id", f"q{len(mcqs) + 1}"),
-                question=q_data["question"],
-                choices=q_data["choices"],
-                correct_answer=q_data["correct_answer"],
-                learning_outcome=q_data.get("learning_outcome", "")
-            )
-            mcqs.append(mcq)
-        
-        # Validate that we have a reasonable number of questions (min 5, max 25)
-        min_questions, max_questions = 5, 25
-        if len(mcqs) < min_questions:
-            state.generation_status = "failed"
-            state.generation_error = f"Expected at least {min_questions} questions, but generated {len(mcqs)} questions"
-            return {"generation_status": "failed", "generation_error": state.generation_error}
-        if len(mcqs) > max_questions:
-            state.generation_status = "failed"
-            state.generation_error = f"Expected at most {max_questions} questions, but generated {len(mcqs)} questions"
-            return {"generation_status": "failed", "generation_error": state.generation_error}
-        
-        # Validate that all learning outcomes are covered
-        covered_outcomes = set(mcq.learning_outcome for mcq in mcqs)
-        if len(covered_outcomes) < len(state.learning_outcomes):
-            state.generation_status = "failed"
-            state.generation_error = f"Not all learning outcomes are covered. Covered: {len(covered_outcomes)}, Required: {len(state.learning_outcomes)}"
-            return {"generation_status": "failed", "generation_error": state.generation_error}
-        
+    ])
+
+
+def _salvage_mcqs(content: str, first_number: int = 1) -> Tuple[List[MCQ], List[Optional[str]]]:
+    """
+    Extracts every complete question object from an LLM response and validates
+    each against MCQ on its own, so one malformed question or a truncated
+    completion does not discard the rest. Questions are numbered from
+    first_number. Returns the valid questions and the learning outcomes of the
+    lost ones (None where unknown, e.g. unparseable or cut-off objects).
+    """
+    parser = IncrementalQuestionParser()
+    mcqs: List[MCQ] = []
+    lost: List[Optional[str]] = []
+    for q_data in parser.feed(content):
+        try:
+            mcqs.append(_mcq_from_data(q_data, f"q{first_number + len(mcqs)}"))
+        except (KeyError, TypeError, ValueError):
+            outcome = q_data.get("learning_outcome")
+            lost.append(outcome if isinstance(outcome, str) else None)
+    lost.extend([None] * len(parser.errors))
+    if parser.truncated:
+        lost.append(None)
+    
+    GENERATED_QUESTIONS.inc(len(mcqs), status="kept")
+    GENERATED_QUESTIONS.inc(len(lost), status="rejected")
+    return mcqs, lost
+
+
+def _top_up_task(state: ExamState, mcqs: List[MCQ], lost: List[Optional[str]]) -> Optional[OutcomeGenerationTask]:
+    """
+    Follow-up request that replaces questions lost to malformed or truncated
+    output, targeting their learning outcomes (or the least covered ones).
+    None when nothing was lost or the exam already has TOP_UP_BELOW questions.
+    """
+    if not lost or len(mcqs) >= TOP_UP_BELOW:
+        return None
+    count = min(max(len(lost), TOP_UP_BELOW - len(mcqs)), MAX_QUESTIONS - len(mcqs))
+    
+    targets = [outcome for outcome in dict.fromkeys(lost) if outcome in state.learning_outcomes]
+    covered = {outcome: 0 for outcome in state.learning_outcomes}
+    for mcq in mcqs:
+        if mcq.learning_outcome in covered:
+            covered[mcq.learning_outcome] += 1
+    for outcome in sorted(state.learning_outcomes, key=covered.get):
+        if len(targets) >= min(count, len(state.learning_outcomes)):
+            break
+        if outcome not in targets:
+            targets.append(outcome)
+    
+    return OutcomeGenerationTask(
+        course_name=state.course_name,
+        teacher_name=state.teacher_name,
+        student_name=state.student_name,
+        learning_outcomes=targets,
+        questions_per_outcome=-(-count // len(targets))
+    )
+
+
+def _add_top_up(mcqs: List[MCQ], content: str) -> Tuple[List[MCQ], List[Optional[str]]]:
+    """Appends the salvaged questions of a top-up response, keeping the exam within MAX_QUESTIONS"""
+    extra, lost = _salvage_mcqs(content, first_number=len(mcqs) + 1)
+    return mcqs + extra[:MAX_QUESTIONS - len(mcqs)], lost
+
+
+def _mcq_from_data(q_data: Dict[str, Any], question_id: str) -> MCQ:
+    """Converts one question object from the LLM into an MCQ, rejecting ungradeable questions"""
+    mcq = MCQ(
+        id=question_id,
+        question=q_data["question"],
+        choices=q_data["choices"],
+        correct_answer=q_data["correct_answer"],
+        learning_outcome=q_data.get("learning_outcome", "")
+    )
+    if set(mcq.choices) != set("ABCD") or mcq.correct_answer not in mcq.choices:
+        raise ValueError(f"Question needs choices A-D and one of them as the answer: {q_data.get('question')!r}")
+    return mcq
+
+
+async def astream_mcqs(state: ExamState, parser: IncrementalQuestionParser) -> AsyncIterator[MCQ]:
+    """
+    Streams the single-prompt MCQ generation, yielding each question as soon
+    as its JSON object is complete. Questions are numbered in arrival order
+    and mapped to the canonical learning outcomes; objects that fail
+    validation are skipped and recorded in parser.errors.
+    """
+    chain = _build_mcq_prompt(state) | get_llm()
+    matcher = OutcomeMatcher(state.learning_outcomes)
+    count = 0
+    async for chunk in chain.astream({}, config={"metadata": {"llm_call": "generate_mcq_stream"}}):
+        for q_data in parser.feed(chunk.content):
+            try:
+                mcq = _mcq_from_data(q_data, f"q{count + 1}")
+            except (KeyError, TypeError, ValueError) as e:
+                parser.errors.append(f"Invalid question object: {e}")
+                continue
+            outcome = matcher.match(mcq.learning_outcome)
+            if outcome is not None and outcome != mcq.learning_outcome:
+                mcq = mcq.model_copy(update={"learning_outcome": outcome})
+            count += 1
+            yield mcq
+
+
+def _start_mcq_generation(state: ExamState) -> Optional[Dict[str, Any]]:
+    """Marks the state as generating; returns a failure update if there is nothing to generate"""
+    state.generation_status = "pending"
+    state.current_step = "mcq_generation"
+    
+    if not state.learning_outcomes:
+        state.generation_status = "failed"
+        state.generation_error = "No learning outcomes provided"
+        return {"generation_status": "failed", "generation_error": state.generation_error}
+    return None
+
+
+def _complete_mcq_generation(state: ExamState, mcqs: List[MCQ]) -> Dict[str, Any]:
+    """
+    Maps the questions to the canonical learning outcomes and validates them.
+    Outcomes no question covers are handed to the coverage repair stage while
+    its retry budget lasts; otherwise the generation fails.
+    """
+    mcqs, missing = OutcomeMatcher(state.learning_outcomes).assign(mcqs)
+    
+    if missing and len(mcqs) < MAX_QUESTIONS and state.generation_attempts < COVERAGE_REPAIR_MAX_RETRIES:
         state.mcqs = mcqs
-        state.generation_status = "completed"
-        
+        state.pending_outcomes = missing
         return {
             "mcqs": mcqs,
-            "generation_status": "completed",
-            "current_step": "mcq_generation_complete"
+            "pending_outcomes": missing,
+            "generation_status": "pending",
+            "current_step": "mcq_coverage_repair"
         }
-        
-    except ValueError as e:
-        # Handle API key errors
+    
+    failure = _check_question_count(state, mcqs)
+    if failure:
+        return failure
+    
+    # Validate that all learning outcomes are covered
+    if missing:
+        state.generation_status = "failed"
+        state.generation_error = (
+            f"Not all learning outcomes are covered. "
+            f"Covered: {len(state.learning_outcomes) - len(missing)}, Required: {len(state.learning_outcomes)}"
+        )
+        if state.generation_attempts:
+            state.generation_error += f" (after {state.generation_attempts} repair attempts)"
+        return {"generation_status": "failed", "generation_error": state.generation_error, "pending_outcomes": []}
+    
+    state.mcqs = mcqs
+    state.generation_status = "completed"
+    
+    return {
+        "mcqs": mcqs,
+        "pending_outcomes": [],
+        "generation_status": "completed",
+        "current_step": "mcq_generation_complete"
+    }
+
+
+def _check_question_count(state: ExamState, mcqs: List[MCQ]) -> Optional[Dict[str, Any]]:
+    """Validate that we have a reasonable number of questions (MIN_QUESTIONS..MAX_QUESTIONS)"""
+    if len(mcqs) < MIN_QUESTIONS:
         state.generation_status = "failed"
+        state.generation_error = f"Expected at least {MIN_QUESTIONS} questions, but generated {len(mcqs)} questions"
+        return {"generation_status": "failed", "generation_error": state.generation_error}
+    if len(mcqs) > MAX_QUESTIONS:
+        state.generation_status = "failed"
+        state.generation_error = f"Expected at most {MAX_QUESTIONS} questions, but generated {len(mcqs)} questions"
+        return {"generation_status": "failed", "generation_error": state.generation_error}
+    return None
+
+
+def _fail_mcq_generation(state: ExamState, e: Exception) -> Dict[str, Any]:
+    """Maps an exception raised during generation to the node's failure update"""
+    state.generation_status = "failed"
+    if isinstance(e, ValueError):
+        # Handle API key errors
         error_msg = str(e)
         if "OPENAI_API_KEY" in error_msg or "API key" in error_msg:
             state.generation_error = f"OpenAI API key error: {error_msg}"
         else:
             state.generation_error = f"Configuration error: {error_msg}"
-        return {"generation_status": "failed", "generation_error": state.generation_error}
-    except json.JSONDecodeError as e:
-        state.generation_status = "failed"
-        state.generation_error = f"Failed to parse LLM response as JSON: {str(e)}"
-        return {"generation_status": "failed", "generation_error": state.generation_error}
-    except Exception as e:
-        state.generation_status = "failed"
+    else:
         error_str = str(e)
         # Check for OpenAI API errors
         if "401" in error_str or "invalid_api_key" in error_str.lower() or "Incorrect API key" in error_str:
@@ -198,167 +315,518 @@ Return the JSON response now.""")
             )
         else:
             state.generation_error = f"MCQ generation failed: {error_str}"
-        return {"generation_status": "failed", "generation_error": state.generation_error}
+    return {"generation_status": "failed", "generation_error": state.generation_error}
 
 
-def supervisor_node(state: ExamState) -> Dict[str, Any]:
+def generate_mcq_node(state: ExamState) -> Dict[str, Any]:
     """
-    Supervisor Node - Validates student answers before grading
-    Checks:
-    1. All questions are answered
-    2. Answers match expected format (A, B, C, or D)
-    3. No duplicate question IDs
+    MCQ Generation Agent Node
+    Generates multiple-choice questions based on learning outcomes.
+    Each learning outcome must be tested by at least one MCQ.
     """
-    state.current_step = "validation"
-    state.validation_status = "pending"
-    state.validation_errors = []
+    try:
+        failure = _start_mcq_generation(state)
+        if failure:
+            return failure
+        
+        chain = _build_mcq_prompt(state) | get_llm()
+        check_deadline("generate_mcq")
+        response = chain.invoke({})
+        mcqs, lost = _salvage_mcqs(response.content)
+        
+        # Regenerate only what was lost instead of the whole exam
+        for _ in range(SALVAGE_MAX_RETRIES):
+            task = _top_up_task(state, mcqs, lost)
+            if task is None:
+                break
+            RETRIES.inc(kind="mcq_top_up")
+            check_deadline("generate_mcq")
+            response = (_build_outcome_mcq_prompt(task) | get_llm()).invoke({})
+            mcqs, lost = _add_top_up(mcqs, response.content)
+        
+        return _complete_mcq_generation(state, mcqs)
+        
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
+    except Exception as e:
+        return _fail_mcq_generation(state, e)
+
+
+async def agenerate_mcq_node(state: ExamState) -> Dict[str, Any]:
+    """
+    Async variant of generate_mcq_node.
+    Awaits the LLM call so the event loop keeps serving other requests.
+    """
+    try:
+        failure = _start_mcq_generation(state)
+        if failure:
+            return failure
+        
+        chain = _build_mcq_prompt(state) | get_llm()
+        response = await within_deadline(chain.ainvoke({}), "generate_mcq")
+        mcqs, lost = _salvage_mcqs(response.content)
+        
+        # Regenerate only what was lost instead of the whole exam
+        for _ in range(SALVAGE_MAX_RETRIES):
+            task = _top_up_task(state, mcqs, lost)
+            if task is None:
+                break
+            RETRIES.inc(kind="mcq_top_up")
+            response = await within_deadline((_build_outcome_mcq_prompt(task) | get_llm()).ainvoke({}), "generate_mcq")
+            mcqs, lost = _add_top_up(mcqs, response.content)
+        
+        return _complete_mcq_generation(state, mcqs)
+        
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
+    except Exception as e:
+        return _fail_mcq_generation(state, e)
+
+
+# ==================== COVERAGE REPAIR ====================
+
+def _coverage_repair_task(state: ExamState) -> OutcomeGenerationTask:
+    """Follow-up request for the uncovered outcomes only, within the exam size limit"""
+    room = MAX_QUESTIONS - len(state.mcqs)
+    targets = state.pending_outcomes[:max(room, 1)]
+    return OutcomeGenerationTask(
+        course_name=state.course_name,
+        teacher_name=state.teacher_name,
+        student_name=state.student_name,
+        learning_outcomes=targets,
+        questions_per_outcome=max(1, min(questions_per_outcome(len(state.learning_outcomes)), room // len(targets))),
+        attempt=state.generation_attempts + 1
+    )
+
+
+def _complete_coverage_repair(state: ExamState, task: OutcomeGenerationTask, content: str) -> Dict[str, Any]:
+    """Appends the repair questions to the exam and re-checks coverage"""
+    batch = _complete_outcome_batch(task, content)["mcq_batches"][0]
+    added = [
+        mcq.model_copy(update={"id": f"q{len(state.mcqs) + i}"})
+        for i, mcq in enumerate(batch.mcqs, start=1)
+    ]
+    state.generation_attempts = task.attempt
+    update = _complete_mcq_generation(state, state.mcqs + added)
+    update["generation_attempts"] = task.attempt
+    return update
+
+
+def repair_coverage_node(state: ExamState) -> Dict[str, Any]:
+    """
+    Coverage Repair Node
+    Generates questions only for the learning outcomes the exam does not
+    cover yet, instead of regenerating the whole exam.
+    """
+    try:
+        task = _coverage_repair_task(state)
+        RETRIES.inc(len(task.learning_outcomes), kind="coverage_repair")
+        chain = _build_outcome_mcq_prompt(task) | get_llm()
+        check_deadline("repair_coverage")
+        response = chain.invoke({})
+        return _complete_coverage_repair(state, task, response.content)
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
+    except Exception as e:
+        return _fail_mcq_generation(state, e)
+
+
+async def arepair_coverage_node(state: ExamState) -> Dict[str, Any]:
+    """Async variant of repair_coverage_node"""
+    try:
+        task = _coverage_repair_task(state)
+        RETRIES.inc(len(task.learning_outcomes), kind="coverage_repair")
+        chain = _build_outcome_mcq_prompt(task) | get_llm()
+        response = await within_deadline(chain.ainvoke({}), "repair_coverage")
+        return _complete_coverage_repair(state, task, response.content)
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
+    except Exception as e:
+        return _fail_mcq_generation(state, e)
+
+
+# ==================== FAN-OUT GENERATION ====================
+
+def questions_per_outcome(num_outcomes: int) -> int:
+    """Per-outcome quota that keeps a fan-out exam at roughly 20 questions"""
+    return max(1, min(5, 20 // max(num_outcomes, 1)))
+
+
+def chunk_outcomes(outcomes: List[str], chunk_size: int = None) -> List[List[str]]:
+    """Splits learning outcomes into the chunks generated by each fan-out branch"""
+    size = max(1, chunk_size or FANOUT_CHUNK_SIZE)
+    return [outcomes[i:i + size] for i in range(0, len(outcomes), size)]
+
+
+def _build_outcome_mcq_prompt(task: OutcomeGenerationTask) -> ChatPromptTemplate:
+    """Builds the prompt for one fan-out branch"""
+    outcomes_text = "\n".join([f"- {outcome}" for outcome in task.learning_outcomes])
+    total = task.questions_per_outcome * len(task.learning_outcomes)
     
-    # Check if MCQs exist
-    if not state.mcqs:
-        state.validation_status = "invalid"
-        state.validation_errors.append("No questions available to validate")
-        return {
-            "validation_status": "invalid",
-            "validation_errors": state.validation_errors
-        }
+    return ChatPromptTemplate.from_messages([
+        ("system", _MCQ_SYSTEM_PROMPT),
+        ("human", f"""Course: {task.course_name}
+Teacher: {task.teacher_name}
+Student: {task.student_name}
+
+Learning Outcomes:
+{outcomes_text}
+
+Generate exactly {task.questions_per_outcome} multiple-choice questions for EACH learning outcome above ({total} questions in total).
+Set "learning_outcome" to the exact text of the learning outcome each question tests.
+
+Return the JSON response now.""")
+    ])
+
+
+def _complete_outcome_batch(task: OutcomeGenerationTask, content: str) -> Dict[str, Any]:
+    """Keeps the questions that belong to the branch's outcomes, capped at the quota"""
+    matcher = OutcomeMatcher(task.learning_outcomes)
+    counts = {outcome: 0 for outcome in task.learning_outcomes}
+    mcqs = []
+    for mcq in _salvage_mcqs(content)[0]:
+        outcome = matcher.match(mcq.learning_outcome)
+        if outcome is None and len(task.learning_outcomes) == 1:
+            # A single-outcome branch can only be testing that outcome
+            outcome = task.learning_outcomes[0]
+        if outcome is None or counts[outcome] >= task.questions_per_outcome:
+            continue
+        counts[outcome] += 1
+        mcqs.append(mcq.model_copy(update={"learning_outcome": outcome}))
     
-    # Check if answers provided
-    if not state.student_answers:
-        state.validation_status = "invalid"
-        state.validation_errors.append("No student answers provided")
+    batch = MCQBatch(learning_outcomes=task.learning_outcomes, mcqs=mcqs, attempt=task.attempt)
+    return {"mcq_batches": [batch]}
+
+
+def _fail_outcome_batch(task: OutcomeGenerationTask, e: Exception) -> Dict[str, Any]:
+    batch = MCQBatch(learning_outcomes=task.learning_outcomes, attempt=task.attempt, error=str(e))
+    return {"mcq_batches": [batch]}
+
+
+def plan_mcq_generation_node(state: ExamState) -> Dict[str, Any]:
+    """
+    Fan-out Planning Node
+    Marks every learning outcome as pending; the graph then sends one
+    generation branch per chunk of pending outcomes.
+    """
+    failure = _start_mcq_generation(state)
+    if failure:
+        return failure
+    
+    return {
+        "generation_status": "pending",
+        "current_step": "mcq_generation",
+        "pending_outcomes": list(state.learning_outcomes),
+        "generation_attempts": 1
+    }
+
+
+def generate_outcome_mcqs_node(task: OutcomeGenerationTask) -> Dict[str, Any]:
+    """
+    Fan-out MCQ Generation Branch
+    Generates questions for one chunk of learning outcomes.
+    """
+    try:
+        chain = _build_outcome_mcq_prompt(task) | get_llm()
+        check_deadline("generate_outcome_mcqs")
+        response = chain.invoke({})
+        return _complete_outcome_batch(task, response.content)
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
+    except Exception as e:
+        return _fail_outcome_batch(task, e)
+
+
+async def agenerate_outcome_mcqs_node(task: OutcomeGenerationTask) -> Dict[str, Any]:
+    """Async variant of generate_outcome_mcqs_node"""
+    try:
+        chain = _build_outcome_mcq_prompt(task) | get_llm()
+        response = await within_deadline(chain.ainvoke({}), "generate_outcome_mcqs")
+        return _complete_outcome_batch(task, response.content)
+    except (DeadlineExceeded, CircuitOpenError):
+        raise
+    except Exception as e:
+        return _fail_outcome_batch(task, e)
+
+
+def merge_mcqs_node(state: ExamState) -> Dict[str, Any]:
+    """
+    Fan-out Merge Node
+    Collects the branch results in learning-outcome order and renumbers them.
+    Outcomes left without questions are sent back for another attempt until
+    the retry budget is spent.
+    """
+    state.current_step = "mcq_merge"
+    
+    by_outcome = {outcome: [] for outcome in state.learning_outcomes}
+    errors = []
+    for batch in state.mcq_batches:
+        if batch.error:
+            errors.append(batch.error)
+        for mcq in batch.mcqs:
+            if mcq.learning_outcome in by_outcome:
+                by_outcome[mcq.learning_outcome].append(mcq)
+    
+    missing = [outcome for outcome, mcqs in by_outcome.items() if not mcqs]
+    if missing:
+        if state.generation_attempts <= FANOUT_MAX_RETRIES:
+            RETRIES.inc(len(missing), kind="fanout_outcome")
+            return {
+                "pending_outcomes": missing,
+                "generation_attempts": state.generation_attempts + 1,
+                "current_step": "mcq_generation_retry"
+            }
+        
+        state.generation_status = "failed"
+        state.generation_error = (
+            f"Not all learning outcomes are covered after {state.generation_attempts} attempts. "
+            f"Covered: {len(by_outcome) - len(missing)}, Required: {len(state.learning_outcomes)}"
+        )
+        if errors:
+            state.generation_error += f". Last error: {errors[-1]}"
         return {
-            "validation_status": "invalid",
-            "validation_errors": state.validation_errors
+            "generation_status": "failed",
+            "generation_error": state.generation_error,
+            "pending_outcomes": []
         }
     
-    # Get all question IDs
-    question_ids = {mcq.id for mcq in state.mcqs}
-    answered_ids = {answer.question_id for answer in state.student_answers}
-    
-    # Check if all questions are answered
-    missing_questions = question_ids - answered_ids
-    if missing_questions:
-        state.validation_status = "invalid"
-        state.validation_errors.append(
-            f"Missing answers for questions: {', '.join(sorted(missing_questions))}"
+    mcqs = [
+        mcq.model_copy(update={"id": f"q{index}"})
+        for index, mcq in enumerate(
+            (mcq for outcome_mcqs in by_outcome.values() for mcq in outcome_mcqs), start=1
         )
+    ]
     
-    # Check for duplicate question IDs
-    seen_ids = set()
-    duplicates = []
-    for answer in state.student_answers:
-        if answer.question_id in seen_ids:
-            duplicates.append(answer.question_id)
-        seen_ids.add(answer.question_id)
+    failure = _check_question_count(state, mcqs)
+    if failure:
+        failure["pending_outcomes"] = []
+        return failure
     
-    if duplicates:
-        state.validation_status = "invalid"
-        state.validation_errors.append(
-            f"Duplicate answers for questions: {', '.join(duplicates)}"
-        )
+    state.mcqs = mcqs
+    state.generation_status = "completed"
     
-    # Check answer format
-    invalid_answers = []
-    for answer in state.student_answers:
-        if answer.answer not in ["A", "B", "C", "D"]:
-            invalid_answers.append(f"{answer.question_id}: {answer.answer}")
-        if answer.question_id not in question_ids:
-            invalid_answers.append(f"{answer.question_id}: Invalid question ID")
+    return {
+        "mcqs": mcqs,
+        "pending_outcomes": [],
+        "generation_status": "completed",
+        "current_step": "mcq_generation_complete"
+    }
+
+
+def _state_answer_pairs(state: ExamState):
+    return ((answer.question_id, answer.answer) for answer in state.student_answers)
+
+
+def supervisor_node(state: ExamState) -> Dict[str, Any]:
+    """
+    Supervisor Node - Validates student answers before grading
+    Checks:
+    1. All questions are answered
+    2. Answers match expected format (A, B, C, or D)
+    3. No duplicate question IDs
+    Graph wrapper around the grading engine's validation pass (scoring.py).
+    """
+    state.current_step = "validation"
     
-    if invalid_answers:
-        state.validation_status = "invalid"
-        state.validation_errors.append(
-            f"Invalid answer format: {', '.join(invalid_answers)}"
-        )
+    _, validation_errors = check_answer_sheet(AnswerKey(state.mcqs), _state_answer_pairs(state))
+    state.validation_errors = validation_errors
     
-    # Final validation result
-    if state.validation_errors:
+    if validation_errors:
         state.validation_status = "invalid"
         return {
             "validation_status": "invalid",
-            "validation_errors": state.validation_errors
-        }
-    else:
-        state.validation_status = "valid"
-        return {
-            "validation_status": "valid",
-            "current_step": "validation_complete"
+            "validation_errors": validation_errors
         }
+    
+    state.validation_status = "valid"
+    return {
+        "validation_status": "valid",
+        "current_step": "validation_complete"
+    }
 
 
 def grading_node(state: ExamState) -> Dict[str, Any]:
     """
     Grading Agent Node
     Compares student answers to correct answers and computes scores.
+    Graph wrapper around the grading engine's scoring pass (scoring.py).
     """
     state.current_step = "grading"
     
-    # Create lookup for correct answers
-    correct_answers = {mcq.id: mcq.correct_answer for mcq in state.mcqs}
+    key = AnswerKey(state.mcqs)
+    answers, _ = check_answer_sheet(key, _state_answer_pairs(state))
+    sheet = score_answer_sheet(key, answers, state.passing_score)
     
-    # Create lookup for student answers
-    student_answers_dict = {answer.question_id: answer.answer for answer in state.student_answers}
+    state.raw_score = sheet.raw_score
+    state.percentage = sheet.percentage
+    state.passed = sheet.passed
+    state.grading_report = sheet.grading_report(key, state.passing_score)
     
-    # Grade each question
-    total_questions = len(state.mcqs)
-    correct_count = 0
-    question_results = []
+    return {
+        "raw_score": sheet.raw_score,
+        "percentage": sheet.percentage,
+        "passed": sheet.passed,
+        "grading_report": state.grading_report,
+        "current_step": "grading_complete"
+    }
+
+
+_CERTIFICATE_SYSTEM_PROMPT = """You are a professional certificate/diploma writer.
+        Generate a formal, professional certificate text for a student who has successfully completed a course.
+        The certificate should be:
+        - Professional and formal in tone
+        - Include all required information
+        - Suitable for official documentation
+        - Clear and concise"""
+
+# Prompts are built once; the system instructions and course fields come first
+# so every student of a course shares the same prompt prefix, which lets
+# provider-side prompt caching apply to per-student calls.
+_CERTIFICATE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", _CERTIFICATE_SYSTEM_PROMPT),
+    ("human", """Generate a certificate/diploma text for:
+
+Course Name: {course_name}
+Teacher/Instructor: {teacher_name}
+Student Name: {student_name}
+Completion Date: {completion_date}
+Score: {score}
+
+Generate the full certificate text now. Make it professional and suitable for official documentation.""")
+])
+
+_CERTIFICATE_STYLE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", _CERTIFICATE_SYSTEM_PROMPT),
+    ("human", """Generate the certificate/diploma text used for every student of this course:
+
+Course Name: {course_name}
+Teacher/Instructor: {teacher_name}
+
+Write the student's name as $student_name, the completion date as $completion_date and the score as $score,
+exactly as shown, wherever they belong. Do not use any other "$" characters.
+
+Generate the full certificate text now. Make it professional and suitable for official documentation.""")
+])
+
+_CERTIFICATE_POLISH_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", _CERTIFICATE_SYSTEM_PROMPT),
+    ("human", """Polish the following certificate text into a more elegant, formal diploma.
+Keep every name, the course, the date and the score exactly as written.
+
+{certificate_text}
+
+Return only the polished certificate text.""")
+])
+
+
+# Labels certificate LLM calls made outside the grading graph (graph calls carry their node)
+_CERTIFICATE_CALL = {"metadata": {"llm_call": "certificate"}}
+
+
+def _certificate_fields(state: ExamState, completion_date: str) -> Dict[str, str]:
+    return {
+        "course_name": state.course_name,
+        "teacher_name": state.teacher_name,
+        "student_name": state.student_name or "",
+        "completion_date": completion_date,
+        "score": f"{state.percentage:.2f}%"
+    }
+
+
+def _total_tokens(response) -> int:
+    return (getattr(response, "usage_metadata", None) or {}).get("total_tokens", 0)
+
+
+def _render_certificate(state: ExamState, completion_date: str) -> str:
+    """Fills the course's certificate template; no LLM call"""
+    return get_certificate_templates().render(
+        state.student_name,
+        state.course_name,
+        state.teacher_name,
+        completion_date,
+        state.percentage
+    )
+
+
+def _llm_certificate(state: ExamState, completion_date: str) -> str:
+    """
+    LLM certificate: the course's cached style filled with the student's fields
+    ("llm"), or one call per student ("llm_per_student", or when the course's
+    style is unusable).
+    """
+    fields = _certificate_fields(state, completion_date)
     
-    for mcq in state.mcqs:
-        student_answer = student_answers_dict.get(mcq.id)
-        is_correct = student_answer == mcq.correct_answer
+    if CERTIFICATE_MODE == "llm":
+        def create_style() -> Tuple[str, int]:
+            check_deadline("certificate")
+            response = (_CERTIFICATE_STYLE_PROMPT | get_llm()).invoke(fields, config=_CERTIFICATE_CALL)
+            return response.content.strip(), _total_tokens(response)
         
-        if is_correct:
-            correct_count += 1
+        style = get_certificate_styles().get_or_create(state.course_name, state.teacher_name, create_style)
+        if style is not None:
+            return fill_certificate(style, fields)
+    
+    check_deadline("certificate")
+    return (_CERTIFICATE_PROMPT | get_llm()).invoke(fields, config=_CERTIFICATE_CALL).content
+
+
+async def _allm_certificate(state: ExamState, completion_date: str) -> str:
+    """Async variant of _llm_certificate"""
+    fields = _certificate_fields(state, completion_date)
+    
+    if CERTIFICATE_MODE == "llm":
+        async def create_style() -> Tuple[str, int]:
+            response = await within_deadline(
+                (_CERTIFICATE_STYLE_PROMPT | get_llm()).ainvoke(fields, config=_CERTIFICATE_CALL), "certificate"
+            )
+            return response.content.strip(), _total_tokens(response)
         
-        question_results.append({
-            "question_id": mcq.id,
-            "question": mcq.question,
-            "student_answer": student_answer,
-            "correct_answer": mcq.correct_answer,
-            "is_correct": is_correct,
-            "learning_outcome": mcq.learning_outcome
-        })
-    
-    # Calculate scores
-    raw_score = correct_count
-    percentage = (correct_count / total_questions) * 100 if total_questions > 0 else 0
-    passed = percentage >= state.passing_score
-    
-    state.raw_score = raw_score
-    state.percentage = percentage
-    state.passed = passed
-    state.grading_report = {
-        "total_questions": total_questions,
-        "correct_answers": correct_count,
-        "incorrect_answers": total_questions - correct_count,
-        "raw_score": raw_score,
-        "percentage": round(percentage, 2),
-        "passing_score": state.passing_score,
-        "passed": passed,
-        "question_results": question_results
+        style = await get_certificate_styles().aget_or_create(state.course_name, state.teacher_name, create_style)
+        if style is not None:
+            return fill_certificate(style, fields)
+    
+    response = await within_deadline((_CERTIFICATE_PROMPT | get_llm()).ainvoke(fields, config=_CERTIFICATE_CALL), "certificate")
+    return response.content
+
+
+def _skip_certificate() -> Dict[str, Any]:
+    return {
+        "certificate_generated": False,
+        "certificate_text": None,
+        "current_step": "certificate_skipped"
     }
+
+
+def _complete_certificate(state: ExamState, content: str, completion_date: str) -> Dict[str, Any]:
+    certificate_text = content.strip()
+    state.certificate_text = certificate_text
+    state.certificate_generated = True
     
     return {
-        "raw_score": raw_score,
-        "percentage": percentage,
-        "passed": passed,
-        "grading_report": state.grading_report,
-        "current_step": "grading_complete"
+        "certificate_text": certificate_text,
+        "certificate_generated": True,
+        "completion_date": completion_date,
+        "current_step": "certificate_complete"
+    }
+
+
+def _fail_certificate(state: ExamState, e: Exception) -> Dict[str, Any]:
+    state.error_message = f"Certificate generation failed: {str(e)}"
+    return {
+        "certificate_generated": False,
+        "error_message": state.error_message
     }
 
 
 def certificate_node(state: ExamState) -> Dict[str, Any]:
     """
     Certificate Generation Agent Node
-    Generates diploma text only if student passed.
+    Generates diploma text only if student passed: rendered from the course
+    template, or written by the LLM when CERTIFICATE_MODE is "llm" or
+    "llm_per_student".
     """
     if not state.passed:
-        return {
-            "certificate_generated": False,
-            "certificate_text": None,
-            "current_step": "certificate_skipped"
-        }
+        return _skip_certificate()
     
     state.current_step = "certificate_generation"
     
@@ -366,42 +834,43 @@ def certificate_node(state: ExamState) -> Dict[str, Any]:
         completion_date = datetime.now().strftime("%B %d, %Y")
         state.completion_date = completion_date
         
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a professional certificate/diploma writer.
-            Generate a formal, professional certificate text for a student who has successfully completed a course.
-            The certificate should be:
-            - Professional and formal in tone
-            - Include all required information
-            - Suitable for official documentation
-            - Clear and concise"""),
-            ("human", f"""Generate a certificate/diploma text for:
-
-Student Name: {state.student_name}
-Course Name: {state.course_name}
-Teacher/Instructor: {state.teacher_name}
-Completion Date: {completion_date}
-Score: {state.percentage:.2f}%
-
-Generate the full certificate text now. Make it professional and suitable for official documentation.""")
-        ])
+        if CERTIFICATE_MODE == "template":
+            return _complete_certificate(state, _render_certificate(state, completion_date), completion_date)
         
-        chain = prompt | get_llm()
-        response = chain.invoke({})
+        return _complete_certificate(state, _llm_certificate(state, completion_date), completion_date)
         
-        certificate_text = response.content.strip()
-        state.certificate_text = certificate_text
-        state.certificate_generated = True
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        return _fail_certificate(state, e)
+
+
+async def acertificate_node(state: ExamState) -> Dict[str, Any]:
+    """
+    Async variant of certificate_node.
+    Awaits the LLM call so grading requests do not block the event loop.
+    """
+    if not state.passed:
+        return _skip_certificate()
+    
+    state.current_step = "certificate_generation"
+    
+    try:
+        completion_date = datetime.now().strftime("%B %d, %Y")
+        state.completion_date = completion_date
         
-        return {
-            "certificate_text": certificate_text,
-            "certificate_generated": True,
-            "completion_date": completion_date,
-            "current_step": "certificate_complete"
-        }
+        if CERTIFICATE_MODE == "template":
+            return _complete_certificate(state, _render_certificate(state, completion_date), completion_date)
+        
+        return _complete_certificate(state, await _allm_certificate(state, completion_date), completion_date)
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        state.error_message = f"Certificate generation failed: {str(e)}"
-        return {
-            "certificate_generated": False,
-            "error_message": state.error_message
-        }
+        return _fail_certificate(state, e)
+
+
+async def apolish_certificate(certificate_text: str) -> str:
+    """LLM enrichment of a template certificate, run as a background job"""
+    response = await (_CERTIFICATE_POLISH_PROMPT | get_llm()).ainvoke({"certificate_text": certificate_text})
+    return response.content.strip()
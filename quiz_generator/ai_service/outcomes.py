@@ -0,0 +1,96 @@
+"""
+Learning Outcome Matching
+LLMs paraphrase, abbreviate or number the learning outcomes they are given, so
+generated questions are mapped back to the canonical outcome text (by index,
+e.g. "LO2" or "3. ...", or by fuzzy text similarity) before coverage is
+checked. Exact string comparison would count a paraphrased outcome as missing
+and trigger a needless regeneration.
+"""
+import os
+import re
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+# Handle imports for both module and direct execution
+try:
+    from .state import MCQ
+    from .cache import normalize_text
+except ImportError:
+    from state import MCQ
+    from cache import normalize_text
+
+
+# Minimum similarity (0-1) for a paraphrased label to count as an outcome
+MATCH_THRESHOLD = float(os.getenv("OUTCOME_MATCH_THRESHOLD", "0.6"))
+
+# "LO2", "Outcome #3", "learning outcome 1: ...", "2. ...", "4"
+_INDEX_LABEL = re.compile(
+    r"^(?:(?:learning outcome|outcome|lo)\s*#?\s*(\d+)|#?(\d+)(?=$|[.:)\-\s]))[.:)\-\s]*(.*)$"
+)
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _similarity(a: str, b: str) -> float:
+    """Best of character-level ratio and word overlap (Dice) of two normalized texts"""
+    words_a, words_b = set(_WORD.findall(a)), set(_WORD.findall(b))
+    dice = 2 * len(words_a & words_b) / (len(words_a) + len(words_b)) if words_a and words_b else 0.0
+    return max(SequenceMatcher(None, a, b).ratio(), dice)
+
+
+class OutcomeMatcher:
+    """Maps free-text outcome labels to one of a fixed list of learning outcomes"""
+
+    def __init__(self, learning_outcomes: List[str], threshold: float = MATCH_THRESHOLD):
+        self.learning_outcomes = learning_outcomes
+        self.threshold = threshold
+        self._normalized = [normalize_text(outcome) for outcome in learning_outcomes]
+        self._exact = dict(zip(self._normalized, learning_outcomes))
+        self._cache: Dict[str, Optional[str]] = {}
+
+    def match(self, label: str) -> Optional[str]:
+        """The canonical outcome a label refers to, or None if nothing is close enough"""
+        key = normalize_text(label)
+        if key not in self._cache:
+            self._cache[key] = self._match(key)
+        return self._cache[key]
+
+    def _match(self, key: str) -> Optional[str]:
+        if not key:
+            return None
+        if key in self._exact:
+            return self._exact[key]
+
+        indexed = _INDEX_LABEL.match(key)
+        if indexed:
+            position = int(indexed.group(1) or indexed.group(2)) - 1
+            rest = indexed.group(3)
+            if 0 <= position < len(self.learning_outcomes) and (
+                not rest or _similarity(rest, self._normalized[position]) >= self.threshold
+            ):
+                return self.learning_outcomes[position]
+            if rest:
+                key = rest
+
+        scores = [_similarity(key, outcome) for outcome in self._normalized]
+        best = max(range(len(scores)), key=scores.__getitem__, default=None)
+        if best is None or scores[best] < self.threshold:
+            return None
+        return self.learning_outcomes[best]
+
+    def assign(self, mcqs: List[MCQ]) -> Tuple[List[MCQ], List[str]]:
+        """
+        Rewrites each question's learning_outcome to the canonical text where
+        it matches one (unmatched labels are kept as they are). Returns the
+        questions and the outcomes no question covers, in outcome order.
+        """
+        assigned = []
+        covered = set()
+        for mcq in mcqs:
+            outcome = self.match(mcq.learning_outcome)
+            if outcome is not None:
+                covered.add(outcome)
+                if outcome != mcq.learning_outcome:
+                    mcq = mcq.model_copy(update={"learning_outcome": outcome})
+            assigned.append(mcq)
+        missing = [outcome for outcome in self.learning_outcomes if outcome not in covered]
+        return assigned, missing
@@ -0,0 +1,68 @@
+"""
+Incremental JSON Extraction
+Pulls complete question objects out of an LLM response while it is still
+being streamed, so each question can be used as soon as its closing brace
+arrives instead of after the whole completion has been parsed.
+"""
+import json
+from typing import Any, Dict, List
+
+
+class IncrementalQuestionParser:
+    """
+    Feed response text chunk by chunk; every call returns the question objects
+    completed by that chunk. Question objects are the elements of the
+    "questions" array ({"questions": [{...}, ...]}) or of a bare top-level
+    array ([{...}, ...]). Markdown fences and prose around the JSON are ignored.
+    """
+
+    def __init__(self):
+        self._buffer: List[str] = []
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+        self._position = 0
+        self.errors: List[str] = []
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        completed = []
+        for char in chunk:
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if char == "{" and self._stack in (["{", "["], ["["]):
+                    self._object_start = self._position
+                self._stack.append(char)
+            elif char in "}]" and self._stack:
+                self._stack.pop()
+                if char == "}" and self._object_start is not None and self._stack in (["{", "["], ["["]):
+                    text = "".join(self._buffer[self._object_start:self._position + 1])
+                    self._object_start = None
+                    try:
+                        obj = json.loads(text)
+                    except json.JSONDecodeError as e:
+                        self.errors.append(f"Malformed question object: {e}")
+                    else:
+                        if isinstance(obj, dict):
+                            completed.append(obj)
+            self._position += 1
+        return completed
+
+    @property
+    def truncated(self) -> bool:
+        """True if the text fed so far ends inside an unfinished JSON value"""
+        return bool(self._stack) or self._in_string
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far"""
+        return "".join(self._buffer)
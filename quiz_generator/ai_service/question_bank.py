@@ -0,0 +1,313 @@
+"""
+Question Bank
+Persistent pools of pre-generated MCQs per course and learning outcome.
+Student exams are assembled by sampling the pools (every outcome covered);
+the LLM is only called in the background when a pool runs low.
+Async code uses the a-prefixed methods, which run SQLite calls in a worker thread.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, TypeVar
+
+# Handle imports for both module and direct execution
+try:
+    from .state import MCQ, OutcomeGenerationTask
+    from .nodes import MAX_QUESTIONS, MIN_QUESTIONS, agenerate_outcome_mcqs_node, questions_per_outcome
+    from .cache import normalize_text
+    from .deadlines import DeadlineExceeded, request_deadline
+    from .resilience import CircuitOpenError
+    from .shared import SQLITE_BUSY_TIMEOUT_SECONDS, offload
+except ImportError:
+    from state import MCQ, OutcomeGenerationTask
+    from nodes import MAX_QUESTIONS, MIN_QUESTIONS, agenerate_outcome_mcqs_node, questions_per_outcome
+    from cache import normalize_text
+    from deadlines import DeadlineExceeded, request_deadline
+    from resilience import CircuitOpenError
+    from shared import SQLITE_BUSY_TIMEOUT_SECONDS, offload
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class QuestionBankStore:
+    """Interface for question pool storage, keyed by (course, outcome)"""
+
+    # Whether calls do file I/O (async callers run them in a worker thread)
+    blocking = True
+
+    def add(self, course_name: str, learning_outcome: str, mcqs: List[MCQ]) -> int:
+        """Adds questions to a pool, skipping duplicates; returns how many were added"""
+        raise NotImplementedError
+
+    def pool(self, course_name: str, learning_outcome: str) -> List[MCQ]:
+        raise NotImplementedError
+
+    def count(self, course_name: str, learning_outcome: str) -> int:
+        return len(self.pool(course_name, learning_outcome))
+
+    def total(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryQuestionBankStore(QuestionBankStore):
+    """Process-local pools; useful for tests and single-worker development"""
+
+    blocking = False
+
+    def __init__(self):
+        self._pools: Dict[Tuple[str, str], Dict[str, MCQ]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, course_name: str, learning_outcome: str, mcqs: List[MCQ]) -> int:
+        key = (normalize_text(course_name), normalize_text(learning_outcome))
+        added = 0
+        with self._lock:
+            pool = self._pools.setdefault(key, {})
+            for mcq in mcqs:
+                question_key = normalize_text(mcq.question)
+                if question_key not in pool:
+                    pool[question_key] = mcq
+                    added += 1
+        return added
+
+    def pool(self, course_name: str, learning_outcome: str) -> List[MCQ]:
+        key = (normalize_text(course_name), normalize_text(learning_outcome))
+        with self._lock:
+            return list(self._pools.get(key, {}).values())
+
+    def total(self) -> int:
+        with self._lock:
+            return sum(len(pool) for pool in self._pools.values())
+
+
+class SQLiteQuestionBankStore(QuestionBankStore):
+    """Pools persisted in SQLite so they survive restarts and are shared by workers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS question_bank ("
+            "course_key TEXT NOT NULL, outcome_key TEXT NOT NULL, question_key TEXT NOT NULL, "
+            "payload TEXT NOT NULL, PRIMARY KEY (course_key, outcome_key, question_key))"
+        )
+        self._conn.commit()
+
+    def add(self, course_name: str, learning_outcome: str, mcqs: List[MCQ]) -> int:
+        course_key, outcome_key = normalize_text(course_name), normalize_text(learning_outcome)
+        rows = [
+            (course_key, outcome_key, normalize_text(mcq.question), json.dumps(mcq.model_dump()))
+            for mcq in mcqs
+        ]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO question_bank (course_key, outcome_key, question_key, payload) "
+                "VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def pool(self, course_name: str, learning_outcome: str) -> List[MCQ]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM question_bank WHERE course_key = ? AND outcome_key = ?",
+                (normalize_text(course_name), normalize_text(learning_outcome))
+            ).fetchall()
+        return [MCQ(**json.loads(payload)) for (payload,) in rows]
+
+    def count(self, course_name: str, learning_outcome: str) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM question_bank WHERE course_key = ? AND outcome_key = ?",
+                (normalize_text(course_name), normalize_text(learning_outcome))
+            ).fetchone()
+        return count
+
+    def total(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM question_bank").fetchone()
+        return count
+
+
+class QuestionBank:
+    """
+    Assembles exams from the pools and keeps them stocked.
+    A pool below low_water is topped up to target_per_outcome in the background.
+    """
+
+    def __init__(
+        self,
+        store: QuestionBankStore,
+        target_per_outcome: int = 20,
+        low_water: int = 10,
+        max_concurrency: int = 4
+    ):
+        self.store = store
+        self.target_per_outcome = target_per_outcome
+        self.low_water = low_water
+        self.max_concurrency = max_concurrency
+        self.exams_assembled = 0
+        self.assembly_misses = 0
+        self.refill_calls = 0
+        self.refill_failures = 0
+        self._refilling: Set[Tuple[str, str]] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def _call(self, fn: Callable[..., T], *args: Any) -> T:
+        return await offload(fn, *args) if self.store.blocking else fn(*args)
+
+    def assemble_exam(self, course_name: str, learning_outcomes: List[str]) -> Optional[List[MCQ]]:
+        """
+        Samples a fresh exam from the pools: up to the per-outcome quota and at
+        least one question for every outcome. Returns None if any pool is empty
+        or the exam would fall outside MIN_QUESTIONS..MAX_QUESTIONS, the range
+        generated exams are held to.
+        """
+        quota = questions_per_outcome(len(learning_outcomes))
+        sampled: List[MCQ] = []
+        for outcome in learning_outcomes:
+            pool = self.store.pool(course_name, outcome)
+            if not pool:
+                self.assembly_misses += 1
+                return None
+            sampled.extend(
+                mcq.model_copy(update={"learning_outcome": outcome})
+                for mcq in random.sample(pool, min(quota, len(pool)))
+            )
+        if not MIN_QUESTIONS <= len(sampled) <= MAX_QUESTIONS:
+            self.assembly_misses += 1
+            return None
+        self.exams_assembled += 1
+        return [mcq.model_copy(update={"id": f"q{index}"}) for index, mcq in enumerate(sampled, start=1)]
+
+    def add_exam(self, course_name: str, mcqs: List[MCQ]) -> None:
+        """Seeds the pools with the questions of a freshly generated exam"""
+        by_outcome: Dict[str, List[MCQ]] = {}
+        for mcq in mcqs:
+            by_outcome.setdefault(mcq.learning_outcome, []).append(mcq)
+        for outcome, outcome_mcqs in by_outcome.items():
+            self.store.add(course_name, outcome, outcome_mcqs)
+
+    def low_outcomes(self, course_name: str, learning_outcomes: List[str]) -> List[str]:
+        return [
+            outcome for outcome in learning_outcomes
+            if self.store.count(course_name, outcome) < self.low_water
+        ]
+
+    async def aassemble_exam(self, course_name: str, learning_outcomes: List[str]) -> Optional[List[MCQ]]:
+        return await self._call(self.assemble_exam, course_name, learning_outcomes)
+
+    async def aadd_exam(self, course_name: str, mcqs: List[MCQ]) -> None:
+        await self._call(self.add_exam, course_name, mcqs)
+
+    async def alow_outcomes(self, course_name: str, learning_outcomes: List[str]) -> List[str]:
+        return await self._call(self.low_outcomes, course_name, learning_outcomes)
+
+    async def refill(self, course_name: str, teacher_name: str, learning_outcomes: List[str]) -> Dict[str, int]:
+        """Tops up every low pool to the target size; returns questions added per outcome"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def refill_outcome(outcome: str) -> int:
+            key = (normalize_text(course_name), normalize_text(outcome))
+            if key in self._refilling:
+                return 0
+            self._refilling.add(key)
+            try:
+                missing = self.target_per_outcome - await self._call(self.store.count, course_name, outcome)
+                if missing <= 0:
+                    return 0
+                async with semaphore:
+                    self.refill_calls += 1
+                    update = await agenerate_outcome_mcqs_node(OutcomeGenerationTask(
+                        course_name=course_name,
+                        teacher_name=teacher_name,
+                        learning_outcomes=[outcome],
+                        questions_per_outcome=missing
+                    ))
+                batch = update["mcq_batches"][0]
+                if batch.error:
+                    self.refill_failures += 1
+                return await self._call(self.store.add, course_name, outcome, batch.mcqs)
+            except (DeadlineExceeded, CircuitOpenError) as e:
+                # Raised through the node for requests; a refill just retries on a later exam
+                self.refill_failures += 1
+                logger.warning("Question bank refill for %r stopped: %s", outcome, e)
+                return 0
+            finally:
+                self._refilling.discard(key)
+
+        low = await self.alow_outcomes(course_name, learning_outcomes)
+        added = await asyncio.gather(*[refill_outcome(outcome) for outcome in low])
+        return dict(zip(low, added))
+
+    async def aschedule_refill(self, course_name: str, teacher_name: str, learning_outcomes: List[str]) -> bool:
+        """Starts a background refill if any pool is low; returns whether one was scheduled"""
+        if not await self.alow_outcomes(course_name, learning_outcomes):
+            return False
+        # The task copies the request's context; it must not inherit its deadline
+        with request_deadline(None):
+            task = asyncio.get_running_loop().create_task(
+                self.refill(course_name, teacher_name, learning_outcomes)
+            )
+        # Keep a reference so the task is not garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    def status(self, course_name: str, learning_outcomes: List[str]) -> Dict[str, int]:
+        return {outcome: self.store.count(course_name, outcome) for outcome in learning_outcomes}
+
+    async def astatus(self, course_name: str, learning_outcomes: List[str]) -> Dict[str, int]:
+        return await self._call(self.status, course_name, learning_outcomes)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "questions": self.store.total(),
+            "exams_assembled": self.exams_assembled,
+            "assembly_misses": self.assembly_misses,
+            "refill_llm_calls": self.refill_calls,
+            "refill_failures": self.refill_failures,
+            "refills_in_flight": len(self._tasks)
+        }
+
+    async def astats(self) -> Dict[str, int]:
+        return await self._call(self.stats)
+
+
+def build_question_bank() -> QuestionBank:
+    """
+    Builds the question bank from environment configuration:
+    QUESTION_BANK_SQLITE_PATH (":memory:" keeps pools in-process),
+    QUESTION_BANK_TARGET_PER_OUTCOME, QUESTION_BANK_LOW_WATER and
+    QUESTION_BANK_MAX_CONCURRENCY.
+    """
+    path = os.getenv("QUESTION_BANK_SQLITE_PATH", str(Path(__file__).parent / "question_bank.db"))
+    store = MemoryQuestionBankStore() if path == ":memory:" else SQLiteQuestionBankStore(path)
+    return QuestionBank(
+        store,
+        target_per_outcome=int(os.getenv("QUESTION_BANK_TARGET_PER_OUTCOME", "20")),
+        low_water=int(os.getenv("QUESTION_BANK_LOW_WATER", "10")),
+        max_concurrency=int(os.getenv("QUESTION_BANK_MAX_CONCURRENCY", "4"))
+    )
+
+
+# Question bank will be initialized lazily when needed
+_question_bank = None
+
+def get_question_bank(create: bool = True) -> Optional[QuestionBank]:
+    """Return the process-wide question bank (None if not yet created and create=False)"""
+    global _question_bank
+    if _question_bank is None and create:
+        _question_bank = build_question_bank()
+    return _question_bank
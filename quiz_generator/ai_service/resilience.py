@@ -0,0 +1,351 @@
+"""
+LLM Call Resilience
+Wraps the chat model of every provider so that provider trouble costs
+seconds, not failed exams or hung requests:
+- each async attempt is bounded by LLM_TIMEOUT_SECONDS; sync attempts rely
+  on the HTTP client timeout of the wrapped model (llm.py), so models
+  without one, such as the fake, are not bounded on the sync path
+- transient failures (429, 5xx, timeouts, connection errors) are retried
+  with jittered exponential backoff, honouring Retry-After, and never
+  sleeping past the request deadline
+- a circuit breaker opens after LLM_BREAKER_FAILURE_THRESHOLD consecutive
+  calls failed transiently (once their retries ran out); while open, calls
+  fail immediately instead of waiting on a degraded provider. After LLM_BREAKER_RESET_SECONDS one trial call is
+  let through, and its outcome closes or reopens the breaker.
+- every attempt takes from the per-minute LLM budget (admission.py) before
+  it is sent, and is charged its actual tokens when it returns
+The breaker is per worker process; its state is reported by /health.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+import openai
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+# Handle imports for both module and direct execution
+try:
+    from .metrics import REGISTRY, RETRIES
+    from .deadlines import DeadlineExceeded, remaining_seconds
+    from .admission import get_llm_budget
+except ImportError:
+    from metrics import REGISTRY, RETRIES
+    from deadlines import DeadlineExceeded, remaining_seconds
+    from admission import get_llm_budget
+
+
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "20"))
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+
+class LLMCallTimeout(Exception):
+    """An LLM call attempt took longer than LLM_TIMEOUT_SECONDS"""
+
+
+class CircuitOpenError(Exception):
+    """The LLM provider is failing; calls are rejected until the breaker resets"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM provider unavailable (circuit breaker open), retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def is_transient(error: BaseException) -> bool:
+    """Rate limits, server errors, timeouts and connection failures are worth retrying"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    return isinstance(error, (LLMCallTimeout, openai.APIConnectionError, httpx.TransportError))
+
+
+def estimated_tokens(messages: List[BaseMessage]) -> int:
+    """Prompt tokens of a call, estimated at four characters per token"""
+    return sum(len(str(message.content)) for message in messages) // 4
+
+
+def usage_tokens(message: Any) -> int:
+    """Total tokens a provider reported on a message or chunk (0 if none)"""
+    usage = getattr(message, "usage_metadata", None) or {}
+    return usage.get("total_tokens") or (usage.get("input_tokens", 0) + usage.get("output_tokens", 0))
+
+
+def retry_delay(attempt: int, error: BaseException) -> float:
+    """Full-jitter exponential backoff; a provider's Retry-After is respected"""
+    delay = random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, min(float(retry_after), LLM_RETRY_MAX_SECONDS))
+        except ValueError:
+            pass
+    return delay
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker: closed -> open -> half_open -> closed"""
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.opened = 0
+        self.retried = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> bool:
+        """Raises CircuitOpenError unless a call may go to the provider; True for the trial call"""
+        with self._lock:
+            if self.state == "closed":
+                return False
+            retry_in = self.opened_at + self.reset_seconds - time.monotonic()
+            if self.state == "open" and retry_in <= 0:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            self.rejected += 1
+            raise CircuitOpenError(max(retry_in, 0.0))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._trial_running = False
+
+    def record_failure(self, transient: bool) -> None:
+        """Only transient failures count; a bad request says nothing about the provider"""
+        with self._lock:
+            self._trial_running = False
+            if not transient:
+                if self.state == "half_open":
+                    self.state = "closed"
+                return
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def record_retry(self) -> None:
+        """An attempt failed and the call goes on; only the call's final outcome counts"""
+        with self._lock:
+            self.retried += 1
+
+    def release_trial(self) -> None:
+        """The trial call ended without an outcome (cancelled); let another one through"""
+        with self._lock:
+            self._trial_running = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.opened,
+                "rejected_calls": self.rejected,
+                "retried_attempts": self.retried
+            }
+            if self.state == "open":
+                stats["retry_in_seconds"] = round(max(self.opened_at + self.reset_seconds - time.monotonic(), 0.0), 1)
+            return stats
+
+    def collect(self) -> List[str]:
+        """Breaker state in the Prometheus text format"""
+        stats = self.stats()
+        lines = [
+            "# HELP quiz_llm_circuit_state LLM circuit breaker state (1 for the current state)",
+            "# TYPE quiz_llm_circuit_state gauge"
+        ]
+        for state in ("closed", "open", "half_open"):
+            lines.append(f'quiz_llm_circuit_state{{state="{state}"}} {int(stats["state"] == state)}')
+        lines += [
+            "# HELP quiz_llm_circuit_rejected_total LLM calls rejected while the breaker was open",
+            "# TYPE quiz_llm_circuit_rejected_total counter",
+            f"quiz_llm_circuit_rejected_total {stats['rejected_calls']}"
+        ]
+        return lines
+
+
+# Shared by every LLM call of the process
+LLM_BREAKER = REGISTRY.register(CircuitBreaker())
+
+
+class ResilientChatModel(BaseChatModel):
+    """Chat model running each call of the wrapped model with timeouts, retries and the breaker"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    model: BaseChatModel
+    breaker: CircuitBreaker = LLM_BREAKER
+    max_retries: int = LLM_MAX_RETRIES
+    timeout_seconds: float = LLM_TIMEOUT_SECONDS
+
+    @property
+    def _llm_type(self) -> str:
+        return self.model._llm_type
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.model._identifying_params
+
+    def _should_retry(self, attempt: int, error: BaseException, trial: bool) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up (the trial call is not retried)"""
+        if trial or not is_transient(error) or attempt >= self.max_retries:
+            return None
+        delay = retry_delay(attempt, error)
+        remaining = remaining_seconds()
+        if remaining is not None and delay >= remaining:
+            return None
+        self.breaker.record_retry()
+        RETRIES.inc(kind="llm_call")
+        return delay
+
+    def _record_outcome(self, trial: bool, error: Optional[BaseException]) -> None:
+        """Reports a call to the breaker once, after its retries"""
+        if error is None:
+            self.breaker.record_success()
+        elif isinstance(error, (asyncio.CancelledError, GeneratorExit, DeadlineExceeded)):
+            # Ended without an answer from the provider
+            if trial:
+                self.breaker.release_trial()
+        else:
+            self.breaker.record_failure(is_transient(error))
+
+    # Each attempt takes one request and its estimated tokens from the budget.
+    # A failed attempt's tokens are refunded, as are a cancelled one's unless a
+    # stream already produced output; a successful one is charged the tokens
+    # the provider reported.
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        trial = self.breaker.before_call()
+        try:
+            result = self._generate_attempts(messages, stop, trial, **kwargs)
+        except BaseException as e:
+            self._record_outcome(trial, e)
+            raise
+        self._record_outcome(trial, None)
+        return result
+
+    def _generate_attempts(self, messages: List[BaseMessage], stop: Optional[List[str]],
+                           trial: bool, **kwargs: Any) -> ChatResult:
+        budget = get_llm_budget()
+        estimate = estimated_tokens(messages)
+        attempt = 0
+        while True:
+            budget.acquire(estimate)
+            try:
+                # Timeouts come from the HTTP client of the wrapped model (none for the fake)
+                result = self.model._generate(messages, stop=stop, **kwargs)
+            except Exception as e:
+                budget.charge(0, -estimate)
+                delay = self._should_retry(attempt, e, trial)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            budget.charge(0, (usage_tokens(result.generations[0].message) or estimate) - estimate)
+            return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        trial = self.breaker.before_call()
+        try:
+            result = await self._agenerate_attempts(messages, stop, trial, **kwargs)
+        except BaseException as e:
+            self._record_outcome(trial, e)
+            raise
+        self._record_outcome(trial, None)
+        return result
+
+    async def _agenerate_attempts(self, messages: List[BaseMessage], stop: Optional[List[str]],
+                                  trial: bool, **kwargs: Any) -> ChatResult:
+        budget = get_llm_budget()
+        estimate = estimated_tokens(messages)
+        attempt = 0
+        while True:
+            await budget.aacquire(estimate)
+            try:
+                result = await asyncio.wait_for(
+                    self.model._agenerate(messages, stop=stop, **kwargs), self.timeout_seconds
+                )
+            except asyncio.TimeoutError:
+                error = LLMCallTimeout(f"LLM call timed out after {self.timeout_seconds:g}s")
+            except Exception as e:
+                error = e
+            except BaseException:
+                # Cancelled by the deadline or a disconnect; the refund must finish regardless
+                await asyncio.shield(budget.acharge(0, -estimate))
+                raise
+            else:
+                await budget.acharge(0, (usage_tokens(result.generations[0].message) or estimate) - estimate)
+                return result
+            await budget.acharge(0, -estimate)
+            delay = self._should_retry(attempt, error, trial)
+            if delay is None:
+                raise error
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        """Retries until the first chunk arrives; a stream that fails midway is not replayed"""
+        trial = self.breaker.before_call()
+        try:
+            async for chunk in self._astream_attempts(messages, stop, trial, **kwargs):
+                yield chunk
+        except BaseException as e:
+            self._record_outcome(trial, e)
+            raise
+        self._record_outcome(trial, None)
+
+    async def _astream_attempts(self, messages: List[BaseMessage], stop: Optional[List[str]],
+                                trial: bool, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        budget = get_llm_budget()
+        estimate = estimated_tokens(messages)
+        attempt = 0
+        while True:
+            await budget.aacquire(estimate)
+            started = False
+            tokens = 0
+            try:
+                async for chunk in self.model._astream(messages, stop=stop, **kwargs):
+                    started = True
+                    tokens += usage_tokens(chunk.message)
+                    yield chunk
+            except Exception as e:
+                if started:
+                    raise
+                await budget.acharge(0, -estimate)
+                delay = self._should_retry(attempt, e, trial)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled or closed; an attempt that produced no output used no tokens
+                if not started:
+                    await asyncio.shield(budget.acharge(0, -estimate))
+                raise
+            await budget.acharge(0, (tokens or estimate) - estimate)
+            return
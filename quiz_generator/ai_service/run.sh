@@ -45,5 +45,12 @@ echo ""
 echo "Press Ctrl+C to stop the server"
 echo ""
 
-# Run uvicorn from project root with package path
-uvicorn ai_service.main:app --host 0.0.0.0 --port 8000 --reload
+# Production: multiple workers with shared cache/job state and graceful shutdown
+# (./run.sh --production [--workers N]); development: single process with reload
+if [ "$1" = "--production" ]; then
+    shift
+    python ai_service/serve.py --host 0.0.0.0 --port 8000 "$@"
+else
+    # Run uvicorn from project root with package path
+    uvicorn ai_service.main:app --host 0.0.0.0 --port 8000 --reload
+fi
@@ -0,0 +1,204 @@
+"""
+Grading Engine
+Validates and scores answer sheets against a precomputed answer key without
+building Pydantic models: the key holds question ids, correct answers and
+learning outcomes as parallel arrays plus an id -> position map, and a sheet
+is checked and scored in one pass over its answers. Single grading requests,
+batch grading and the grading graph's supervisor and grading nodes all use
+this engine.
+
+Graded sheets are compact: answers are kept as one byte per question
+(0-3 for A-D) and question text stays in the answer key; the per-question
+grading report is only built when a response is serialized.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Handle imports for both module and direct execution
+try:
+    from .state import MCQ
+except ImportError:
+    from state import MCQ
+
+
+ANSWER_LETTERS = "ABCD"
+ANSWER_CODES = {letter: code for code, letter in enumerate(ANSWER_LETTERS)}
+VALID_ANSWERS = frozenset(ANSWER_LETTERS)
+# Code of a question without an answer
+UNANSWERED = 255
+
+# (question_id, answer) pairs as submitted
+AnswerPairs = Iterable[Tuple[str, str]]
+
+
+def _letter(code: int) -> Optional[str]:
+    return ANSWER_LETTERS[code] if code < len(ANSWER_LETTERS) else None
+
+
+class AnswerKey:
+    """Correct answers of one exam, indexed by question id"""
+
+    __slots__ = ("mcqs", "question_ids", "correct_answers", "correct_codes", "index",
+                 "outcomes", "outcome_positions")
+
+    def __init__(self, mcqs: List[MCQ]):
+        self.mcqs = mcqs
+        self.question_ids = [mcq.id for mcq in mcqs]
+        self.correct_answers = [mcq.correct_answer for mcq in mcqs]
+        self.correct_codes = bytes(ANSWER_CODES.get(answer, UNANSWERED) for answer in self.correct_answers)
+        self.index = {question_id: i for i, question_id in enumerate(self.question_ids)}
+        # Distinct learning outcomes in question order, and each question's outcome position
+        outcome_index: Dict[str, int] = {}
+        self.outcome_positions = [
+            outcome_index.setdefault(mcq.learning_outcome, len(outcome_index)) for mcq in mcqs
+        ]
+        self.outcomes = list(outcome_index)
+
+    def __len__(self) -> int:
+        return len(self.question_ids)
+
+
+class GradedSheet:
+    """
+    One graded (or rejected) answer sheet. answers holds one code per question
+    in key order; validation_errors is non-empty when the sheet was not graded.
+    """
+
+    __slots__ = ("answers", "raw_score", "percentage", "passed", "validation_errors")
+
+    def __init__(
+        self,
+        answers: Optional[bytes] = None,
+        raw_score: int = 0,
+        percentage: float = 0.0,
+        passed: bool = False,
+        validation_errors: Optional[List[str]] = None
+    ):
+        self.answers = answers
+        self.raw_score = raw_score
+        self.percentage = percentage
+        self.passed = passed
+        self.validation_errors = validation_errors or []
+
+    @property
+    def graded(self) -> bool:
+        return not self.validation_errors
+
+    def grading_report(self, key: AnswerKey, passing_score: float, detail: str = "full") -> Dict[str, Any]:
+        """
+        The public grading report. "full" is the format the grading node has
+        always produced; "ids" leaves question and outcome text out of the
+        question results; "summary" has no per-question results.
+        """
+        total_questions = len(key)
+        report = {
+            "total_questions": total_questions,
+            "correct_answers": self.raw_score,
+            "incorrect_answers": total_questions - self.raw_score,
+            "raw_score": self.raw_score,
+            "percentage": round(self.percentage, 2),
+            "passing_score": passing_score,
+            "passed": self.passed
+        }
+        if detail == "summary":
+            return report
+
+        rows = zip(key.question_ids, self.answers, key.correct_answers, key.correct_codes)
+        if detail == "ids":
+            report["question_results"] = [
+                {
+                    "question_id": question_id,
+                    "student_answer": _letter(code),
+                    "correct_answer": correct_answer,
+                    "is_correct": code == correct_code
+                }
+                for question_id, code, correct_answer, correct_code in rows
+            ]
+            return report
+
+        report["question_results"] = [
+            {
+                "question_id": question_id,
+                "question": mcq.question,
+                "student_answer": _letter(code),
+                "correct_answer": correct_answer,
+                "is_correct": code == correct_code,
+                "learning_outcome": mcq.learning_outcome
+            }
+            for mcq, (question_id, code, correct_answer, correct_code) in zip(key.mcqs, rows)
+        ]
+        return report
+
+
+def answer_pairs(student_answers: List[Dict[str, str]]) -> AnswerPairs:
+    """(question_id, answer) pairs of a request's [{"question_id": ..., "answer": ...}] list"""
+    return ((answer.get("question_id", ""), answer.get("answer", "")) for answer in student_answers)
+
+
+def check_answer_sheet(key: AnswerKey, pairs: AnswerPairs) -> Tuple[bytearray, List[str]]:
+    """
+    Validation pass: every question answered exactly once with A-D and no
+    unknown question ids. Returns the answer codes in question order and the
+    validation errors (same messages as the supervisor node has always given).
+    """
+    answers = bytearray([UNANSWERED]) * len(key)
+    if not key.question_ids:
+        return answers, ["No questions available to validate"]
+
+    seen = set()
+    duplicates = []
+    invalid_answers = []
+    for question_id, value in pairs:
+        if question_id in seen:
+            duplicates.append(question_id)
+        seen.add(question_id)
+        code = ANSWER_CODES.get(value)
+        if code is None:
+            invalid_answers.append(f"{question_id}: {value}")
+        position = key.index.get(question_id)
+        if position is None:
+            invalid_answers.append(f"{question_id}: Invalid question ID")
+        elif code is not None:
+            answers[position] = code
+
+    if not seen:
+        return answers, ["No student answers provided"]
+
+    validation_errors = []
+    missing_questions = [question_id for question_id in key.question_ids if question_id not in seen]
+    if missing_questions:
+        validation_errors.append(f"Missing answers for questions: {', '.join(sorted(missing_questions))}")
+    if duplicates:
+        validation_errors.append(f"Duplicate answers for questions: {', '.join(duplicates)}")
+    if invalid_answers:
+        validation_errors.append(f"Invalid answer format: {', '.join(invalid_answers)}")
+    return answers, validation_errors
+
+
+def score_answer_sheet(key: AnswerKey, answers: bytes, passing_score: float) -> GradedSheet:
+    """Scores answer codes given in question order"""
+    correct_count = sum(code == correct for code, correct in zip(answers, key.correct_codes))
+    total_questions = len(key)
+    percentage = (correct_count / total_questions) * 100 if total_questions > 0 else 0
+    return GradedSheet(
+        answers=bytes(answers),
+        raw_score=correct_count,
+        percentage=percentage,
+        passed=percentage >= passing_score
+    )
+
+
+def grade_answer_sheet(key: AnswerKey, student_answers: List[Dict[str, str]], passing_score: float) -> GradedSheet:
+    """Validates and scores one answer sheet in a single pass"""
+    answers, validation_errors = check_answer_sheet(key, answer_pairs(student_answers))
+    if validation_errors:
+        return GradedSheet(validation_errors=validation_errors)
+    return score_answer_sheet(key, answers, passing_score)
+
+
+def grade_answer_sheets(
+    key: AnswerKey,
+    sheets: Iterable[List[Dict[str, str]]],
+    passing_score: float
+) -> List[GradedSheet]:
+    """grade_answer_sheet for many sheets against one key"""
+    return [grade_answer_sheet(key, student_answers, passing_score) for student_answers in sheets]
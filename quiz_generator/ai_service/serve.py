@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Production launcher for the AI Quiz Generator service
+Runs uvicorn with several worker processes (one per CPU core by default)
+instead of the single-process development server:
+- workers share exam cache, jobs and certificate styles through the shared
+  state backend (SQLite by default, see shared.py), so adding workers does
+  not multiply LLM calls through per-process cache misses
+- each worker warms up its state (compiled graphs, LLM client, stores)
+  during startup, before it accepts requests
+- on SIGTERM/SIGINT the workers stop accepting connections, let in-flight
+  requests and their LLM calls finish for up to --graceful-timeout seconds,
+  then give running jobs the same grace (SHUTDOWN_DRAIN_SECONDS)
+
+Usage:
+    python serve.py --workers 4 --port 8000
+"""
+import argparse
+import os
+from pathlib import Path
+
+import uvicorn
+
+
+def default_workers() -> int:
+    """SERVICE_WORKERS or WEB_CONCURRENCY if set, otherwise the number of CPU cores"""
+    configured = os.getenv("SERVICE_WORKERS") or os.getenv("WEB_CONCURRENCY")
+    return int(configured) if configured else (os.cpu_count() or 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=default_workers(), help="worker processes (default: CPU cores)")
+    parser.add_argument("--graceful-timeout", type=float, default=float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "30")),
+                        help="seconds in-flight requests and running jobs get to finish on shutdown")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    args = parser.parse_args()
+
+    # Read by the workers at import: worker count selects the shared backend
+    os.environ["SERVICE_WORKERS"] = str(args.workers)
+    os.environ["SHUTDOWN_DRAIN_SECONDS"] = str(args.graceful_timeout)
+
+    uvicorn.run(
+        "main:app",
+        app_dir=str(Path(__file__).parent),
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        log_level=args.log_level,
+        proxy_headers=True
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Shared State Backend
+Key-value state that must be consistent across worker processes: the exam
+cache tier, job records, certificate styles and rate-limit counters. With
+several workers (see serve.py) every process sees the same entries, so a
+cache miss in one worker does not mean another LLM call for an exam a
+different worker already generated.
+
+SHARED_BACKEND selects the implementation:
+- memory: process-local (default for a single worker)
+- sqlite: a WAL-mode SQLite file shared by the workers on one host
+  (default when SERVICE_WORKERS > 1); SHARED_BACKEND_PATH sets the file
+- package.module:factory: any callable returning a SharedBackend, e.g. a
+  Redis-backed implementation for several hosts
+Backends that do file or network I/O are "blocking": async code uses the
+a-prefixed variants (aget, aset, ...), which run their calls in a worker
+thread so a write lock held by another process does not stall the event loop.
+"""
+import asyncio
+import importlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+
+# Worker processes serving the app; set by serve.py for its workers
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "1"))
+
+SHARED_BACKEND = os.getenv("SHARED_BACKEND") or ("sqlite" if SERVICE_WORKERS > 1 else "memory")
+
+# How long a SQLite call waits for another process's write lock before failing
+SQLITE_BUSY_TIMEOUT_SECONDS = float(os.getenv("SQLITE_BUSY_TIMEOUT_SECONDS", "2"))
+
+T = TypeVar("T")
+
+
+async def offload(fn: Callable[..., T], *args: Any) -> T:
+    """Runs a blocking store call in a worker thread"""
+    return await asyncio.to_thread(fn, *args)
+
+
+def _expires_at(ttl_seconds: Optional[float]) -> Optional[float]:
+    return time.time() + ttl_seconds if ttl_seconds is not None else None
+
+
+class SharedBackend:
+    """
+    Interface for shared state backends. Values are strings (callers store
+    JSON); entries are grouped by namespace and may expire after a TTL.
+    """
+
+    # False for backends that are only visible to the current process
+    shared = True
+    # False for backends whose calls never wait on I/O
+    blocking = True
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def add(self, namespace: str, key: str, value: str, ttl_seconds: Optional[float] = None) -> bool:
+        """Sets the entry only if it does not exist (or has expired); True if it was set"""
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str) -> None:
+        raise NotImplementedError
+
+    def incr(self, namespace: str, key: str, amount: int = 1, ttl_seconds: Optional[float] = None) -> int:
+        """
+        Atomically adds amount to an integer entry and returns the new value.
+        A missing or expired entry starts from zero with the given TTL; the
+        TTL of a live entry is kept (fixed windows for rate limits).
+        """
+        raise NotImplementedError
+
+    def scan(self, namespace: str) -> List[Tuple[str, str]]:
+        """All live (key, value) pairs of a namespace"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, object]:
+        return {}
+
+    async def _call(self, fn: Callable[..., T], *args: Any) -> T:
+        return await offload(fn, *args) if self.blocking else fn(*args)
+
+    async def aget(self, namespace: str, key: str) -> Optional[str]:
+        return await self._call(self.get, namespace, key)
+
+    async def aset(self, namespace: str, key: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        await self._call(self.set, namespace, key, value, ttl_seconds)
+
+    async def aadd(self, namespace: str, key: str, value: str, ttl_seconds: Optional[float] = None) -> bool:
+        return await self._call(self.add, namespace, key, value, ttl_seconds)
+
+    async def adelete(self, namespace: str, key: str) -> None:
+        await self._call(self.delete, namespace, key)
+
+    async def aincr(self, namespace: str, key: str, amount: int = 1, ttl_seconds: Optional[float] = None) -> int:
+        return await self._call(self.incr, namespace, key, amount, ttl_seconds)
+
+
+class MemorySharedBackend(SharedBackend):
+    """Process-local backend, for a single worker"""
+
+    shared = False
+    blocking = False
+
+    def __init__(self):
+        self._entries: Dict[str, Dict[str, Tuple[str, Optional[float]]]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, namespace: str, key: str) -> Optional[Tuple[str, Optional[float]]]:
+        entries = self._entries.get(namespace, {})
+        entry = entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del entries[key]
+            return None
+        return entry
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._live(namespace, key)
+        return entry[0] if entry is not None else None
+
+    def set(self, namespace: str, key: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self._entries.setdefault(namespace, {})[key] = (value, _expires_at(ttl_seconds))
+
+    def add(self, namespace: str, key: str, value: str, ttl_seconds: Optional[float] = None) -> bool:
+        with self._lock:
+            if self._live(namespace, key) is not None:
+                return False
+            self._entries.setdefault(namespace, {})[key] = (value, _expires_at(ttl_seconds))
+            return True
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._entries.get(namespace, {}).pop(key, None)
+
+    def incr(self, namespace: str, key: str, amount: int = 1, ttl_seconds: Optional[float] = None) -> int:
+        with self._lock:
+            entry = self._live(namespace, key)
+            if entry is None:
+                value, expires_at = amount, _expires_at(ttl_seconds)
+            else:
+                value, expires_at = int(entry[0]) + amount, entry[1]
+            self._entries.setdefault(namespace, {})[key] = (str(value), expires_at)
+            return value
+
+    def scan(self, namespace: str) -> List[Tuple[str, str]]:
+        with self._lock:
+            items = []
+            for key in list(self._entries.get(namespace, {})):
+                entry = self._live(namespace, key)
+                if entry is not None:
+                    items.append((key, entry[0]))
+            return items
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": {namespace: len(entries) for namespace, entries in self._entries.items()}
+            }
+
+
+class SQLiteSharedBackend(SharedBackend):
+    """
+    SQLite file in WAL mode, shared by all worker processes on the host.
+    Read-modify-write operations run in IMMEDIATE transactions so they are
+    atomic across processes.
+    """
+
+    # Expired rows are purged after this many writes
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str, busy_timeout: float = SQLITE_BUSY_TIMEOUT_SECONDS):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_state ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._writes = 0
+
+    def _live_value(self, namespace: str, key: str) -> Optional[Tuple[str, Optional[float]]]:
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM shared_state WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return row
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """IMMEDIATE transaction: takes the write lock up front, so no other process interleaves"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _write(self, sql: str, params: tuple) -> None:
+        self._conn.execute(sql, params)
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._conn.execute("DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._live_value(namespace, key)
+        return row[0] if row is not None else None
+
+    def set(self, namespace: str, key: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self._write(
+                "INSERT OR REPLACE INTO shared_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, value, _expires_at(ttl_seconds))
+            )
+
+    def add(self, namespace: str, key: str, value: str, ttl_seconds: Optional[float] = None) -> bool:
+        with self._lock, self._transaction():
+            if self._live_value(namespace, key) is not None:
+                return False
+            self._write(
+                "INSERT OR REPLACE INTO shared_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, value, _expires_at(ttl_seconds))
+            )
+            return True
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._write("DELETE FROM shared_state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def incr(self, namespace: str, key: str, amount: int = 1, ttl_seconds: Optional[float] = None) -> int:
+        with self._lock, self._transaction():
+            row = self._live_value(namespace, key)
+            if row is None:
+                value, expires_at = amount, _expires_at(ttl_seconds)
+            else:
+                value, expires_at = int(row[0]) + amount, row[1]
+            self._write(
+                "INSERT OR REPLACE INTO shared_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, str(value), expires_at)
+            )
+            return value
+
+    def scan(self, namespace: str) -> List[Tuple[str, str]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, value FROM shared_state WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, time.time())
+            ).fetchall()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            rows = self._conn.execute("SELECT namespace, COUNT(*) FROM shared_state GROUP BY namespace").fetchall()
+        return {"backend": "sqlite", "path": self.path, "entries": dict(rows)}
+
+
+def build_shared_backend(spec: str = SHARED_BACKEND) -> SharedBackend:
+    """Backend for a SHARED_BACKEND value (memory, sqlite or package.module:factory)"""
+    if spec == "memory":
+        return MemorySharedBackend()
+    if spec == "sqlite":
+        path = os.getenv("SHARED_BACKEND_PATH", str(Path(__file__).parent / "shared_state.db"))
+        return SQLiteSharedBackend(path)
+    module_name, _, factory = spec.partition(":")
+    if not factory:
+        raise ValueError(f"Unknown SHARED_BACKEND '{spec}'. Use memory, sqlite or package.module:factory.")
+    return getattr(importlib.import_module(module_name), factory)()
+
+
+# Backend will be initialized lazily when needed
+_shared_backend = None
+
+def get_shared_backend() -> SharedBackend:
+    """Return the process-wide shared state backend"""
+    global _shared_backend
+    if _shared_backend is None:
+        _shared_backend = build_shared_backend()
+    return _shared_backend
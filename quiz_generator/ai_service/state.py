@@ -2,7 +2,8 @@
 LangGraph State Management with Pydantic Models
 Defines the typed state that flows through the LangGraph workflow.
 """
-from typing import List, Dict, Optional, Literal
+import operator
+from typing import Annotated, List, Dict, Optional, Literal
 from pydantic import BaseModel, Field
 from datetime import datetime
 
@@ -31,6 +32,24 @@ class StudentAnswer(BaseModel):
     answer: str = Field(..., pattern="^[ABCD]$", description="Student's answer (A, B, C, or D)")
 
 
+class OutcomeGenerationTask(BaseModel):
+    """Input of one fan-out branch: generate questions for a chunk of learning outcomes"""
+    course_name: Optional[str] = None
+    teacher_name: Optional[str] = None
+    student_name: Optional[str] = None
+    learning_outcomes: List[str]
+    questions_per_outcome: int = Field(..., ge=1)
+    attempt: int = 1
+
+
+class MCQBatch(BaseModel):
+    """Questions produced by one fan-out branch"""
+    learning_outcomes: List[str]
+    mcqs: List[MCQ] = Field(default_factory=list)
+    attempt: int = 1
+    error: Optional[str] = None
+
+
 class ExamState(BaseModel):
     """Main state object that flows through LangGraph nodes"""
     # Course setup (from Laravel)
@@ -41,10 +60,17 @@ class ExamState(BaseModel):
     passing_score: float = 70.0
     
     # MCQ Generation
+    generation_mode: Literal["single", "fanout"] = "single"
     mcqs: List[MCQ] = Field(default_factory=list)
     generation_status: Optional[Literal["pending", "completed", "failed"]] = None
     generation_error: Optional[str] = None
     
+    # Fan-out generation (one branch per chunk of outcomes, merged by reducer);
+    # pending_outcomes and generation_attempts also drive coverage repair
+    mcq_batches: Annotated[List[MCQBatch], operator.add] = Field(default_factory=list)
+    pending_outcomes: List[str] = Field(default_factory=list)
+    generation_attempts: int = 0
+    
     # Validation
     student_answers: List[StudentAnswer] = Field(default_factory=list)
     validation_status: Optional[Literal["pending", "valid", "invalid"]] = None
@@ -0,0 +1,105 @@
+"""
+Streaming Exam Generation
+Emits each question as a Server-Sent Event or NDJSON line as soon as the
+LLM has finished writing it, followed by a summary event with the exam
+validation result.
+"""
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+# Handle imports for both module and direct execution
+try:
+    from .state import ExamState, MCQ
+    from .nodes import astream_mcqs, MIN_QUESTIONS, MAX_QUESTIONS
+    from .parsing import IncrementalQuestionParser
+    from .cache import ExamCache
+except ImportError:
+    from state import ExamState, MCQ
+    from nodes import astream_mcqs, MIN_QUESTIONS, MAX_QUESTIONS
+    from parsing import IncrementalQuestionParser
+    from cache import ExamCache
+
+
+MEDIA_TYPES = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson"
+}
+
+
+def format_event(event: str, data: Dict[str, Any], fmt: str) -> str:
+    """Serializes one event as an SSE message or an NDJSON line"""
+    if fmt == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"type": event, "data": data}) + "\n"
+
+
+def exam_summary(mcqs: List[MCQ], learning_outcomes: List[str], errors: List[str]) -> Dict[str, Any]:
+    """Count and learning-outcome coverage checks for a streamed exam"""
+    covered = {mcq.learning_outcome for mcq in mcqs}
+    missing = [outcome for outcome in learning_outcomes if outcome not in covered]
+    
+    error = None
+    if len(mcqs) < MIN_QUESTIONS:
+        error = f"Expected at least {MIN_QUESTIONS} questions, but generated {len(mcqs)} questions"
+    elif len(mcqs) > MAX_QUESTIONS:
+        error = f"Expected at most {MAX_QUESTIONS} questions, but generated {len(mcqs)} questions"
+    elif missing:
+        error = (
+            f"Not all learning outcomes are covered. "
+            f"Covered: {len(learning_outcomes) - len(missing)}, Required: {len(learning_outcomes)}"
+        )
+    
+    return {
+        "success": error is None,
+        "total_questions": len(mcqs),
+        "covered_outcomes": len(learning_outcomes) - len(missing),
+        "required_outcomes": len(learning_outcomes),
+        "missing_outcomes": missing,
+        "invalid_questions": len(errors),
+        "parse_errors": errors,
+        "error": error
+    }
+
+
+async def stream_exam_generation(
+    state: ExamState,
+    fmt: str,
+    cache: Optional[ExamCache] = None,
+    cache_key: Optional[str] = None,
+    cached_mcqs: Optional[List[Dict[str, Any]]] = None,
+    store_exam: Optional[Callable[[List[MCQ]], Awaitable[str]]] = None
+) -> AsyncIterator[str]:
+    """
+    Yields "question" events while the exam is generated, then one "summary"
+    event ("error" if the LLM call fails). Cached exams are replayed directly;
+    successful generations are written back to the cache. store_exam persists
+    a valid exam and returns the exam_id reported in the summary.
+    """
+    if cached_mcqs is not None:
+        mcqs = [MCQ(**mcq) for mcq in cached_mcqs]
+        for mcq in mcqs:
+            yield format_event("question", mcq.model_dump(), fmt)
+        summary = exam_summary(mcqs, state.learning_outcomes, [])
+        summary["cached"] = True
+        if summary["success"] and store_exam is not None:
+            summary["exam_id"] = await store_exam(mcqs)
+        yield format_event("summary", summary, fmt)
+        return
+    
+    parser = IncrementalQuestionParser()
+    mcqs = []
+    try:
+        async for mcq in astream_mcqs(state, parser):
+            mcqs.append(mcq)
+            yield format_event("question", mcq.model_dump(), fmt)
+    except Exception as e:
+        yield format_event("error", {"success": False, "error": f"Exam generation failed: {str(e)}"}, fmt)
+        return
+    
+    summary = exam_summary(mcqs, state.learning_outcomes, parser.errors)
+    summary["cached"] = False
+    if summary["success"] and cache is not None and cache_key:
+        await cache.aset(cache_key, [mcq.model_dump() for mcq in mcqs])
+    if summary["success"] and store_exam is not None:
+        summary["exam_id"] = await store_exam(mcqs)
+    yield format_event("summary", summary, fmt)